@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+from pathlib import Path
+
+import numpy as np
+
+SOURCES = ["drums", "bass", "other", "vocals"]
+BENCH_MODEL = "bench"
+
+
+def prepare_environment(workdir: Path) -> None:
+    """
+    Points the service to workdir, must be called before importing
+    anything from lib since the configuration is read on import
+    """
+    workdir.mkdir(parents=True, exist_ok=True)
+    (workdir / "models").mkdir(exist_ok=True)
+    os.environ["DEMUCS_MODELS_DIR"] = str((workdir / "models").resolve())
+    # every run must separate, not hit the cache of the previous one
+    os.environ["DEMUCS_RESULT_CACHE_MB"] = "0"
+    os.environ["DEMUCS_STREAMING_MIN_SECONDS"] = "-1"
+    # demucs models are full pickles of the model class
+    os.environ.setdefault("TORCH_FORCE_NO_WEIGHTS_ONLY_LOAD", "1")
+    os.chdir(workdir)
+
+
+def save_random_model(channels: int = 16, depth: int = 4, seed: int = 0,
+                      **kwargs):
+    """
+    Saves a randomly initialized model with the shape of demucs as
+    models/bench.th, in the same format load_model expects. kwargs are
+    given to Demucs, e.g. segment_length
+    """
+    import torch
+    from lib.demucs.demucs.model import Demucs
+
+    torch.manual_seed(seed)
+    model = Demucs(SOURCES, channels=channels, depth=depth, **kwargs)
+    args, kwargs = model._init_args_kwargs
+    package = {
+        "klass": Demucs,
+        "args": args,
+        "kwargs": kwargs,
+        "state": model.state_dict(),
+        "training_args": argparse.Namespace(diffq=False, qat=False),
+    }
+    path = Path(os.environ["DEMUCS_MODELS_DIR"]) / f"{BENCH_MODEL}.th"
+    torch.save(package, path)
+    return path
+
+
+def synthetic_audio(seconds: float, samplerate: int = 44100, seed: int = 0):
+    """
+    Stereo mix of a few tones and noise as a [samples, 2] int16 array
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * samplerate)) / samplerate
+    mix = 0.3 * np.sin(2 * np.pi * 110 * t) + 0.2 * np.sin(2 * np.pi * 440 * t)
+    mix = mix + 0.05 * rng.standard_normal(len(t))
+    stereo = np.stack([mix, np.roll(mix, 100)], axis=1)
+    return (stereo * 2**15 * 0.5).astype(np.int16)
+
+
+def write_track(path: Path, seconds: float) -> Path:
+    from scipy.io import wavfile
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    wavfile.write(str(path), 44100, synthetic_audio(seconds))
+    return path
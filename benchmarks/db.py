@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+"""
+Download claims/sec on a downloads table of --rows rows: a lookup and an
+update opening a connection per query on the unindexed table (how the
+service used to claim a token) against claim_download's single
+UPDATE ... RETURNING on the connection pool and the migrated schema:
+
+    python -m benchmarks.db --rows 1000000 --claims 2000 --concurrency 8
+"""
+
+import argparse
+import random
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from lib.db import MIGRATIONS, ConnectionPool
+
+# what the service used to run for a download, each query on its own
+# connection
+LOOKUP = """
+SELECT song_path FROM downloads
+WHERE download_url=? AND accessed=False"""
+DISABLE = """
+UPDATE downloads SET accessed = True
+WHERE download_url = ?"""
+
+# the statement of lib.utils.claim_download
+CLAIM = """
+UPDATE downloads SET accessed = True
+WHERE download_url = ? AND accessed = False
+RETURNING song_path, song_name"""
+
+
+def fill(path: Path, rows: int, migrate: bool) -> None:
+    with sqlite3.connect(path) as db:
+        if migrate:
+            # the schema (and user_version) the service runs on
+            ConnectionPool(path, 1)._migrate(db)
+        else:
+            db.execute(MIGRATIONS[0])
+        db.executemany(
+            "INSERT INTO downloads (song_path, download_url, accessed) "
+            "VALUES (?, ?, False)",
+            ((f"separated/demucs/song{i}", f"token{i}") for i in range(rows))
+        )
+    db.close()
+
+
+def run_connect(path: Path, tokens, concurrency: int) -> float:
+    def claim(token):
+        with sqlite3.connect(path, timeout=30) as db:
+            found = db.execute(LOOKUP, (token,)).fetchone()
+        db.close()
+        if found:
+            with sqlite3.connect(path, timeout=30) as db:
+                db.execute(DISABLE, (token,))
+            db.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(claim, tokens))
+    return time.perf_counter() - start
+
+
+def run_pool(path: Path, tokens, concurrency: int) -> float:
+    pool = ConnectionPool(path, concurrency)
+    try:
+        pool.execute("SELECT 1")
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            list(executor.map(
+                lambda token: pool.execute(CLAIM, (token,)), tokens
+            ))
+        return time.perf_counter() - start
+    finally:
+        pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--claims", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    # every token is claimed once
+    tokens = [
+        f"token{i}" for i in random.sample(range(args.rows), args.claims)
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        unindexed = Path(tmp) / "unindexed.db"
+        indexed = Path(tmp) / "indexed.db"
+        fill(unindexed, args.rows, migrate=False)
+        fill(indexed, args.rows, migrate=True)
+
+        results = {
+            "connect per query, no index": run_connect(
+                unindexed, tokens, args.concurrency
+            ),
+            "claim on the pool, migrated": run_pool(
+                indexed, tokens, args.concurrency
+            ),
+        }
+    for name, elapsed in results.items():
+        print(
+            f"{name:>32}: {elapsed:8.2f}s "
+            f"{args.claims / elapsed:10.1f} claims/sec"
+        )
+
+
+if __name__ == "__main__":
+    main()
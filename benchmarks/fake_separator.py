@@ -0,0 +1,39 @@
+#!/usr/bin/python3
+"""
+Stand-in for DemucsService that needs no model weights, for the load tests:
+
+    DEMUCS_SEPARATOR=benchmarks.fake_separator:FakeSeparator python server.py
+
+Every split takes DEMUCS_FAKE_SEPARATE_SECONDS (1 by default) and writes
+DEMUCS_FAKE_STEM_SECONDS (30 by default) of synthetic audio per stem, so the
+downloads have the size of real stems.
+"""
+
+import os
+import time
+from pathlib import Path
+
+from benchmarks.common import SOURCES, write_track
+
+SEPARATE_SECONDS = float(os.environ.get("DEMUCS_FAKE_SEPARATE_SECONDS", "1"))
+STEM_SECONDS = float(os.environ.get("DEMUCS_FAKE_STEM_SECONDS", "30"))
+
+
+class FakeSeparator():
+
+    def __init__(self, model, device, output_format="wav", bitrate=None,
+                 stems=None, preset="standard"):
+        self.stems = stems or SOURCES
+        self.out = Path(f'separated/{model}')
+        self.out.mkdir(parents=True, exist_ok=True)
+
+    def split_song(self, track_path, seek_time=None, duration=None,
+                   name=None):
+        track = Path(track_path)
+        if not track.is_file():
+            raise FileNotFoundError(f"{track} doesn't exist")
+        name = name or track.stem
+        # sleeping releases the GIL as the torch kernels of the model do
+        time.sleep(SEPARATE_SECONDS)
+        for stem in self.stems:
+            write_track(self.out / name / f"{stem}.wav", STEM_SECONDS)
@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+"""
+Speedup of the fast inference mode against the eager model and the
+difference of their outputs on test signals:
+
+    python -m benchmarks.fast_inference --seconds 20
+    python -m benchmarks.fast_inference --model demucs \
+        --models-dir lib/demucs/models
+
+Without --model a randomly initialized model with the shape of demucs is
+used, its stems are meaningless but the cost of running it is the real one.
+The difference is reported as the max absolute error and the signal to
+noise ratio (dB) of every variant against the eager stems.
+"""
+
+import argparse
+import gc
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.common import (
+    BENCH_MODEL, prepare_environment, save_random_model, synthetic_audio
+)
+
+VARIANTS = [
+    ("int8", True), ("int8", False), ("bf16", True), ("fp32", True)
+]
+
+
+def signals(seconds: float, samplerate: int = 44100):
+    """
+    [channels, samples] float test signals: the tones and noise of the
+    other benchmarks, white noise and a frequency sweep
+    """
+    import torch
+
+    rng = np.random.default_rng(1)
+    length = int(seconds * samplerate)
+    t = np.arange(length) / samplerate
+    sweep = 0.5 * np.sin(2 * np.pi * (50 + 4000 * t / seconds) * t)
+    return {
+        "tones": torch.from_numpy(
+            synthetic_audio(seconds, samplerate).T / 2**15
+        ).float(),
+        "noise": torch.from_numpy(
+            0.1 * rng.standard_normal((2, length))
+        ).float(),
+        "sweep": torch.from_numpy(np.stack([sweep, sweep])).float(),
+    }
+
+
+def separate(model, wav, repeat: int):
+    """
+    Median seconds of apply_model(split=True) on wav and its output
+    """
+    import torch
+    from lib.demucs.demucs.utils import apply_model
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with torch.no_grad():
+            out = apply_model(model, wav, split=True)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings)), out
+
+
+def compare(reference, out) -> dict:
+    noise = (out - reference).pow(2).sum().item()
+    signal = reference.pow(2).sum().item()
+    return {
+        "max_abs_diff": (out - reference).abs().max().item(),
+        "snr_db": 10 * np.log10(signal / noise) if noise else float("inf"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--model", help="model of --models-dir to use"
+                        " instead of a random one")
+    parser.add_argument("--models-dir", type=Path)
+    parser.add_argument("--seconds", type=float, default=20,
+                        help="length of every test signal")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int,
+                        help="torch intra-op threads")
+    parser.add_argument("--json", type=Path, help="also write the results")
+    args = parser.parse_args()
+
+    models_dir = args.models_dir.resolve() if args.models_dir else None
+    json_path = args.json.resolve() if args.json else None
+    with tempfile.TemporaryDirectory() as tmp:
+        prepare_environment(Path(tmp))
+        if args.model:
+            os.environ["DEMUCS_MODELS_DIR"] = str(models_dir)
+        else:
+            # segments of 8 seconds, as apply_model(split=True) documents
+            save_random_model(
+                channels=64, depth=6, segment_length=8 * 44100
+            )
+
+        import torch
+        import lib.fast_inference as fast_inference
+        from lib.model_registry import registry
+
+        if args.threads:
+            torch.set_num_threads(args.threads)
+        model = registry.load(args.model or BENCH_MODEL, "cpu")
+        test_signals = signals(args.seconds)
+        warm_up = test_signals["tones"][..., :model.samplerate]
+        separate(model, warm_up, 1)
+        rows = []
+        references = {}
+        for name, wav in test_signals.items():
+            seconds, references[name] = separate(model, wav, args.repeat)
+            rows.append({
+                "signal": name, "variant": "eager", "seconds": seconds,
+                "speedup": 1.0, "max_abs_diff": 0.0, "snr_db": float("inf"),
+            })
+        eager_seconds = {row["signal"]: row["seconds"] for row in rows}
+        for precision, trace in VARIANTS:
+            fast = fast_inference.optimize(model, precision, trace)
+            variant = fast.precision + ("+trace" if trace else "")
+            # the first call initializes the traced graph
+            separate(fast, warm_up, 1)
+            for name, wav in test_signals.items():
+                seconds, out = separate(fast, wav, args.repeat)
+                rows.append({
+                    "signal": name, "variant": variant, "seconds": seconds,
+                    "speedup": eager_seconds[name] / seconds,
+                    **compare(references[name], out),
+                })
+            # the quantized copy of a full size model takes a few hundred
+            # MB, only one variant is kept at a time
+            del fast
+            gc.collect()
+        order = list(test_signals)
+        rows.sort(key=lambda row: order.index(row["signal"]))
+
+    print(
+        f"{'signal':>8} {'variant':>12} {'seconds':>9} {'speedup':>8} "
+        f"{'max diff':>10} {'SNR dB':>8}"
+    )
+    for row in rows:
+        print(
+            f"{row['signal']:>8} {row['variant']:>12} {row['seconds']:9.3f} "
+            f"{row['speedup']:7.2f}x {row['max_abs_diff']:10.2e} "
+            f"{row['snr_db']:8.1f}"
+        )
+    if json_path:
+        json_path.write_text(json.dumps(rows, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
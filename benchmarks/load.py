@@ -0,0 +1,371 @@
+#!/usr/bin/python3
+"""
+Drives /graphql and /download with concurrent clients and reports the
+throughput and the p50/p95/p99 latency of every kind of request:
+
+    python -m benchmarks.load --concurrency 16 --duration 60 \
+        --mix split=1,download=4,list=2
+
+Without --url a server is started on a temporary directory with the fake
+separator (benchmarks.fake_separator, no model weights needed), seeded with
+songs and download tokens. Against a running server (--url
+http://host:5000) the splits use --song, which must exist on it, and the
+downloads the tokens of the splits completed during the test.
+
+A split is measured from its submission until its job completes, as a
+client polling the job would see it.
+"""
+
+import argparse
+import json
+import math
+import os
+import queue
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import requests
+
+from benchmarks.common import SOURCES, write_track
+
+REPOSITORY = Path(__file__).resolve().parent.parent
+SEED_SONG = "seed"
+
+
+class Recorder():
+    """
+    Latencies and errors of every kind of request, shared by the clients
+    """
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+        self.skipped: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def ok(self, kind: str, seconds: float) -> None:
+        with self._lock:
+            self.latencies.setdefault(kind, []).append(seconds)
+
+    def error(self, kind: str, reason: str) -> None:
+        with self._lock:
+            errors = self.errors.setdefault(kind, {})
+            errors[reason] = errors.get(reason, 0) + 1
+
+    def skip(self, kind: str) -> None:
+        with self._lock:
+            self.skipped[kind] = self.skipped.get(kind, 0) + 1
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Nearest rank percentile of values
+    """
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class Client():
+
+    def __init__(
+        self,
+        url: str,
+        songs: List[str],
+        tokens: "queue.Queue[str]",
+        recorder: Recorder,
+        poll_interval: float
+    ):
+        self.url = url.rstrip("/")
+        self.songs = songs
+        self.tokens = tokens
+        self.recorder = recorder
+        self.poll_interval = poll_interval
+        self.session = requests.Session()
+
+    def graphql(self, query: str) -> dict:
+        response = self.session.post(
+            f"{self.url}/graphql", json={"query": query}, timeout=60
+        )
+        response.raise_for_status()
+        body = response.json()
+        if body.get("errors"):
+            raise RuntimeError(body["errors"][0].get("message"))
+        return body["data"]
+
+    def split(self) -> None:
+        start = time.perf_counter()
+        song = random.choice(self.songs)
+        job_id = self.graphql(f'{{ split(song: "{song}") }}')["split"]
+        if job_id.startswith("Unable"):
+            self.recorder.error("split", "rejected")
+            return
+        while True:
+            time.sleep(self.poll_interval)
+            job = self.graphql(
+                f'{{ job(id: "{job_id}") {{ state downloadToken }} }}'
+            )["job"]
+            if job["state"] == "failed":
+                self.recorder.error("split", "failed")
+                return
+            if job["state"] == "completed":
+                break
+        self.recorder.ok("split", time.perf_counter() - start)
+        self.tokens.put(job["downloadToken"])
+
+    def download(self) -> None:
+        try:
+            token = self.tokens.get_nowait()
+        except queue.Empty:
+            self.recorder.skip("download")
+            return
+        start = time.perf_counter()
+        with self.session.get(
+            f"{self.url}/download/{token}", stream=True, timeout=60
+        ) as response:
+            if response.status_code != 200:
+                self.recorder.error("download", str(response.status_code))
+                return
+            for _ in response.iter_content(64 * 1024):
+                pass
+        self.recorder.ok("download", time.perf_counter() - start)
+
+    def list(self) -> None:
+        start = time.perf_counter()
+        self.graphql("{ listSongs(limit: 100) }")
+        self.recorder.ok("list", time.perf_counter() - start)
+
+    def run(self, mix: Dict[str, float], deadline: float) -> None:
+        kinds = list(mix)
+        weights = [mix[kind] for kind in kinds]
+        while time.monotonic() < deadline:
+            kind = random.choices(kinds, weights)[0]
+            try:
+                getattr(self, kind)()
+            except Exception as e:
+                self.recorder.error(kind, type(e).__name__)
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for item in value.split(","):
+        kind, _, weight = item.partition("=")
+        if kind not in ("split", "download", "list"):
+            raise argparse.ArgumentTypeError(f"unknown request {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def seed(workdir: Path, songs: int, song_seconds: float, tokens: int):
+    """
+    Songs to split and download tokens of a separated song, written before
+    the server starts
+    """
+    from lib.db import ConnectionPool
+
+    names = [
+        str(write_track(
+            workdir / "songs" / f"load{i}.wav", song_seconds
+        ).relative_to(workdir))
+        for i in range(songs)
+    ]
+    stems = Path("separated") / "demucs" / SEED_SONG
+    for source in SOURCES:
+        write_track(workdir / stems / f"{source}.wav", song_seconds)
+    pool = ConnectionPool(workdir / "models" / "database.db", 1)
+    try:
+        with pool.connection() as connection:
+            connection.executemany(
+                "INSERT INTO downloads "
+                "(song_path, download_url, accessed, created_at) "
+                "VALUES (?, ?, False, strftime('%s', 'now'))",
+                ((str(stems), f"seed{i}") for i in range(tokens))
+            )
+    finally:
+        pool.close()
+    return names, [f"seed{i}" for i in range(tokens)]
+
+
+def start_server(
+    workdir: Path, port: int, production: bool
+) -> subprocess.Popen:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [str(REPOSITORY), env.get("PYTHONPATH")])
+    )
+    env.setdefault(
+        "DEMUCS_SEPARATOR", "benchmarks.fake_separator:FakeSeparator"
+    )
+    if production:
+        env["DEMUCS_SERVER_BIND"] = f"127.0.0.1:{port}"
+        command = [
+            sys.executable, "-m", "gunicorn",
+            "-c", str(REPOSITORY / "gunicorn.conf.py"), "wsgi:application"
+        ]
+    else:
+        command = [
+            sys.executable, "-c",
+            "import server; "
+            f"server.app.run(host='127.0.0.1', port={port}, threaded=True)"
+        ]
+    server = subprocess.Popen(
+        command,
+        cwd=workdir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The server exited while starting")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/metrics", timeout=1)
+            return server
+        except requests.RequestException:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("The server didn't start in 60 seconds")
+
+
+def run(
+    url: str,
+    songs: List[str],
+    tokens: List[str],
+    mix: Dict[str, float],
+    concurrency: int,
+    duration: float,
+    poll_interval: float
+) -> Recorder:
+    recorder = Recorder()
+    token_queue: "queue.Queue[str]" = queue.Queue()
+    for token in tokens:
+        token_queue.put(token)
+    deadline = time.monotonic() + duration
+    clients = [
+        threading.Thread(
+            target=Client(
+                url, songs, token_queue, recorder, poll_interval
+            ).run,
+            args=(mix, deadline)
+        )
+        for _ in range(concurrency)
+    ]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    return recorder
+
+
+def report(recorder: Recorder, elapsed: float) -> List[dict]:
+    rows = []
+    for kind in sorted(set(recorder.latencies) | set(recorder.errors)):
+        latencies = recorder.latencies.get(kind, [])
+        errors = recorder.errors.get(kind, {})
+        row = {
+            "request": kind,
+            "ok": len(latencies),
+            "errors": sum(errors.values()),
+            "error_reasons": errors,
+            "skipped": recorder.skipped.get(kind, 0),
+            "throughput": len(latencies) / elapsed,
+        }
+        for q in (50, 95, 99):
+            row[f"p{q}"] = percentile(latencies, q) if latencies else None
+        rows.append(row)
+    print(
+        f"{'request':>10} {'ok':>7} {'errors':>7} {'req/s':>8} "
+        f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    )
+    for row in rows:
+        latencies = " ".join(
+            f"{row[p] * 1000:9.1f}" if row[p] is not None else f"{'-':>9}"
+            for p in ("p50", "p95", "p99")
+        )
+        print(
+            f"{row['request']:>10} {row['ok']:7d} {row['errors']:7d} "
+            f"{row['throughput']:8.2f} {latencies}"
+        )
+        if row["error_reasons"]:
+            print(f"{'':>10} errors: {row['error_reasons']}")
+        if row["skipped"]:
+            print(f"{'':>10} {row['skipped']} skipped, no token left")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--url", help="server to test, a local server with"
+                        " the fake separator is started by default")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="clients sending requests in a loop")
+    parser.add_argument("--duration", type=float, default=30,
+                        help="seconds of the test")
+    parser.add_argument("--mix", type=parse_mix,
+                        default=parse_mix("split=1,download=4,list=2"),
+                        help="relative weight of every request")
+    parser.add_argument("--song", action="append",
+                        help="song split against --url, can be repeated")
+    parser.add_argument("--songs", type=int, default=4,
+                        help="songs seeded on the local server")
+    parser.add_argument("--song-seconds", type=float, default=30)
+    parser.add_argument("--tokens", type=int, default=10000,
+                        help="download tokens seeded on the local server")
+    parser.add_argument("--poll-interval", type=float, default=0.2,
+                        help="seconds between two queries of a split job")
+    parser.add_argument("--production", action="store_true",
+                        help="start the local server with gunicorn instead"
+                        " of the development server")
+    parser.add_argument("--json", type=Path, help="also write the results")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server: Optional[subprocess.Popen] = None
+        url = args.url
+        songs = args.song or []
+        tokens: List[str] = []
+        if url is None:
+            songs, tokens = seed(
+                Path(tmp), args.songs, args.song_seconds, args.tokens
+            )
+            port = free_port()
+            server = start_server(Path(tmp), port, args.production)
+            url = f"http://127.0.0.1:{port}"
+        elif "split" in args.mix and not songs:
+            parser.error("--song is required to split against --url")
+        try:
+            start = time.monotonic()
+            recorder = run(
+                url, songs, tokens, args.mix, args.concurrency,
+                args.duration, args.poll_interval
+            )
+            elapsed = time.monotonic() - start
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    rows = report(recorder, elapsed)
+    if args.json:
+        args.json.write_text(json.dumps(rows, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
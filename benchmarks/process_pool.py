@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+"""
+Compares the songs/hour of separating concurrently on threads of a single
+process (how the server executes splits by default) against the pool of
+processes pinned to their own cores:
+
+    python -m benchmarks.process_pool --songs 16 --concurrency 4 \
+        --workers 4 --threads 2
+"""
+
+import argparse
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from benchmarks.common import (
+    BENCH_MODEL, prepare_environment, save_random_model, write_track
+)
+
+
+def run_threads(tracks, concurrency: int) -> float:
+    from lib.demucs_service import DemucsService
+
+    def split(track):
+        DemucsService(BENCH_MODEL, "cpu").split_song(track)
+
+    # the model is loaded once, as the registry does in the server
+    DemucsService(BENCH_MODEL, "cpu")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(split, tracks))
+    return time.perf_counter() - start
+
+
+def run_processes(tracks, workers: int, threads: int, pin: bool) -> float:
+    from lib.process_pool import ProcessPool
+
+    pool = ProcessPool(workers, threads, pin=pin)
+    try:
+        # one split per worker to spawn them and load the model
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(
+                lambda track: pool.split_song(BENCH_MODEL, "cpu", track),
+                tracks[:workers]
+            ))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(
+                lambda track: pool.split_song(BENCH_MODEL, "cpu", track),
+                tracks
+            ))
+        return time.perf_counter() - start
+    finally:
+        pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--songs", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="concurrent splits in thread mode")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=1,
+                        help="torch threads per worker process")
+    parser.add_argument("--no-pin", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        prepare_environment(Path(tmp))
+        save_random_model()
+        tracks = [
+            str(write_track(Path("songs") / f"song{i}.wav", args.seconds))
+            for i in range(args.songs)
+        ]
+
+        results = {
+            f"threads x{args.concurrency}": run_threads(
+                tracks, args.concurrency
+            ),
+            f"processes {args.workers}x{args.threads} threads": run_processes(
+                tracks, args.workers, args.threads, not args.no_pin
+            ),
+        }
+    for name, elapsed in results.items():
+        print(
+            f"{name:>32}: {elapsed:8.2f}s "
+            f"{args.songs / elapsed * 3600:10.1f} songs/hour"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+#!/usr/bin/python3
+"""
+Wall time and peak memory of the hot paths of the service at several input
+sizes, compared against a stored baseline:
+
+    python -m benchmarks.suite
+    python -m benchmarks.suite --cases split_song,stream_zip --repeat 5
+    python -m benchmarks.suite --save-baseline
+
+Every case runs in a fresh process so its peak memory isn't hidden by the
+cases before it. The exit status is 1 when a case is slower or uses more
+memory than the baseline by more than the threshold.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from benchmarks.common import (
+    BENCH_MODEL, SOURCES, prepare_environment, save_random_model, write_track
+)
+
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+
+# differences below these are noise, whatever the relative change
+MIN_SECONDS = 0.005
+MIN_PEAK_MB = 2.0
+
+# queries of every run of the db cases and runs of every case, set by
+# measure in the process of the case
+DB_OPERATIONS = 1000
+REPEAT = 3
+
+
+def setup_split_song(seconds: float) -> Callable[[int], None]:
+    from lib.demucs_service import DemucsService
+
+    track = str(write_track(Path("songs") / f"split-{seconds}.wav", seconds))
+    # the model is loaded once, as the registry does in the server
+    service = DemucsService(BENCH_MODEL, "cpu")
+    return lambda _: service.split_song(track)
+
+
+def setup_split_excerpt(seconds: float) -> Callable[[int], None]:
+    # the excerpt of split (it used to be cut by trim_song) is decoded
+    # straight from the middle of a long track
+    from lib.demucs_service import DemucsService
+
+    track = str(write_track(Path("songs") / "excerpt.wav", 120 + seconds))
+    service = DemucsService(BENCH_MODEL, "cpu")
+    return lambda _: service.split_song(
+        track, seek_time=60, duration=seconds, name=f"excerpt-{seconds}"
+    )
+
+
+def _stems(seconds: float) -> str:
+    song = f"stems-{seconds}"
+    for source in SOURCES:
+        write_track(
+            Path("separated") / BENCH_MODEL / song / f"{source}.wav", seconds
+        )
+    return song
+
+
+def setup_stream_zip(seconds: float) -> Callable[[int], None]:
+    import lib.utils as utils
+
+    song = Path("separated") / BENCH_MODEL / _stems(seconds)
+
+    def run(_):
+        for _ in utils.stream_zip(song, song.name):
+            pass
+
+    return run
+
+
+def _fill_downloads(rows: int, extra_tokens: int = 0) -> None:
+    import lib.db as db
+
+    with db.pool.connection() as connection:
+        connection.executemany(
+            "INSERT INTO downloads "
+            "(song_path, download_url, accessed, created_at) "
+            "VALUES (?, ?, False, strftime('%s', 'now'))",
+            (
+                (f"separated/{BENCH_MODEL}/song{i}", f"token{i}")
+                for i in range(rows + extra_tokens)
+            )
+        )
+
+
+def setup_db_create(rows: int) -> Callable[[int], None]:
+    import lib.utils as utils
+
+    _fill_downloads(rows)
+
+    def run(repeat):
+        for i in range(DB_OPERATIONS):
+            utils.create_new_download(
+                f"separated/{BENCH_MODEL}/new{i}", f"new{repeat}-{i}"
+            )
+
+    return run
+
+
+def setup_db_claim(rows: int) -> Callable[[int], None]:
+    import lib.utils as utils
+
+    # every repeat claims tokens that weren't claimed before
+    _fill_downloads(rows, DB_OPERATIONS * REPEAT)
+
+    def run(repeat):
+        for i in range(DB_OPERATIONS):
+            utils.claim_download(f"token{rows + repeat * DB_OPERATIONS + i}")
+
+    return run
+
+
+# case -> (setup returning the measured function of the repeat index,
+# sizes, quick sizes, unit of the sizes)
+CASES: Dict[str, tuple] = {
+    "split_song": (setup_split_song, [5, 15, 30, 600], [5], "s of audio"),
+    "split_excerpt": (setup_split_excerpt, [5, 15, 30], [5], "s excerpt"),
+    "stream_zip": (setup_stream_zip, [30, 120, 300], [30], "s stems"),
+    "db_create": (setup_db_create, [1000, 100000, 1000000], [1000], "rows"),
+    "db_claim": (setup_db_claim, [1000, 100000, 1000000], [1000], "rows"),
+}
+
+
+def _status_kb(field: str) -> Optional[int]:
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak() -> bool:
+    # writing 5 to clear_refs resets VmHWM (linux >= 4.0)
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _max_rss_kb() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes everywhere else
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def measure(case: str, size: float, repeat: int, db_operations: int) -> dict:
+    """
+    Runs case at size repeat times in this process, returns the median wall
+    time and the peak memory above what the setup left allocated
+    """
+    global DB_OPERATIONS, REPEAT
+    DB_OPERATIONS, REPEAT = db_operations, repeat
+    os.environ["DEMUCS_DOWNLOAD_DB"] = f"bench-{case}-{size}.db"
+    setup = CASES[case][0]
+    run = setup(size)
+
+    timings = []
+    peak_kb = 0
+    for i in range(repeat):
+        if _reset_peak():
+            before = _status_kb("VmRSS")
+        else:
+            before = _max_rss_kb()
+        start = time.perf_counter()
+        run(i)
+        timings.append(time.perf_counter() - start)
+        after = _status_kb("VmHWM") or _max_rss_kb()
+        peak_kb = max(peak_kb, after - before)
+    return {
+        "seconds": statistics.median(timings),
+        "peak_mb": peak_kb / 1024,
+    }
+
+
+def compare(
+    results: Dict[str, dict],
+    baseline: Dict[str, dict],
+    threshold: float,
+    memory_threshold: float
+) -> Dict[str, str]:
+    """
+    Regressions of results against baseline, as the case and the reason
+    """
+    regressions = {}
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        reasons = []
+        seconds = result["seconds"] - base["seconds"]
+        if seconds > max(base["seconds"] * threshold, MIN_SECONDS):
+            reasons.append(
+                f"{result['seconds']:.3f}s vs {base['seconds']:.3f}s"
+            )
+        peak = result["peak_mb"] - base["peak_mb"]
+        if peak > max(base["peak_mb"] * memory_threshold, MIN_PEAK_MB):
+            reasons.append(
+                f"{result['peak_mb']:.1f}MB vs {base['peak_mb']:.1f}MB"
+            )
+        if reasons:
+            regressions[key] = ", ".join(reasons)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--cases", default=",".join(CASES),
+                        help="comma separated cases to run")
+    parser.add_argument("--quick", action="store_true",
+                        help="only the smallest size of every case")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--db-operations", type=int, default=1000,
+                        help="queries of every run of the db cases")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed relative increase of the wall time")
+    parser.add_argument("--memory-threshold", type=float, default=0.25,
+                        help="allowed relative increase of the peak memory")
+    args = parser.parse_args()
+
+    cases = [case for case in args.cases.split(",") if case]
+    unknown = set(cases) - CASES.keys()
+    if unknown:
+        parser.error(f"unknown cases {', '.join(sorted(unknown))}")
+    baseline_path = args.baseline.resolve()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        # the processes of the cases inherit the environment and the
+        # working directory
+        prepare_environment(Path(tmp))
+        save_random_model()
+        context = multiprocessing.get_context("spawn")
+        for case in cases:
+            _, sizes, quick_sizes, unit = CASES[case]
+            for size in quick_sizes if args.quick else sizes:
+                pool = context.Pool(1)
+                try:
+                    result = pool.apply(
+                        measure,
+                        (case, size, args.repeat, args.db_operations)
+                    )
+                finally:
+                    pool.close()
+                    pool.join()
+                key = f"{case}/{size}"
+                results[key] = result
+                print(
+                    f"{case:>14} {size:>8} {unit:<11}"
+                    f"{result['seconds']:10.3f}s {result['peak_mb']:9.1f}MB",
+                    flush=True
+                )
+
+    if args.save_baseline:
+        baseline = {}
+        if baseline_path.is_file():
+            baseline = json.loads(baseline_path.read_text())
+        baseline.update(results)
+        baseline_path.write_text(
+            json.dumps(baseline, indent=2, sort_keys=True) + "\n"
+        )
+        print(f"Baseline saved to {baseline_path}")
+        return
+
+    if not baseline_path.is_file():
+        print(f"No baseline at {baseline_path}, run with --save-baseline")
+        return
+    regressions = compare(
+        results,
+        json.loads(baseline_path.read_text()),
+        args.threshold,
+        args.memory_threshold
+    )
+    for key, reason in regressions.items():
+        print(f"REGRESSION {key}: {reason}")
+    if regressions:
+        sys.exit(1)
+    print("No regression against the baseline")
+
+
+if __name__ == "__main__":
+    main()
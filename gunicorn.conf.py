@@ -0,0 +1,30 @@
+#!/usr/bin/python3
+"""
+Production settings of gunicorn, read from the server settings of
+lib/config.py:
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+"""
+
+# config is a setting of gunicorn
+import lib.config as demucs_config
+
+bind = demucs_config.SERVER_BIND
+workers = demucs_config.SERVER_WORKERS
+# every request has its own thread, a split only holds it while it is
+# queued and a slow download while the zip is sent
+worker_class = "gthread"
+threads = demucs_config.SERVER_THREADS
+# gthread workers keep notifying the arbiter while their requests run, the
+# timeout only catches stuck workers
+timeout = demucs_config.SERVER_TIMEOUT
+graceful_timeout = demucs_config.SERVER_TIMEOUT
+keepalive = 5
+
+
+def post_worker_init(worker):
+    # the janitor must run in the process of the splits, it leaves their
+    # songs and stems alone
+    if demucs_config.JANITOR_INTERVAL_SECONDS > 0:
+        from lib.janitor import janitor
+        janitor.start(demucs_config.JANITOR_INTERVAL_SECONDS)
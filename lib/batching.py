@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Tuple
+
+import torch
+
+import lib.config as config
+import lib.metrics as metrics
+import lib.progress as progress
+from lib.demucs.demucs.utils import TensorChunk, center_trim
+
+BATCH_SIZE = metrics.histogram(
+    "demucs_batch_size", "Segments run through the model in one batch",
+    buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+
+
+class BatchScheduler():
+    """
+    Runs the segments submitted by every song being separated through the
+    model in batches of up to max_batch, waiting at most max_wait seconds
+    for a batch to fill up
+    """
+
+    def __init__(self, model, max_batch: int, max_wait: float):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: "queue.Queue" = queue.Queue()
+        self._closed = False
+        self._close_lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._loop, name="demucs-batching", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, padded: torch.Tensor) -> Future:
+        """
+        Queues a [channels, samples] input already padded to a valid length
+        """
+        future: Future = Future()
+        with self._close_lock:
+            if not self._closed:
+                self._queue.put((padded, future))
+                return future
+        # the scheduler was replaced (the model was loaded again) while songs
+        # were still separating with it, they run their segments themselves
+        self._run([(padded, future)])
+        return future
+
+    def forward(self, chunk: TensorChunk) -> torch.Tensor:
+        return self.collect(chunk, self.submit(self.pad(chunk)))
+
+    def pad(self, chunk: TensorChunk) -> torch.Tensor:
+        return chunk.padded(self.model.valid_length(chunk.length))
+
+    @staticmethod
+    def collect(chunk: TensorChunk, future: Future) -> torch.Tensor:
+        return center_trim(future.result(), chunk.length)
+
+    def close(self) -> None:
+        """
+        The segments already queued still run, later ones run in the
+        thread that submits them
+        """
+        with self._close_lock:
+            self._closed = True
+            self._queue.put(None)
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self) -> None:
+        # the None queued by close comes after every segment queued before
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            # only inputs of the same length can be stacked, that is every
+            # segment but the last one of each song
+            groups: Dict[Tuple, list] = {}
+            for padded, future in batch:
+                groups.setdefault(tuple(padded.shape), []).append(
+                    (padded, future)
+                )
+            for group in groups.values():
+                self._run(group)
+
+    def _run(self, group) -> None:
+        BATCH_SIZE.observe(len(group))
+        try:
+            with torch.no_grad():
+                out = self.model(torch.stack([padded for padded, _ in group]))
+            for (_, future), result in zip(group, out):
+                future.set_result(result)
+        except Exception as e:
+            logging.error(f"Batch of {len(group)} segments failed: {e}")
+            for _, future in group:
+                future.set_exception(e)
+
+
+def apply_batched(scheduler: BatchScheduler, mix: torch.Tensor,
+                  overlap: float = 0.25) -> torch.Tensor:
+    """
+    apply_model(split=True) with every segment of mix submitted upfront to
+    the scheduler, so they can be batched with each other and with the
+    segments of other songs
+    """
+    model = scheduler.model
+    channels, length = mix.shape
+    out = torch.zeros(len(model.sources), channels, length, device=mix.device)
+    sum_weight = torch.zeros(length, device=mix.device)
+    segment = model.segment_length
+    stride = int((1 - overlap) * segment)
+    weight = torch.cat([torch.arange(1, segment // 2 + 1),
+                        torch.arange(segment - segment // 2, 0, -1)])
+    weight = (weight / weight.max()).to(mix.device)
+
+    pending = []
+    for offset in range(0, length, stride):
+        chunk = TensorChunk(mix, offset, segment)
+        pending.append((offset, chunk, scheduler.submit(scheduler.pad(chunk))))
+    for offset, chunk, future in pending:
+        chunk_out = scheduler.collect(chunk, future)
+        progress.advance()
+        chunk_length = chunk_out.shape[-1]
+        out[..., offset:offset + segment] += weight[:chunk_length] * chunk_out
+        sum_weight[offset:offset + segment] += weight[:chunk_length]
+    out /= sum_weight
+    return out
+
+
+_schedulers: Dict[Tuple[str, str], BatchScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(name: str, device: str, model) -> BatchScheduler:
+    """
+    One scheduler per (model, device) shared by all the songs, it is
+    replaced when the registry loaded the model again after an eviction
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.get((name, device))
+        if scheduler is None or scheduler.model is not model:
+            if scheduler is not None:
+                scheduler.close()
+            scheduler = BatchScheduler(
+                model, config.BATCH_MAX_SIZE, config.BATCH_MAX_WAIT_MS / 1000
+            )
+            _schedulers[(name, device)] = scheduler
+        return scheduler
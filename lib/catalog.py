@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+
+import logging
+import threading
+from pathlib import Path
+from typing import List, Optional, Set, Tuple
+
+import lib.db as db
+import lib.utils as utils
+
+# entries returned by a list query when it doesn't set a limit, and the
+# most it can ask for
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+SORT_COLUMNS = {"name": "name", "modified": "modified_at"}
+
+# the greatest code point, every name starting with a prefix sorts before
+# prefix + LAST_CHAR
+LAST_CHAR = "\U0010ffff"
+
+
+class Catalog():
+    """
+    Index of the songs in songs/ and the stems in separated/<model>/, so
+    listing them doesn't scan the directories. It is updated as songs are
+    downloaded, separated and removed, reconcile brings it in line with
+    the disk for whatever changed behind its back
+    """
+
+    def __init__(self, pool: db.ConnectionPool):
+        self.pool = pool
+        self._reconciled: Set[str] = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _folder(path: Path) -> str:
+        # the same folder can be reached through relative and absolute
+        # paths (pytube returns absolute ones)
+        return str(Path(path).resolve())
+
+    def add(self, path: Path) -> None:
+        path = Path(path)
+        self.pool.execute(
+            "INSERT OR REPLACE INTO catalog (folder, name, modified_at) "
+            "VALUES (?, ?, ?)",
+            (self._folder(path.parent), path.name, path.stat().st_mtime)
+        )
+
+    def remove(self, path: Path) -> None:
+        path = Path(path)
+        self.pool.execute(
+            "DELETE FROM catalog WHERE folder = ? AND name = ?",
+            (self._folder(path.parent), path.name)
+        )
+
+    def reconcile(self, folder: Path) -> Tuple[int, int]:
+        """
+        Indexes what is in folder and forgets what is no longer there,
+        returns the number of entries added and removed
+        """
+        key = self._folder(folder)
+        folder = Path(folder)
+        on_disk = {}
+        if folder.is_dir():
+            for entry in utils.list_songs(folder):
+                try:
+                    on_disk[entry.name] = entry.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+        with self.pool.connection() as connection:
+            indexed = {
+                row[0] for row in connection.execute(
+                    "SELECT name FROM catalog WHERE folder = ?",
+                    (key,)
+                )
+            }
+            connection.executemany(
+                "INSERT OR REPLACE INTO catalog (folder, name, modified_at) "
+                "VALUES (?, ?, ?)",
+                [(key, name, mtime) for name, mtime in on_disk.items()]
+            )
+            removed = indexed - on_disk.keys()
+            connection.executemany(
+                "DELETE FROM catalog WHERE folder = ? AND name = ?",
+                [(key, name) for name in removed]
+            )
+        added = len(on_disk.keys() - indexed)
+        with self._lock:
+            self._reconciled.add(key)
+        if added or removed:
+            logging.info(
+                f"Catalog of {folder}: {added} added, {len(removed)} removed"
+            )
+        return added, len(removed)
+
+    def reconcile_all(self) -> None:
+        """
+        Reconciles every folder that was ever listed
+        """
+        folders = {
+            row[0] for row in
+            self.pool.execute("SELECT DISTINCT folder FROM catalog")
+        }
+        with self._lock:
+            folders.update(self._reconciled)
+        for folder in sorted(folders):
+            self.reconcile(Path(folder))
+
+    def list(
+        self,
+        folder: Path,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        prefix: Optional[str] = None,
+        search: Optional[str] = None,
+        sort_by: str = "name",
+        descending: bool = False
+    ) -> List[str]:
+        """
+        One page of the paths in folder, optionally only the names starting
+        with prefix or containing search (case insensitive)
+        """
+        if sort_by not in SORT_COLUMNS:
+            raise ValueError(
+                f"Unsupported sort {sort_by}, "
+                f"use one of {', '.join(SORT_COLUMNS)}"
+            )
+        limit = DEFAULT_LIMIT if limit is None else limit
+        if not 0 <= limit <= MAX_LIMIT or offset < 0:
+            raise ValueError(
+                f"limit must be between 0 and {MAX_LIMIT} and offset "
+                "can't be negative"
+            )
+        folder = Path(folder)
+        key = self._folder(folder)
+        with self._lock:
+            reconciled = key in self._reconciled
+        if not reconciled:
+            # the first listing after a restart indexes what is already
+            # on disk
+            self.reconcile(folder)
+
+        query = "SELECT name FROM catalog WHERE folder = ?"
+        parameters: list = [key]
+        if prefix:
+            # a range on the primary key instead of LIKE, which can't use
+            # the index
+            query += " AND name >= ? AND name < ?"
+            parameters += [prefix, prefix + LAST_CHAR]
+        if search:
+            query += " AND instr(lower(name), lower(?)) > 0"
+            parameters.append(search)
+        order = "DESC" if descending else "ASC"
+        query += f" ORDER BY {SORT_COLUMNS[sort_by]} {order}, name {order}"
+        query += " LIMIT ? OFFSET ?"
+        parameters += [limit, offset]
+        return [
+            str(folder / row[0])
+            for row in self.pool.execute(query, parameters)
+        ]
+
+
+catalog = Catalog(db.pool)
@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+
+import os
+
+
+def _env_list(name, default=""):
+    value = os.environ.get(name, default)
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+# Directory that holds the pretrained <model>.th files
+MODELS_DIR = os.environ.get("DEMUCS_MODELS_DIR", "lib/demucs/models")
+
+# Memory budget (in MB) for the loaded models kept by the model registry,
+# when it is exceeded the least recently used models are evicted.
+MODEL_CACHE_MB = int(os.environ.get("DEMUCS_MODEL_CACHE_MB", "2048"))
+
+# "fast" runs the models under inference_mode, quantized to FAST_PRECISION
+# ("int8" dynamic quantization of the LSTM and linear layers, "bf16" where
+# the CPU supports it natively or "fp32") and traced with TorchScript when
+# FAST_TRACE is 1. The fast models are cached next to the eager ones.
+INFERENCE = os.environ.get("DEMUCS_INFERENCE", "eager")
+FAST_PRECISION = os.environ.get("DEMUCS_FAST_PRECISION", "int8")
+FAST_TRACE = os.environ.get("DEMUCS_FAST_TRACE", "0") == "1"
+
+# Models loaded (and warmed up) when server.py starts, e.g. "demucs,tasnet"
+PRELOAD_MODELS = _env_list("DEMUCS_PRELOAD_MODELS")
+PRELOAD_DEVICE = os.environ.get("DEMUCS_PRELOAD_DEVICE", "cpu")
+
+# Split jobs run in a bounded pool of worker threads, requests beyond
+# JOB_MAX_PENDING (queued + running) jobs are rejected.
+JOB_WORKERS = int(os.environ.get("DEMUCS_JOB_WORKERS", "2"))
+JOB_MAX_PENDING = int(os.environ.get("DEMUCS_JOB_MAX_PENDING", "32"))
+# Number of jobs remembered so clients can query their state
+JOB_HISTORY = int(os.environ.get("DEMUCS_JOB_HISTORY", "1000"))
+
+# Separated stems are cached by content under RESULT_CACHE_DIR, the oldest
+# entries are evicted past RESULT_CACHE_MB. 0 disables the cache.
+RESULT_CACHE_DIR = os.environ.get(
+    "DEMUCS_RESULT_CACHE_DIR", "separated/.cache"
+)
+RESULT_CACHE_MB = int(os.environ.get("DEMUCS_RESULT_CACHE_MB", "10240"))
+# Stems of separations that never finished (the worker crashed) are kept
+# aside in RESULT_CACHE_DIR until nothing was written to them for this long
+RESULT_CACHE_STALE_HOURS = float(
+    os.environ.get("DEMUCS_RESULT_CACHE_STALE_HOURS", "6")
+)
+
+# Tracks of at least STREAMING_MIN_SECONDS are separated segment by segment
+# with constant memory instead of being loaded whole. -1 disables streaming.
+STREAMING_MIN_SECONDS = float(
+    os.environ.get("DEMUCS_STREAMING_MIN_SECONDS", "600")
+)
+
+# Segments of the songs being separated at the same time are run through the
+# model in batches of up to BATCH_MAX_SIZE, waiting at most BATCH_MAX_WAIT_MS
+# for a batch to fill up. 1 disables batching.
+BATCH_MAX_SIZE = int(os.environ.get("DEMUCS_BATCH_MAX_SIZE", "1"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("DEMUCS_BATCH_MAX_WAIT_MS", "10"))
+
+# "thread" runs the separation on the job threads, "process" sends it to a
+# pool of PROCESS_WORKERS processes using PROCESS_THREADS torch threads each,
+# optionally pinned to their own cores.
+EXECUTION_MODE = os.environ.get("DEMUCS_EXECUTION_MODE", "thread")
+PROCESS_WORKERS = int(os.environ.get("DEMUCS_PROCESS_WORKERS", "2"))
+PROCESS_THREADS = int(os.environ.get("DEMUCS_PROCESS_THREADS", "1"))
+PROCESS_INTEROP_THREADS = int(
+    os.environ.get("DEMUCS_PROCESS_INTEROP_THREADS", "1")
+)
+PROCESS_PIN_CPUS = os.environ.get("DEMUCS_PROCESS_PIN_CPUS", "0") == "1"
+
+# "module:Class" used instead of DemucsService to separate the songs, with
+# the same constructor and split_song, e.g. the fake separator of the load
+# tests "benchmarks.fake_separator:FakeSeparator". Empty uses demucs.
+SEPARATOR = os.environ.get("DEMUCS_SEPARATOR", "")
+
+# Seconds of separation per second of audio assumed by estimateSplit until
+# the splits of the server measured it, for the standard preset
+ESTIMATE_COST_PER_SECOND = float(
+    os.environ.get("DEMUCS_ESTIMATE_COST_PER_SECOND", "0.5")
+)
+
+# Stems of a song are encoded concurrently by up to ENCODER_WORKERS encoders
+ENCODER_WORKERS = int(os.environ.get("DEMUCS_ENCODER_WORKERS", "4"))
+
+# SQLite database of the service, its schema is created and migrated on the
+# first connection
+DOWNLOAD_DB = os.environ.get("DEMUCS_DOWNLOAD_DB", "models/database.db")
+DB_POOL_SIZE = int(os.environ.get("DEMUCS_DB_POOL_SIZE", "8"))
+
+# Audio downloaded from youtube is cached by video id under INGEST_CACHE_DIR,
+# entries older than INGEST_CACHE_TTL_HOURS are downloaded again and the
+# least recently used ones are evicted past INGEST_CACHE_MB. 0 disables it.
+INGEST_CACHE_DIR = os.environ.get("DEMUCS_INGEST_CACHE_DIR", "songs/.cache")
+INGEST_CACHE_MB = int(os.environ.get("DEMUCS_INGEST_CACHE_MB", "5120"))
+INGEST_CACHE_TTL_HOURS = float(
+    os.environ.get("DEMUCS_INGEST_CACHE_TTL_HOURS", "168")
+)
+
+# Unclaimed download tokens keep their stems from being cleaned up for
+# DOWNLOAD_TOKEN_TTL_HOURS
+DOWNLOAD_TOKEN_TTL_HOURS = float(
+    os.environ.get("DEMUCS_DOWNLOAD_TOKEN_TTL_HOURS", "24")
+)
+
+# The janitor removes the songs, stems and zips older than their TTL and
+# then the oldest ones past their quota every JANITOR_INTERVAL_SECONDS.
+# 0 disables a TTL or a quota, JANITOR_INTERVAL_SECONDS 0 the background
+# janitor of server.py (python -m lib.janitor still sweeps once).
+JANITOR_INTERVAL_SECONDS = float(
+    os.environ.get("DEMUCS_JANITOR_INTERVAL_SECONDS", "600")
+)
+SONGS_TTL_HOURS = float(os.environ.get("DEMUCS_SONGS_TTL_HOURS", "72"))
+SONGS_MAX_MB = int(os.environ.get("DEMUCS_SONGS_MAX_MB", "10240"))
+SEPARATED_TTL_HOURS = float(
+    os.environ.get("DEMUCS_SEPARATED_TTL_HOURS", "72")
+)
+SEPARATED_MAX_MB = int(os.environ.get("DEMUCS_SEPARATED_MAX_MB", "20480"))
+# zips are streamed and no longer written to downloads/, its policy only
+# cleans up the zips left by the versions that did
+DOWNLOADS_TTL_HOURS = float(
+    os.environ.get("DEMUCS_DOWNLOADS_TTL_HOURS", "24")
+)
+DOWNLOADS_MAX_MB = int(os.environ.get("DEMUCS_DOWNLOADS_MAX_MB", "5120"))
+
+# Splits can ask to be profiled (profile argument or X-Demucs-Profile
+# header) only when PROFILING is 1, the profiles are written to
+# PROFILES_DIR/<job id>
+PROFILING = os.environ.get("DEMUCS_PROFILING", "0") == "1"
+PROFILES_DIR = os.environ.get("DEMUCS_PROFILES_DIR", "profiles")
+
+# Production server (gunicorn -c gunicorn.conf.py wsgi:application), every
+# worker process has SERVER_THREADS threads. The jobs and the janitor live
+# in the worker that runs them, so keep a single worker and use the process
+# execution mode to separate on several cores.
+SERVER_BIND = os.environ.get("DEMUCS_SERVER_BIND", "0.0.0.0:5000")
+SERVER_WORKERS = int(os.environ.get("DEMUCS_SERVER_WORKERS", "1"))
+SERVER_THREADS = int(os.environ.get("DEMUCS_SERVER_THREADS", "16"))
+SERVER_TIMEOUT = int(os.environ.get("DEMUCS_SERVER_TIMEOUT", "120"))
+# Downloads streamed at the same time, beyond it /download answers 503 so
+# slow clients can't take every server thread. 0 disables the limit.
+MAX_DOWNLOADS = int(os.environ.get("DEMUCS_MAX_DOWNLOADS", "8"))
+# Job event streams followed at the same time, every one holds a server
+# thread until its job is done. Beyond it /jobs/<id>/events answers 503,
+# 0 disables the limit.
+MAX_EVENT_STREAMS = int(os.environ.get("DEMUCS_MAX_EVENT_STREAMS", "4"))
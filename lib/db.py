@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+
+import logging
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List
+
+import lib.config as config
+
+# Every entry upgrades the schema by one version (stored as the sqlite
+# user_version), new migrations must be appended at the end.
+MIGRATIONS = [
+    """
+CREATE TABLE IF NOT EXISTS downloads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    song_path TEXT,
+    download_url TEXT,
+    accessed BOOLEAN
+)""",
+    """
+CREATE INDEX IF NOT EXISTS downloads_download_url
+ON downloads (download_url)""",
+    """
+CREATE TABLE IF NOT EXISTS ingest_cache (
+    video_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (video_id, kind)
+)""",
+    "ALTER TABLE downloads ADD COLUMN created_at REAL",
+    # the tokens created before the column existed expire as if they had
+    # been created by the migration
+    """
+UPDATE downloads SET created_at = strftime('%s', 'now')
+WHERE created_at IS NULL""",
+    """
+CREATE TABLE IF NOT EXISTS catalog (
+    folder TEXT NOT NULL,
+    name TEXT NOT NULL,
+    modified_at REAL NOT NULL,
+    PRIMARY KEY (folder, name)
+)""",
+    """
+CREATE INDEX IF NOT EXISTS catalog_modified_at
+ON catalog (folder, modified_at)""",
+    # name of the song the stems come from, the folder of a split carries
+    # the id of the split
+    "ALTER TABLE downloads ADD COLUMN song_name TEXT",
+]
+
+
+class ConnectionPool():
+
+    def __init__(self, path: Path, size: int):
+        self.path = Path(path)
+        self.size = size
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._migrated = False
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(
+            self.path, timeout=30, check_same_thread=False
+        )
+        # readers don't block the writer (and the other way around) and
+        # commits don't wait for an fsync of the whole database
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _migrate(self, db: sqlite3.Connection) -> None:
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+        for number, migration in enumerate(
+            MIGRATIONS[version:], start=version + 1
+        ):
+            logging.info(f"Migrating {self.path} to version {number}")
+            db.execute(migration)
+            db.execute(f"PRAGMA user_version = {number}")
+            db.commit()
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                db = self._connect()
+                if not self._migrated:
+                    self._migrate(db)
+                    self._migrated = True
+                self._created += 1
+                return db
+        return self._idle.get(timeout=30)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrows a connection, the transaction is committed when the block
+        finishes and rolled back if it raises
+        """
+        db = self._acquire()
+        try:
+            yield db
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            self._idle.put(db)
+
+    def execute(self, query: str, parameters=()) -> List[tuple]:
+        with self.connection() as db:
+            return db.execute(query, parameters).fetchall()
+
+    def close(self) -> None:
+        """
+        Closes the idle connections
+        """
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+                self._created -= 1
+
+
+pool = ConnectionPool(Path(config.DOWNLOAD_DB), config.DB_POOL_SIZE)
@@ -1,92 +1,323 @@
 #!/usr/bin/python3
 
-import sys
-
-from lib.demucs import demucs
-from lib.demucs.demucs import model
+import contextlib
+import functools
+import lib.batching as batching
+import lib.config as config
+import lib.encoders as encoders
+import lib.fast_inference as fast_inference
+import lib.metrics as metrics
+import lib.profiling as profiling
+import lib.progress as progress
+import lib.streaming as streaming
+import logging
+import torch
 from lib.demucs.demucs.audio import AudioFile
-from lib.demucs.demucs.utils import apply_model, load_model
+from lib.demucs.demucs.utils import apply_model
+from lib.model_registry import registry
+from lib.presets import DEFAULT_PRESET, PRESETS, check_preset
+from lib.result_cache import finish_key, make_key, result_cache
+from lib.stems import SOURCES, check_stems, select as select_stems
 from pathlib import Path
-from scipy.io import wavfile
 
 
-# within the demucs directory
-sys.modules['demucs.model'] = model
-sys.modules['demucs'] = demucs
+class _TimedWriter():
+    """
+    Stem writer whose writes and close are timed by timer, the stems are
+    written while the segments are separated
+    """
+
+    def __init__(self, writer, timer: metrics.Timer):
+        self.writer = writer
+        self.timer = timer
+
+    def write(self, source) -> None:
+        with self.timer.time():
+            self.writer.write(source)
+
+    def close(self) -> None:
+        with self.timer.time():
+            self.writer.close()
 
 
 class DemucsService():
 
-    def __init__(self, model, device):
+    def __init__(self, model, device, output_format="wav", bitrate=None,
+                 stems=None, inference=None, preset=DEFAULT_PRESET):
         # This will require all the parameters to build and split the song.
 
         # Get from the arguments the model that we want to use,
         # by default demucs
-        self.model_path = f"lib/demucs/models/{model}.th"
+        self.model_name = model
 
         # Get the device that we want to use to split the song, by default cpu
         self.device = device  # it can be cuda if NVIDIA available
 
+        # quality/latency trade-off of the request, see lib/presets.py
+        self.preset = check_preset(preset)
+
         # Number of random shifts for equivariant stabilization.
         # Increase separation time but improves quality for Demucs. 10 was used
-        self.shifts = 0
+        self.shifts = self.preset.shifts
+
+        # Overlap of the segments the song is split in
+        self.overlap = self.preset.overlap
 
         # Apply the model to the entire input at once rather than
         # first splitting it in chunks of 10 seconds
         self.split = True
 
-        # This hack is to be able to load a pickled class from
-        self.model = load_model(self.model_path)
+        # "eager" or "fast" (quantized and traced, see
+        # lib/fast_inference.py), the one of the preset or DEMUCS_INFERENCE
+        # by default
+        self.inference = inference or self.preset.inference or \
+            config.INFERENCE
+        fast_inference.check_inference(self.inference)
+
+        # Models are shared across requests through the registry, so
+        # only the first request for (model, device) pays the loading cost
+        self.model = registry.get(model, device, self.inference)
 
         # default location for the service
         self.out = Path(f'separated/{model}')
         self.out.mkdir(parents=True, exist_ok=True)
         # default tracks:
-        self.source_names = ["drums", "bass", "other", "vocals"]
+        self.source_names = list(SOURCES)
+        # stems written for the request, every source when None, see
+        # lib/stems.py
+        self.stems = check_stems(stems)
 
-        self.mp3_bitrate = 320
+        # stems are written as wav, flac, mp3 or opus, bitrate (kbps) is
+        # used by the lossy formats
+        encoders.check_format(output_format)
+        self.output_format = output_format
+        self.mp3_bitrate = bitrate or encoders.DEFAULT_BITRATES["mp3"]
+        self.opus_bitrate = bitrate or encoders.DEFAULT_BITRATES["opus"]
 
-    """
-    def encode_mp3(wav, path, bitrate=320, verbose=False):
-        try:
-            import lameenc
-        except ImportError:
-            print("Failed to call lame encoder. Maybe it is not installed? "
-                "On windows, run `python.exe -m pip install -U lameenc`, "
-                "on OSX/Linux, run `python3 -m pip install -U lameenc`, "
-                "then try again.", file=sys.stderr)
-            sys.exit(1)
-        encoder = lameenc.Encoder()
-        encoder.set_bit_rate(bitrate)
-        encoder.set_in_sample_rate(44100)
-        encoder.set_channels(2)
-        encoder.set_quality(2)  # 2-highest, 7-fastest
-        if not verbose:
-            encoder.silence()
-        mp3_data = encoder.encode(wav.tostring())
-        mp3_data += encoder.flush()
-        with open(path, "wb") as f:
-            f.write(mp3_data)
-    """
+    @property
+    def bitrate(self):
+        if self.output_format == "mp3":
+            return self.mp3_bitrate
+        if self.output_format == "opus":
+            return self.opus_bitrate
+        return None
 
-    def split_song(self, track_path):
+    @property
+    def output_names(self):
+        return self.stems or self.source_names
+
+    def _cache_params(self, **params):
+        if self.stems is not None:
+            # the keys of the separations of every source don't change
+            params["stems"] = self.stems
+        if self.overlap != PRESETS[DEFAULT_PRESET].overlap:
+            params["overlap"] = self.overlap
+        if self.inference != "eager":
+            # the fast models produce slightly different stems
+            params["inference"] = self.inference
+            params["precision"] = self.model.precision
+        return dict(
+            model=self.model_name,
+            shifts=self.shifts,
+            output_format=self.output_format,
+            bitrate=self.bitrate,
+            **params
+        )
+
+    def _scheduler(self):
+        # shifts run every segment several times with a random offset,
+        # those are left to apply_model
+        if config.BATCH_MAX_SIZE <= 1 or self.shifts:
+            return None
+        name = self.model_name
+        if self.inference != "eager":
+            name = f"{name}:{self.inference}"
+        return batching.get_scheduler(name, self.device, self.model)
+
+    def _inference_mode(self):
+        # the fast models already run under inference_mode, the tensors
+        # around them (overlap-add buffers, shifts) are created under it too
+        if self.inference == "eager":
+            return contextlib.nullcontext()
+        return torch.inference_mode()
+
+    def split_song(self, track_path, seek_time=None, duration=None,
+                   name=None):
+        # seek_time and duration (seconds) select the excerpt to separate,
+        # only that range is decoded. The stems are written to name, the
+        # track name by default. Returns the seconds of audio separated,
+        # None when the stems came from the cache
         track = Path(track_path)
-        wav = AudioFile(track).read(
-            streams=0, samplerate=44100, channels=2).to(self.device)
-        wav = (wav * 2**15).round() / 2**15
-        ref = wav.mean(0)
-        wav = (wav - ref.mean()) / ref.std()
-        sources = apply_model(self.model, wav, shifts=self.shifts,
-                              split=self.split, progress=True)
-        sources = sources * ref.std() + ref.mean()
-
-        track_folder = self.out / track.name.replace(track.suffix, '')
+        name = name or track.name.replace(track.suffix, '')
+        track_folder = self.out / name
+        audio = AudioFile(track)
+        length = audio.duration - (seek_time or 0)
+        if duration is not None:
+            length = min(length, duration)
+        if 0 <= config.STREAMING_MIN_SECONDS <= length:
+            cached = self.split_song_streaming(
+                track, track_folder, seek_time, duration
+            )
+            return None if cached else length
+        progress.stage("decode")
+        with metrics.stage("decode"):
+            wav = audio.read(
+                seek_time=seek_time, duration=duration,
+                streams=0, samplerate=44100, channels=2).to(self.device)
+        # the same audio separated with the same parameters always produces
+        # the same stems, so they are only computed once
+        key = make_key(wav, **self._cache_params(split=self.split))
+        # _separate takes the only reference to the track, so it is freed
+        # as soon as it has been separated
+        tracks = [wav]
+        del wav
+        cached = result_cache.fetch_or_compute(
+            key, track_folder, lambda folder: self._separate(
+                tracks.pop(), folder
+            )
+        )
+        return None if cached else length
+
+    def split_song_streaming(self, track, track_folder, seek_time=None,
+                             duration=None):
+        # long tracks are decoded twice rather than held in memory, first to
+        # get the normalization statistics and the cache key and then to
+        # separate them segment by segment
+        def blocks():
+            return streaming.read_blocks(
+                track, seek_time=seek_time, duration=duration
+            )
+
+        progress.stage("scan")
+        with metrics.stage("scan"):
+            stats, digest = streaming.scan(blocks())
+        key = finish_key(digest, **self._cache_params(streaming=True))
+        return result_cache.fetch_or_compute(
+            key, track_folder,
+            lambda folder: self._separate_streaming(
+                blocks, stats.count, stats.mean, stats.std, folder
+            )
+        )
+
+    def _stream_writer(self, track_folder, name, samples):
+        path = track_folder / f"{name}.{self.output_format}"
+        if self.output_format == "wav":
+            return streaming.WavWriter(path, samples)
+        return encoders.StreamEncoder(path, self.output_format, self.bitrate)
+
+    def _separate_streaming(self, blocks, samples, mean, std, track_folder,
+                            stage="stream_separate"):
+        track_folder.mkdir(exist_ok=True)
+        # writing the stems is reported as the encode stage, not as part
+        # of the separation it is interleaved with
+        encode = metrics.Timer("encode")
+        with encode.time():
+            writers = [
+                _TimedWriter(
+                    self._stream_writer(track_folder, name, samples), encode
+                )
+                for name in self.output_names
+            ]
+        scheduler = self._scheduler()
+        progress.stage(
+            "separate",
+            progress.chunks(samples, self.model.segment_length, self.overlap)
+        )
+        error = None
+        try:
+            # decoding, the model and the writers are interleaved
+            with metrics.stage(stage, exclude=encode), \
+                    profiling.torch_profile(), self._inference_mode():
+                streaming.separate_stream(
+                    self.model,
+                    (b.to(self.device) for b in blocks()),
+                    mean,
+                    std,
+                    writers,
+                    shifts=self.shifts,
+                    overlap=self.overlap,
+                    forward=scheduler.forward if scheduler else None,
+                    select=lambda sources: select_stems(
+                        sources, self.source_names, self.stems, inplace=True
+                    )
+                )
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            # every writer is closed, a failed one must not leave the
+            # others' encoders running, and the error of the separation
+            # wins over the ones of the writers it interrupted
+            first = None
+            for name, writer in zip(self.output_names, writers):
+                try:
+                    writer.close()
+                except Exception as e:
+                    logging.warning(f"Writing the {name} stem failed: {e}")
+                    first = first or e
+            encode.observe()
+            if first is not None and error is None:
+                raise first
+
+    def _separate(self, wav, track_folder):
+        # every step works in place on wav or on the output of the model,
+        # a 10 minutes track is 200MB and its 4 sources 850MB, so no other
+        # full length copy is ever made
+        progress.stage("normalize")
+        with metrics.stage("normalize"):
+            wav.mul_(2**15).round_().div_(2**15)
+            ref = wav.mean(0)
+            mean, std = ref.mean().item(), ref.std().item()
+            del ref
+        scheduler = self._scheduler()
+        if self.split and not scheduler:
+            # the segments are separated one after the other, as for the
+            # long tracks, so the stems are written as soon as they are
+            # final while the next segments run and the sources are never
+            # held for the whole track
+            self._separate_streaming(
+                functools.partial(wav.split, self.model.segment_length, -1),
+                wav.shape[-1], mean, std, track_folder, stage="separate"
+            )
+            return
+        # the batched segments are all submitted upfront, the stems are
+        # written once the whole output is there
+        with metrics.stage("normalize"):
+            wav.sub_(mean).div_(std)
+        chunks = progress.chunks(
+            wav.shape[-1], self.model.segment_length, self.overlap
+        ) if self.split else 1
+        progress.stage("separate", chunks * max(self.shifts, 1))
+        with metrics.stage("separate"), profiling.torch_profile(), \
+                self._inference_mode():
+            if scheduler and self.split:
+                sources = batching.apply_batched(scheduler, wav, self.overlap)
+            else:
+                # the chunks are counted as the model runs, instead of the
+                # progress bar apply_model prints
+                sources = apply_model(progress.counting(self.model), wav,
+                                      shifts=self.shifts, split=self.split,
+                                      overlap=self.overlap)
+            del wav
+            # the output of the fast models is an inference tensor, it can
+            # only be updated in place under the inference mode
+            sources.mul_(std).add_(mean)
+
         track_folder.mkdir(exist_ok=True)
-        for source, name in zip(sources, self.source_names):
-            source = (source * 2**15).clamp_(-2**15, 2**15 - 1).short()
-            source = source.cpu().transpose(0, 1).numpy()
-            # I can't install lameenc so I'm skipping mp3 for now
-            # stem = str(track_folder / name)
-            # self.encode_mp3(source, stem + ".mp3", self.mp3_bitrate)
-            wavname = str(track_folder / f"{name}.wav")
-            wavfile.write(wavname, 44100, source)
+        progress.stage("encode")
+        with metrics.stage("encode"):
+            # the stems are summed and converted in place, the inference
+            # tensors of the fast models too
+            with self._inference_mode():
+                selected = select_stems(
+                    sources, self.source_names, self.stems, inplace=True
+                )
+                del sources
+                stems = {
+                    name: encoders.to_pcm16(source, inplace=True)
+                    for source, name in zip(selected, self.output_names)
+                }
+                del selected
+            encoders.encode_stems(
+                stems, track_folder, self.output_format, self.bitrate
+            )
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+
+import subprocess as sp
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+from scipy.io import wavfile
+
+import lib.config as config
+
+FORMATS = ["wav", "flac", "mp3", "opus"]
+
+# kbps used when the request doesn't set a bitrate
+DEFAULT_BITRATES = {"mp3": 320, "opus": 160}
+
+_CODECS = {
+    "flac": ["-c:a", "flac"],
+    "mp3": ["-c:a", "libmp3lame"],
+    "opus": ["-c:a", "libopus"],
+}
+
+# encoders are ffmpeg processes, the threads only feed them and wait
+encoder_pool = ThreadPoolExecutor(
+    max_workers=config.ENCODER_WORKERS, thread_name_prefix="demucs-encoder"
+)
+
+
+def check_format(output_format: str) -> None:
+    if output_format not in FORMATS:
+        raise ValueError(
+            f"Unsupported output format {output_format}, "
+            f"use one of {', '.join(FORMATS)}"
+        )
+
+
+def to_pcm16(source: torch.Tensor, inplace: bool = False) -> np.ndarray:
+    """
+    [channels, samples] float source to the contiguous [samples, channels]
+    int16 layout written to the stems. The samples are converted and
+    interleaved in a single copy, with inplace source is also scaled in
+    place instead of in a float copy (and can't be used afterwards)
+    """
+    if inplace:
+        source = source.mul_(2**15)
+    else:
+        source = source * 2**15
+    source.clamp_(-2**15, 2**15 - 1)
+    pcm = torch.empty(source.shape[::-1], dtype=torch.int16)
+    # float to int16 truncates, like .short()
+    pcm.copy_(source.t())
+    return pcm.numpy()
+
+
+def ffmpeg_command(
+    path: Path,
+    output_format: str,
+    bitrate: Optional[int],
+    samplerate: int = 44100,
+    channels: int = 2
+) -> List[str]:
+    command = [
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 's16le', '-ar', str(samplerate), '-ac', str(channels),
+        '-i', '-'
+    ]
+    command += _CODECS[output_format]
+    if output_format in DEFAULT_BITRATES:
+        bitrate = bitrate or DEFAULT_BITRATES[output_format]
+        command += ['-b:a', f'{bitrate}k']
+    return command + [str(path)]
+
+
+def encode_stem(
+    pcm: np.ndarray,
+    path: Path,
+    output_format: str,
+    bitrate: Optional[int] = None,
+    samplerate: int = 44100
+) -> Path:
+    """
+    Writes a [samples, channels] int16 stem to path in output_format
+    """
+    if output_format == "wav":
+        wavfile.write(str(path), samplerate, pcm)
+        return path
+    sp.run(
+        ffmpeg_command(path, output_format, bitrate, samplerate, pcm.shape[1]),
+        # a byte view of the samples, tobytes() would copy the whole stem
+        input=memoryview(np.ascontiguousarray(pcm)).cast("B"),
+        check=True
+    )
+    return path
+
+
+def encode_stems(
+    stems: Dict[str, np.ndarray],
+    folder: Path,
+    output_format: str,
+    bitrate: Optional[int] = None
+) -> List[Path]:
+    """
+    Encodes every stem concurrently as folder/<name>.<output_format>
+    """
+    futures = [
+        encoder_pool.submit(
+            encode_stem, pcm, folder / f"{name}.{output_format}",
+            output_format, bitrate
+        )
+        for name, pcm in stems.items()
+    ]
+    return [future.result() for future in futures]
+
+
+class StreamEncoder():
+    """
+    Incremental writer for the streaming separation, the stem is piped
+    into an ffmpeg process as it is produced
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        output_format: str,
+        bitrate: Optional[int] = None,
+        samplerate: int = 44100,
+        channels: int = 2
+    ):
+        self._proc = sp.Popen(
+            ffmpeg_command(path, output_format, bitrate, samplerate, channels),
+            stdin=sp.PIPE
+        )
+
+    def write(self, source: torch.Tensor) -> None:
+        self._proc.stdin.write(to_pcm16(source, inplace=True))
+
+    def close(self) -> None:
+        self._proc.stdin.close()
+        if self._proc.wait() != 0:
+            raise sp.CalledProcessError(self._proc.returncode, "ffmpeg")
@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+
+import math
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import lib.config as config
+import lib.metrics as metrics
+import lib.utils as utils
+from lib.demucs.demucs.audio import AudioFile
+from lib.presets import DEFAULT_PRESET, check_preset
+
+
+class CostModel():
+    """
+    Seconds of separation per second of audio of every (model, device,
+    preset), measured on the splits of this server as an exponential
+    moving average
+    """
+
+    def __init__(self, default_cost: float, smoothing: float = 0.2):
+        # used until the standard preset of a model has been measured
+        self.default_cost = default_cost
+        self.smoothing = smoothing
+        self._costs: Dict[Tuple[str, str, str], float] = {}
+        # wall time of a split, to estimate the wait behind the jobs
+        # already queued
+        self._split_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _average(self, previous: Optional[float], value: float) -> float:
+        if previous is None:
+            return value
+        return previous + self.smoothing * (value - previous)
+
+    def record(self, model: str, device: str, preset: str,
+               audio_seconds: float, seconds: float) -> None:
+        if audio_seconds <= 0:
+            return
+        key = (model, device, preset)
+        with self._lock:
+            self._costs[key] = self._average(
+                self._costs.get(key), seconds / audio_seconds
+            )
+            self._split_seconds = self._average(self._split_seconds, seconds)
+
+    def cost(self, model: str, device: str, preset: str) -> Tuple[float, bool]:
+        """
+        Seconds per second of audio and whether it was measured, presets
+        that weren't are extrapolated from the standard one
+        """
+        with self._lock:
+            measured = self._costs.get((model, device, preset))
+            if measured is not None:
+                return measured, True
+            standard = self._costs.get((model, device, DEFAULT_PRESET))
+        if standard is None:
+            standard = self.default_cost
+        relative = check_preset(preset).relative_cost / \
+            check_preset(DEFAULT_PRESET).relative_cost
+        return standard * relative, False
+
+    def estimate(self, audio_seconds: float, model: str, device: str,
+                 preset: str, pending: int, workers: int) -> dict:
+        """
+        Run time of a split of audio_seconds and the time it would wait
+        for a worker behind the pending (queued and running) jobs
+        """
+        cost, measured = self.cost(model, device, preset)
+        run_seconds = cost * audio_seconds
+        with self._lock:
+            split_seconds = self._split_seconds
+        # the jobs beyond the free workers run in waves of `workers` jobs
+        # taking about as long as the recent splits
+        waves = math.ceil(max(pending - workers + 1, 0) / max(workers, 1))
+        queue_seconds = waves * (split_seconds or run_seconds)
+        return {
+            "audio_seconds": audio_seconds,
+            "cost_per_second": cost,
+            "measured": measured,
+            "run_seconds": run_seconds,
+            "queue_seconds": queue_seconds,
+            "total_seconds": queue_seconds + run_seconds,
+        }
+
+    def costs(self):
+        with self._lock:
+            return list(self._costs.items())
+
+
+def track_seconds(
+    song: str,
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None
+) -> float:
+    """
+    Seconds of song a split with start_time and end_time separates
+    """
+    if not Path(song).is_file():
+        raise FileNotFoundError(f"{song} doesn't exist")
+    length = AudioFile(Path(song)).duration
+    if start_time and end_time:
+        seek_time, duration = utils.trim_window(start_time, end_time)
+        length = max(min(length - seek_time, duration), 0)
+    return length
+
+
+cost_model = CostModel(config.ESTIMATE_COST_PER_SECOND)
+
+metrics.callback(
+    "demucs_separation_cost",
+    "Measured seconds of separation per second of audio",
+    lambda: [
+        ({"model": model, "device": device, "preset": preset}, cost)
+        for (model, device, preset), cost in cost_model.costs()
+    ]
+)
@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+
+import contextlib
+import logging
+
+import torch
+
+# int8: dynamic quantization of the LSTM and linear layers, bf16: autocast
+# of the convolutions (only where the CPU supports it natively), fp32: the
+# weights as they were trained. They can't be combined, the quantized LSTM
+# only takes float32 inputs.
+PRECISIONS = ["int8", "bf16", "fp32"]
+INFERENCES = ["eager", "fast"]
+
+
+def check_inference(inference: str) -> None:
+    if inference not in INFERENCES:
+        raise ValueError(
+            f"Unsupported inference {inference}, "
+            f"use one of {', '.join(INFERENCES)}"
+        )
+
+
+def bf16_supported() -> bool:
+    # autocast runs anywhere but is slower than float32 without native
+    # bfloat16 instructions (avx512_bf16, amx)
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+class FastModel():
+    """
+    model run under inference_mode, quantized or in bfloat16, through a
+    TorchScript trace for the [channels, samples] of the segments
+    apply_model feeds it and eagerly for the other inputs (the last segment
+    of a song). Everything else is forwarded to the original model.
+    """
+
+    def __init__(self, model, module, precision: str, traced=None,
+                 traced_shape=None):
+        self._model = model
+        self._module = module
+        self.precision = precision
+        self._traced = traced
+        self._traced_shape = traced_shape
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+    def state_dict(self):
+        # the weights actually run, quantized ones included
+        return self._module.state_dict()
+
+    def _autocast(self):
+        if self.precision == "bf16":
+            return torch.autocast("cpu", dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+
+    def __call__(self, mix):
+        with torch.inference_mode(), self._autocast():
+            if self._traced is not None and \
+                    mix.shape[1:] == self._traced_shape:
+                out = self._traced(mix)
+            else:
+                out = self._module(mix)
+        return out.float()
+
+
+def optimize(model, precision: str, trace: bool = True) -> FastModel:
+    """
+    Fast version of an eval() model loaded on the cpu, the original model
+    is left untouched
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(
+            f"Unsupported precision {precision}, "
+            f"use one of {', '.join(PRECISIONS)}"
+        )
+    if precision == "bf16" and not bf16_supported():
+        logging.warning("This CPU has no native bfloat16, using float32")
+        precision = "fp32"
+    module = model
+    if precision == "int8":
+        module = torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.LSTM, torch.nn.Linear}, dtype=torch.qint8
+        )
+    traced = traced_shape = None
+    if trace:
+        traced_shape = (
+            model.audio_channels, model.valid_length(model.segment_length)
+        )
+        example = torch.zeros((1,) + traced_shape)
+        try:
+            with torch.no_grad():
+                traced = torch.jit.freeze(torch.jit.trace(
+                    module.eval(), example, check_trace=False
+                ))
+        except Exception as e:
+            # the eager module is as correct, only a bit slower
+            logging.warning(f"Unable to trace the model, running it: {e}")
+            traced = traced_shape = None
+    return FastModel(model, module, precision, traced, traced_shape)
@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+import pytube
+
+import lib.config as config
+import lib.db as db
+import lib.metrics as metrics
+
+INGESTED_BYTES = metrics.counter(
+    "demucs_ingested_bytes_total", "Bytes of audio downloaded from youtube"
+)
+
+
+def timed_download(
+    download: Callable[..., Optional[str]], url: str, folder: Path
+) -> Optional[str]:
+    with metrics.stage("download"):
+        filename = download(url, folder)
+    if filename:
+        INGESTED_BYTES.inc(Path(filename).stat().st_size)
+    else:
+        metrics.ERRORS.inc(stage="download")
+    return filename
+
+
+def video_id(url: str) -> Optional[str]:
+    """
+    Normalized id of a youtube url, every form of the url of a video
+    (youtu.be, watch?v=, extra query parameters...) has the same id
+    """
+    try:
+        return pytube.extract.video_id(url)
+    except pytube.exceptions.RegexMatchError:
+        return None
+
+
+class IngestCache():
+    """
+    Audio downloaded from youtube, keyed by video id and kind (e.g. the
+    audio stream or its mp3 conversion), the metadata is kept in the
+    service DB
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        max_bytes: int,
+        ttl_seconds: float,
+        pool: db.ConnectionPool
+    ):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.pool = pool
+        self.hits = 0
+        self.misses = 0
+        # (video id, kind) -> event set once its download finished
+        self._inflight: Dict[Tuple[str, str], threading.Event] = {}
+        # downloads finished so far, the lookups run outside the lock and
+        # a download finishing meanwhile must not be missed
+        self._finished = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def fetch(
+        self,
+        url: str,
+        kind: str,
+        download: Callable[..., Optional[str]],
+        destination: Path = Path('songs')
+    ) -> Optional[str]:
+        """
+        Places the audio of url in destination, downloading it with
+        download(url, folder) only if it isn't cached yet. Concurrent calls
+        for the same video wait for a single download.
+        Returns the filename in destination or None if the download failed
+        """
+        vid = video_id(url)
+        if not self.enabled or vid is None:
+            return timed_download(download, url, destination)
+
+        key = (vid, kind)
+        while True:
+            with self._lock:
+                finished = self._finished
+            cached = self._lookup(vid, kind)
+            if cached is not None:
+                try:
+                    target = self._materialize(vid, cached, destination)
+                except FileNotFoundError:
+                    # evicted (by another request or process) after the
+                    # lookup, the next lookup misses and downloads it again
+                    logging.info(f"{cached} was evicted, fetching it again")
+                    continue
+                with self._lock:
+                    self.hits += 1
+                logging.info(f"Ingest cache hit for {vid} ({kind})")
+                return target
+            with self._lock:
+                # a download finished since the lookup, its row may be
+                # there now
+                if self._finished != finished:
+                    continue
+                event = self._inflight.get(key)
+                leader = event is None
+                if leader:
+                    event = threading.Event()
+                    self._inflight[key] = event
+            if not leader:
+                logging.info(f"Waiting for in flight download of {vid}")
+                event.wait()
+                # a failed download is retried by the next leader
+                continue
+            try:
+                with self._lock:
+                    self.misses += 1
+                logging.info(f"Ingest cache miss for {vid} ({kind})")
+                entry = self._download(url, vid, kind, download)
+            finally:
+                with self._lock:
+                    del self._inflight[key]
+                    self._finished += 1
+                event.set()
+            if entry is None:
+                return None
+            self.evict(keep=entry)
+            return self._materialize(vid, entry, destination)
+
+    def _lookup(self, vid: str, kind: str) -> Optional[Path]:
+        rows = self.pool.execute(
+            "SELECT path FROM ingest_cache "
+            "WHERE video_id = ? AND kind = ? AND created_at > ?",
+            (vid, kind, time.time() - self.ttl_seconds)
+        )
+        if not rows or not Path(rows[0][0]).is_file():
+            return None
+        self.pool.execute(
+            "UPDATE ingest_cache SET accessed_at = ?, hits = hits + 1 "
+            "WHERE video_id = ? AND kind = ?",
+            (time.time(), vid, kind)
+        )
+        return Path(rows[0][0])
+
+    def _download(
+        self,
+        url: str,
+        vid: str,
+        kind: str,
+        download: Callable[..., Optional[str]]
+    ) -> Optional[Path]:
+        # downloaded aside and renamed so a partial file is never served
+        tmp = self.root / f".{uuid.uuid4().hex}"
+        tmp.mkdir(parents=True)
+        try:
+            filename = timed_download(download, url, tmp)
+            if not filename:
+                return None
+            folder = self.root / f"{vid}-{kind}"
+            shutil.rmtree(folder, ignore_errors=True)
+            folder.mkdir()
+            entry = folder / Path(filename).name
+            Path(filename).rename(entry)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        now = time.time()
+        self.pool.execute(
+            "INSERT OR REPLACE INTO ingest_cache "
+            "(video_id, kind, path, size, created_at, accessed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (vid, kind, str(entry), entry.stat().st_size, now, now)
+        )
+        return entry
+
+    @staticmethod
+    def _materialize(vid: str, entry: Path, destination: Path) -> str:
+        destination.mkdir(parents=True, exist_ok=True)
+        # named after the video, two videos with the same title must not
+        # replace each other's file while it is being separated
+        target = destination / f"{vid}-{entry.name}"
+        if target.exists() and not target.samefile(entry):
+            target.unlink()
+        if not target.exists():
+            try:
+                # hardlinks don't take extra space and survive the eviction
+                # of the entry
+                os.link(entry, target)
+            except OSError:
+                shutil.copy2(entry, target)
+        # the song was just requested, the janitor must not take it for an
+        # old one
+        os.utime(target)
+        return str(target)
+
+    def evict(self, keep: Optional[Path] = None) -> int:
+        """
+        Removes the expired entries and then the least recently used ones
+        until the cache fits in max_bytes, returns the bytes reclaimed
+        """
+        rows = self.pool.execute(
+            "SELECT video_id, kind, path, size, created_at FROM ingest_cache "
+            "ORDER BY accessed_at"
+        )
+        total = sum(row[3] for row in rows)
+        expired_before = time.time() - self.ttl_seconds
+        reclaimed = 0
+        for vid, kind, path, size, created_at in rows:
+            if Path(path) == keep:
+                continue
+            if total <= self.max_bytes and created_at > expired_before:
+                continue
+            shutil.rmtree(Path(path).parent, ignore_errors=True)
+            self.pool.execute(
+                "DELETE FROM ingest_cache WHERE video_id = ? AND kind = ?",
+                (vid, kind)
+            )
+            total -= size
+            reclaimed += size
+            logging.info(f"Evicted {vid} ({kind}) from the ingest cache")
+        return reclaimed
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+ingest_cache = IngestCache(
+    Path(config.INGEST_CACHE_DIR),
+    config.INGEST_CACHE_MB * 1024 * 1024,
+    config.INGEST_CACHE_TTL_HOURS * 3600,
+    db.pool
+)
+
+metrics.callback(
+    "demucs_ingest_cache_requests_total",
+    "Youtube audio served from the cache (hit) or downloaded (miss)",
+    lambda: [
+        ({"result": "hit"}, ingest_cache.stats()["hits"]),
+        ({"result": "miss"}, ingest_cache.stats()["misses"]),
+    ],
+    kind="counter"
+)
@@ -0,0 +1,250 @@
+#!/usr/bin/python3
+"""
+Removes the songs, stems and zips the service no longer needs:
+
+    python -m lib.janitor
+
+sweeps once (e.g. from cron), server.py also runs it in the background
+every DEMUCS_JANITOR_INTERVAL_SECONDS.
+"""
+
+import logging
+import shutil
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Set
+
+import lib.config as config
+import lib.db as db
+import lib.metrics as metrics
+from lib.catalog import Catalog, catalog
+
+
+def entry_size(path: Path) -> int:
+    if path.is_file():
+        return path.stat().st_size
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def entry_mtime(path: Path) -> float:
+    # a folder of stems is as recent as its newest stem
+    mtime = path.stat().st_mtime
+    if path.is_dir():
+        for child in path.iterdir():
+            mtime = max(mtime, child.stat().st_mtime)
+    return mtime
+
+
+class Policy():
+    """
+    Entries of root (or of its subfolders with depth 2, e.g. the songs of
+    every model in separated/) older than ttl_seconds are removed, then the
+    oldest ones until they take at most max_bytes. 0 disables either limit
+    """
+
+    def __init__(
+        self, root: Path, ttl_seconds: float, max_bytes: int, depth: int = 1
+    ):
+        self.root = Path(root)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.depth = depth
+
+    def entries(self) -> List[Path]:
+        level = [self.root]
+        for _ in range(self.depth):
+            # hidden entries are the caches, they enforce their own quotas
+            level = [
+                child for folder in level if folder.is_dir()
+                for child in folder.iterdir()
+                if not child.name.startswith(".")
+            ]
+        return level
+
+
+class Janitor():
+
+    def __init__(
+        self,
+        policies: List[Policy],
+        token_ttl_seconds: float,
+        pool: db.ConnectionPool,
+        catalog: Catalog
+    ):
+        self.policies = policies
+        self.token_ttl_seconds = token_ttl_seconds
+        self.pool = pool
+        self.catalog = catalog
+        self.reclaimed_bytes = 0
+        self._in_use: Counter = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def hold(self, *paths) -> Callable[[], None]:
+        """
+        The paths (and the entries holding them) aren't removed until the
+        returned function is called, e.g. the song of a job from its
+        submission until it finished
+        """
+        resolved = [Path(p).resolve() for p in paths]
+        with self._lock:
+            self._in_use.update(resolved)
+
+        def release() -> None:
+            with self._lock:
+                self._in_use.subtract(resolved)
+                self._in_use += Counter()
+        return release
+
+    @contextmanager
+    def in_use(self, *paths) -> Iterator[None]:
+        """
+        hold for the duration of the block, e.g. the song and the stems of
+        a running split
+        """
+        release = self.hold(*paths)
+        try:
+            yield
+        finally:
+            release()
+
+    def protected(self) -> Set[Path]:
+        with self._lock:
+            paths = set(self._in_use)
+        # the stems of the tokens that can still be downloaded
+        rows = self.pool.execute(
+            "SELECT song_path FROM downloads "
+            "WHERE accessed = False AND created_at > ?",
+            (time.time() - self.token_ttl_seconds,)
+        )
+        paths.update(Path(row[0]).resolve() for row in rows)
+        return paths
+
+    @staticmethod
+    def _is_protected(entry: Path, protected: Set[Path]) -> bool:
+        entry = entry.resolve()
+        return any(p == entry or entry in p.parents for p in protected)
+
+    def _remove(self, entry: Path) -> None:
+        if entry.is_dir():
+            shutil.rmtree(entry)
+        else:
+            entry.unlink()
+
+    def sweep_policy(self, policy: Policy, protected: Set[Path]) -> int:
+        now = time.time()
+        entries = []
+        for entry in policy.entries():
+            try:
+                entries.append((entry_mtime(entry), entry_size(entry), entry))
+            except FileNotFoundError:
+                # removed while it was being scanned
+                continue
+        total = sum(size for _, size, _ in entries)
+        reclaimed = 0
+        for mtime, size, entry in sorted(entries, key=lambda e: e[0]):
+            expired = policy.ttl_seconds > 0 and \
+                now - mtime > policy.ttl_seconds
+            over_quota = policy.max_bytes > 0 and total > policy.max_bytes
+            if not (expired or over_quota):
+                continue
+            if self._is_protected(entry, protected):
+                continue
+            try:
+                self._remove(entry)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logging.error(f"Unable to remove {entry}: {e}")
+                continue
+            self.catalog.remove(entry)
+            total -= size
+            reclaimed += size
+            logging.debug(f"Janitor removed {entry} ({size}B)")
+        return reclaimed
+
+    def sweep(self) -> Dict[str, int]:
+        """
+        Applies every policy once, returns the bytes reclaimed by each
+        """
+        protected = self.protected()
+        reclaimed = {
+            str(policy.root): self.sweep_policy(policy, protected)
+            for policy in self.policies
+        }
+        with self._lock:
+            self.reclaimed_bytes += sum(reclaimed.values())
+        # whatever was added or removed outside of the service
+        self.catalog.reconcile_all()
+        logging.info(
+            "Janitor reclaimed " + ", ".join(
+                f"{size}B from {root}" for root, size in reclaimed.items()
+            )
+        )
+        return reclaimed
+
+    def _loop(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error(f"The janitor sweep failed: {e}")
+
+    def start(self, interval: float) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._loop, args=(interval,), name="demucs-janitor",
+            daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+janitor = Janitor(
+    [
+        Policy(
+            Path("songs"),
+            config.SONGS_TTL_HOURS * 3600,
+            config.SONGS_MAX_MB * 1024 * 1024
+        ),
+        Policy(
+            Path("separated"),
+            config.SEPARATED_TTL_HOURS * 3600,
+            config.SEPARATED_MAX_MB * 1024 * 1024,
+            depth=2
+        ),
+        # only the zips written before they were streamed are left there
+        Policy(
+            Path("downloads"),
+            config.DOWNLOADS_TTL_HOURS * 3600,
+            config.DOWNLOADS_MAX_MB * 1024 * 1024
+        ),
+    ],
+    config.DOWNLOAD_TOKEN_TTL_HOURS * 3600,
+    db.pool,
+    catalog
+)
+
+metrics.callback(
+    "demucs_janitor_reclaimed_bytes_total",
+    "Bytes removed by the storage janitor",
+    lambda: janitor.reclaimed_bytes,
+    kind="counter"
+)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    for root, size in janitor.sweep().items():
+        print(f"{root}: {size} bytes reclaimed")
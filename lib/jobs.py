@@ -0,0 +1,214 @@
+#!/usr/bin/python3
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional, Sequence
+
+import lib.config as config
+import lib.metrics as metrics
+import lib.profiling as profiling
+import lib.progress as progress
+from lib.janitor import janitor
+
+JOBS = metrics.counter(
+    "demucs_jobs_total", "Finished jobs by kind and final state",
+    ["kind", "state"]
+)
+JOB_SECONDS = metrics.histogram(
+    "demucs_job_seconds", "Time jobs spent queued and running",
+    ["kind", "phase"]
+)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# kinds of job whose result is a /download token
+DOWNLOAD_KINDS = ("split", "split_from_url")
+
+
+class JobQueueFull(Exception):
+
+    def __init__(self, msg):
+        super().__init__(msg)
+
+
+class Job():
+
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.state = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # whatever the job function returns, the download token for splits
+        # and the song filename for music_from_video
+        self.result: Optional[str] = None
+        self.error: Optional[str] = None
+        # the job runs under the profiler, see lib/profiling.py
+        self.profile = False
+        self.progress = progress.Progress()
+
+    @property
+    def queued_seconds(self) -> Optional[float]:
+        if self.started_at is None:
+            return None
+        return self.started_at - self.created_at
+
+    @property
+    def run_seconds(self) -> Optional[float]:
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    @property
+    def download_token(self) -> Optional[str]:
+        if self.kind not in DOWNLOAD_KINDS:
+            return None
+        return self.result
+
+    @property
+    def done(self) -> bool:
+        return self.state in (COMPLETED, FAILED)
+
+    def snapshot(self) -> dict:
+        return {
+            "id": self.id,
+            "state": self.state,
+            "stage": self.progress.stage,
+            "percent": self.progress.percent,
+            "eta_seconds": self.progress.eta_seconds,
+            "download_token": self.download_token,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+def events(job: Job, keepalive: float) -> Iterator[Optional[dict]]:
+    """
+    Snapshot of job every time it changes until it is done, None when
+    nothing changed for keepalive seconds
+    """
+    version = None
+    while True:
+        current = job.progress.version
+        if current == version:
+            yield None
+        else:
+            version = current
+            snapshot = job.snapshot()
+            yield snapshot
+            if snapshot["state"] in (COMPLETED, FAILED):
+                return
+        job.progress.wait(version, keepalive)
+
+
+class JobManager():
+
+    def __init__(self, workers: int, max_pending: int, history: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.history = history
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="demucs-job"
+        )
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        kind: str,
+        fn: Callable,
+        *args,
+        profile: bool = False,
+        paths: Sequence = (),
+        **kwargs
+    ) -> Job:
+        """
+        Queues fn(*args, **kwargs), the janitor leaves paths (e.g. the song
+        to separate) alone from now until the job finished
+        """
+        job = Job(kind)
+        job.profile = profile
+        release = janitor.hold(*paths)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                release()
+                raise JobQueueFull(
+                    f"There are already {self._pending} jobs waiting, "
+                    "try again later"
+                )
+            self._pending += 1
+            self._jobs[job.id] = job
+            self._forget_finished()
+        self._executor.submit(self._run, job, fn, args, kwargs, release)
+        logging.info(f"Job {job.id} ({kind}) queued")
+        return job
+
+    def _run(
+        self, job: Job, fn: Callable, args, kwargs, release: Callable
+    ) -> None:
+        job.started_at = time.time()
+        job.state = RUNNING
+        job.progress.touch()
+        try:
+            with progress.tracking(job.progress):
+                if job.profile:
+                    with profiling.capture(profiling.profile_folder(job.id)):
+                        job.result = fn(*args, **kwargs)
+                else:
+                    job.result = fn(*args, **kwargs)
+            job.state = COMPLETED
+            logging.info(f"Job {job.id} completed")
+        except Exception as e:
+            job.error = str(e)
+            job.state = FAILED
+            logging.error(f"Job {job.id} failed: {e}")
+        finally:
+            release()
+            job.finished_at = time.time()
+            job.progress.touch()
+            with self._lock:
+                self._pending -= 1
+            JOBS.inc(kind=job.kind, state=job.state)
+            JOB_SECONDS.observe(job.queued_seconds, kind=job.kind,
+                                phase="queued")
+            JOB_SECONDS.observe(job.run_seconds, kind=job.kind, phase="run")
+
+    def _forget_finished(self) -> None:
+        # must be called with self._lock held, only finished jobs are
+        # dropped so a client can always query a job that is still running
+        excess = len(self._jobs) - self.history
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id].done:
+                del self._jobs[job_id]
+                excess -= 1
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._pending
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+jobs = JobManager(
+    config.JOB_WORKERS, config.JOB_MAX_PENDING, config.JOB_HISTORY
+)
+
+metrics.callback(
+    "demucs_jobs_pending", "Jobs queued or running", jobs.pending
+)
@@ -0,0 +1,256 @@
+#!/usr/bin/python3
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import (
+    Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+)
+
+# seconds, from a DB query to the separation of a long track
+DEFAULT_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+    120, 300, 600
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"') \
+        .replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter():
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            f"{self.name}{_labels(self.labels, key)} {_number(value)}"
+            for key, value in sorted(values)
+        ]
+
+
+class Histogram():
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> (count per bucket plus +Inf, sum)
+        self._values: Dict[Tuple, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels[name] for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(
+                key, ([0] * (len(self.buckets) + 1), [0.0])
+            )
+            counts[index] += 1
+            total[0] += value
+
+    def count(self, **labels) -> int:
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            counts, _ = self._values.get(key, ([0], [0.0]))
+            return sum(counts)
+
+    def sum(self, **labels) -> float:
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            _, total = self._values.get(key, ([0], [0.0]))
+            return total[0]
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = [
+                (key, list(counts), total[0])
+                for key, (counts, total) in self._values.items()
+            ]
+        lines = []
+        for key, counts, total in sorted(values):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _labels(
+                    self.labels + ("le",), key + (_number(bound),)
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_number(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Callback():
+    """
+    Value read when the metrics are scraped, fn returns a number or a list
+    of (labels dict, number)
+    """
+
+    def __init__(
+        self, name: str, help: str, fn: Callable, kind: str = "gauge"
+    ):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.kind = kind
+
+    def samples(self) -> List[str]:
+        value = self.fn()
+        if isinstance(value, (int, float)):
+            return [f"{self.name} {_number(value)}"]
+        return [
+            f"{self.name}{_labels(list(labels), list(labels.values()))} "
+            f"{_number(number)}"
+            for labels, number in value
+        ]
+
+
+class Registry():
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            # modules can be imported again (e.g. by the tests), the first
+            # metric keeps collecting
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        """
+        Every metric in the Prometheus text format
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines += metric.samples()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def counter(name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+    return registry.register(Counter(name, help, labels))
+
+
+def histogram(
+    name: str,
+    help: str,
+    labels: Sequence[str] = (),
+    buckets: Sequence[float] = DEFAULT_BUCKETS
+) -> Histogram:
+    return registry.register(Histogram(name, help, labels, buckets))
+
+
+def callback(
+    name: str, help: str, fn: Callable, kind: str = "gauge"
+) -> Callback:
+    return registry.register(Callback(name, help, fn, kind))
+
+
+STAGE_SECONDS = histogram(
+    "demucs_stage_seconds",
+    "Time spent in every stage of the requests",
+    ["stage"]
+)
+ERRORS = counter(
+    "demucs_errors_total", "Errors raised by every stage", ["stage"]
+)
+
+
+class Timer():
+    """
+    Stage interleaved with another one (e.g. writing the stems while they
+    are separated): the time of its blocks adds up and is observed once
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            ERRORS.inc(stage=self.name)
+            raise
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def observe(self) -> None:
+        STAGE_SECONDS.observe(self.seconds, stage=self.name)
+
+
+@contextmanager
+def stage(name: str, exclude: Optional[Timer] = None) -> Iterator[None]:
+    """
+    Times the block as the stage name and counts its errors, the time
+    exclude spent inside the block is left out
+    """
+    start = time.perf_counter()
+    excluded = exclude.seconds if exclude else 0.0
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(stage=name)
+        raise
+    finally:
+        if exclude:
+            excluded = exclude.seconds - excluded
+        STAGE_SECONDS.observe(
+            time.perf_counter() - start - excluded, stage=name
+        )
@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+
+import logging
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Tuple
+
+import torch
+
+import lib.config as config
+import lib.fast_inference as fast_inference
+import lib.metrics as metrics
+from lib.demucs import demucs
+from lib.demucs.demucs import model as demucs_model
+from lib.demucs.demucs.utils import apply_model, load_model
+
+# This hack is to be able to load a pickled class from
+# within the demucs directory
+sys.modules['demucs.model'] = demucs_model
+sys.modules['demucs'] = demucs
+
+
+def _tensors(value) -> Iterator[torch.Tensor]:
+    if isinstance(value, torch.Tensor):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _tensors(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _tensors(item)
+    elif isinstance(value, torch.ScriptObject):
+        # the packed weights of the quantized layers
+        try:
+            yield from _tensors(value.__getstate__())
+        except Exception:
+            pass
+
+
+def model_size(model, shared=None) -> int:
+    """
+    Approximate amount of bytes held by the state of model (the packed
+    weights of a quantized model included), without the tensors it shares
+    with the shared model
+    """
+    seen = set()
+    if shared is not None:
+        seen.update(t.data_ptr() for t in _tensors(shared.state_dict()))
+    size = 0
+    for tensor in _tensors(model.state_dict()):
+        if tensor.data_ptr() not in seen:
+            seen.add(tensor.data_ptr())
+            size += tensor.numel() * tensor.element_size()
+    return size
+
+
+class ModelRegistry():
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        # (model, device, inference) -> (loaded model, size in bytes), the
+        # order of the dict is the LRU order, most recently used at the end.
+        self._models: "OrderedDict[Tuple[str, str, str], Tuple]" = \
+            OrderedDict()
+        self._lock = threading.Lock()
+        # one lock per key so two requests for the same model only
+        # unpickle it once, while other models can still be served
+        self._load_locks: Dict[Tuple[str, str, str], threading.Lock] = {}
+
+    def get(self, model: str, device: str, inference: str = "eager"):
+        key = (model, device, inference)
+        with self._lock:
+            if key in self._models:
+                self._touch(key)
+                return self._models[key][0]
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                if key in self._models:
+                    self._touch(key)
+                    return self._models[key][0]
+            if inference == "eager":
+                loaded = self.load(model, device)
+                size = model_size(loaded)
+            else:
+                # the fast model is derived from the eager one, which stays
+                # cached for the requests that don't use it, and only the
+                # weights it doesn't share with it are its own
+                eager = self.get(model, device)
+                loaded = self.optimize(eager, model)
+                size = model_size(loaded, shared=eager)
+            with self._lock:
+                self._models[key] = (loaded, size)
+                self._touch(key)
+                self._evict(keep=key)
+            return loaded
+
+    def load(self, model: str, device: str):
+        model_path = Path(config.MODELS_DIR) / f"{model}.th"
+        logging.info(f"Loading model {model} into {device} from {model_path}")
+        with metrics.stage("model_load"):
+            return load_model(str(model_path)).to(device).eval()
+
+    @staticmethod
+    def optimize(loaded, model: str):
+        logging.info(
+            f"Optimizing model {model} ({config.FAST_PRECISION}, "
+            f"trace={config.FAST_TRACE})"
+        )
+        with metrics.stage("model_optimize"):
+            return fast_inference.optimize(
+                loaded, config.FAST_PRECISION, config.FAST_TRACE
+            )
+
+    @staticmethod
+    def _eager_key(key):
+        model, device, _ = key
+        return (model, device, "eager")
+
+    def _touch(self, key) -> None:
+        # must be called with self._lock held, a fast model keeps its eager
+        # model alive so using it uses the eager one too
+        eager = self._eager_key(key)
+        if eager in self._models:
+            self._models.move_to_end(eager)
+        self._models.move_to_end(key)
+
+    def _evict(self, keep) -> None:
+        # must be called with self._lock held
+        total = sum(size for _, size in self._models.values())
+        for key in list(self._models):
+            if total <= self.budget_bytes:
+                break
+            if key not in self._models or key in (keep, self._eager_key(keep)):
+                continue
+            # evicting an eager model frees nothing while the fast models
+            # derived from it are cached, they go with it
+            evicted = [key] if key[2] != "eager" else [
+                other for other in self._models
+                if self._eager_key(other) == key
+            ]
+            for other in evicted:
+                _, size = self._models.pop(other)
+                total -= size
+                logging.info(
+                    f"Evicted model {other} from the registry ({size}B)"
+                )
+        if total > self.budget_bytes:
+            logging.warning(
+                f"Model {keep} alone exceeds the registry budget "
+                f"{total}B > {self.budget_bytes}B"
+            )
+
+    def preload(self, models: Iterable[str], device: str,
+                inference: str = "eager") -> None:
+        for name in models:
+            try:
+                loaded = self.get(name, device, inference)
+                self.warm_up(loaded, device)
+            except Exception as e:
+                logging.error(f"Unable to preload model {name}: {e}")
+
+    @staticmethod
+    def warm_up(model, device: str) -> None:
+        # a second of silence is enough to allocate the buffers and
+        # initialize the kernels used on the hot path
+        silence = torch.zeros(2, model.samplerate, device=device)
+        apply_model(model, silence)
+
+    def loaded(self):
+        with self._lock:
+            return [
+                (key, size) for key, (_, size) in self._models.items()
+            ]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._models.clear()
+
+
+registry = ModelRegistry(config.MODEL_CACHE_MB * 1024 * 1024)
+
+metrics.callback(
+    "demucs_model_cache_bytes",
+    "Size of the models loaded in the registry",
+    lambda: [
+        ({"model": model, "device": device, "inference": inference}, size)
+        for (model, device, inference), size in registry.loaded()
+    ]
+)
+metrics.callback(
+    "demucs_model_cache_budget_bytes",
+    "Memory budget of the model registry",
+    lambda: registry.budget_bytes
+)
@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+
+import importlib
+import logging
+import time
+import uuid
+from pathlib import Path
+from typing import List, Optional
+
+import lib.config as config
+import lib.progress as progress
+import lib.utils as utils
+from lib.catalog import catalog
+from lib.demucs_service import DemucsService
+from lib.estimator import cost_model
+from lib.ingest_cache import ingest_cache
+from lib.janitor import janitor
+from lib.presets import DEFAULT_PRESET
+from lib.process_pool import process_pool
+
+
+def separator_class():
+    """
+    DemucsService, or the class configured in DEMUCS_SEPARATOR
+    """
+    if not config.SEPARATOR:
+        return DemucsService
+    module, _, name = config.SEPARATOR.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def split_song(
+    model: str,
+    device: str,
+    track_path: str,
+    options: Optional[dict] = None,
+    **kwargs
+) -> None:
+    """
+    options are the DemucsService settings of the request and kwargs the
+    arguments of DemucsService.split_song
+    """
+    options = options or {}
+    start = time.perf_counter()
+    if config.EXECUTION_MODE == "process":
+        # the chunks are separated in another process, only the stage is
+        # known here
+        progress.stage("separate")
+        audio_seconds = process_pool.split_song(
+            model, device, track_path, options, **kwargs
+        )
+    else:
+        audio_seconds = separator_class()(model, device, **options) \
+            .split_song(track_path, **kwargs)
+    # splits served from the cache (None) say nothing about the cost
+    if audio_seconds:
+        cost_model.record(
+            model, device, options.get("preset", DEFAULT_PRESET),
+            audio_seconds, time.perf_counter() - start
+        )
+
+
+def split(
+    song: str,
+    model: str = "demucs",
+    device: str = 'cpu',
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    output_format: str = "wav",
+    bitrate: Optional[int] = None,
+    stems: Optional[List[str]] = None,
+    preset: str = DEFAULT_PRESET
+) -> str:
+    """
+    Separates song and returns the token to download the stems
+    """
+    logging.info(f"running demucs with {model} and {device}")
+    name = Path(song).stem
+    excerpt = {}
+    if start_time and end_time:
+        # only the excerpt is decoded and separated
+        seek_time, duration = utils.trim_window(start_time, end_time)
+        name = f"{name}-extract"
+        excerpt = dict(seek_time=seek_time, duration=duration)
+    # every split writes its own folder, so the download token serves the
+    # stems of this split whatever the later splits of the same song
+    # (other format, stems or excerpt) write
+    folder = f"{name}-{uuid.uuid4().hex}"
+    output = Path('separated') / model / folder
+    # the janitor leaves the song and its stems alone until the download
+    # token exists
+    with janitor.in_use(song, output):
+        split_song(
+            model, device, song,
+            dict(
+                output_format=output_format, bitrate=bitrate, stems=stems,
+                preset=preset
+            ),
+            name=folder, **excerpt
+        )
+        catalog.add(output)
+        # the download is named after the song, not the folder
+        token = utils.get_download_link(folder, model, name)
+    logging.info('demucs completed')
+    return token
+
+
+def music_from_video(url: str) -> str:
+    """
+    Downloads a youtube video as mp3 into songs/ and returns its filename
+    """
+    progress.stage("download")
+    filename = ingest_cache.fetch(url, "mp3", utils.video_to_mp3)
+    if not filename:
+        raise Exception(f"Failed to download the video {url}")
+    catalog.add(Path(filename))
+    return filename
+
+
+def split_from_url(
+    url: str,
+    model: str = "demucs",
+    device: str = 'cpu',
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    output_format: str = "wav",
+    bitrate: Optional[int] = None,
+    stems: Optional[List[str]] = None,
+    preset: str = DEFAULT_PRESET
+) -> str:
+    """
+    Downloads the audio of a youtube video and separates it
+    """
+    logging.info(
+        f"Received a split from url, trying to fetch video \
+        from Youtube {url} - {model} - {device}"
+    )
+    progress.stage("download")
+    filename = ingest_cache.fetch(url, "audio", utils.fetch_audio)
+    if not filename:
+        raise Exception(f"Failed to download the audio of {url}")
+    catalog.add(Path(filename))
+    # fetch refreshed the mtime of the song so a sweep doesn't take it for
+    # an old one, it is held until the split is done
+    with janitor.in_use(filename):
+        return split(
+            filename, model, device, start_time, end_time, output_format,
+            bitrate, stems, preset
+        )
@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+
+from typing import Optional
+
+
+class Preset():
+    """
+    Quality/latency trade-off of a split: random shifts averaged by
+    apply_model, overlap of the segments and inference mode (None for
+    DEMUCS_INFERENCE). Segments are always separated one at a time
+    (split=True) so the memory doesn't depend on the track length.
+    """
+
+    def __init__(self, name: str, shifts: int, overlap: float,
+                 inference: Optional[str], description: str):
+        self.name = name
+        self.shifts = shifts
+        self.overlap = overlap
+        self.inference = inference
+        self.description = description
+
+    @property
+    def relative_cost(self) -> float:
+        """
+        Cost of the preset relative to standard, used until its own cost
+        is measured: every shift runs the model again, a smaller overlap
+        runs it on fewer segments and the fast mode takes about half the
+        time (see benchmarks/fast_inference.py)
+        """
+        cost = max(self.shifts, 1) * 0.75 / (1 - self.overlap)
+        if self.inference == "fast":
+            cost *= 0.5
+        return cost
+
+
+DEFAULT_PRESET = "standard"
+PRESETS = {
+    preset.name: preset for preset in [
+        Preset("preview", 0, 0.1, "fast",
+               "int8 model and little overlap, about 2x faster than"
+               " standard"),
+        Preset("standard", 0, 0.25, None,
+               "the settings the service always used"),
+        Preset("high_quality", 5, 0.25, "eager",
+               "average of 5 random shifts (+0.2 SDR), about 5x slower"
+               " than standard"),
+    ]
+}
+
+
+def check_preset(name: str) -> Preset:
+    if name not in PRESETS:
+        raise ValueError(
+            f"Unsupported preset {name}, use one of {', '.join(PRESETS)}"
+        )
+    return PRESETS[name]
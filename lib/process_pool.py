@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+import torch
+
+import lib.config as config
+
+
+def _init_worker(counter, threads: int, interop_threads: int, pin: bool):
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    # every worker owns a fixed slice of cores instead of all the workers
+    # competing for every core with the default torch thread pools
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(interop_threads)
+    if pin and hasattr(os, "sched_setaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+        start = (index * threads) % len(cpus)
+        cores = cpus[start:start + threads] or cpus
+        os.sched_setaffinity(0, cores)
+        logging.info(f"Worker {index} ({os.getpid()}) pinned to {cores}")
+
+
+def _split_song(
+    model: str, device: str, track_path: str, options: dict, kwargs: dict
+) -> Optional[float]:
+    # imported here so the parent process doesn't need the model code
+    # just to submit work
+    from lib.pipeline import separator_class
+    return separator_class()(model, device, **options).split_song(
+        track_path, **kwargs
+    )
+
+
+class ProcessPool():
+
+    def __init__(
+        self,
+        workers: int,
+        threads: int,
+        interop_threads: int = 1,
+        pin: bool = False
+    ):
+        self.workers = workers
+        self.threads = threads
+        self.interop_threads = interop_threads
+        self.pin = pin
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # fork is not safe once torch started its thread pools
+                context = multiprocessing.get_context("spawn")
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(
+                        context.Value('i', 0),
+                        self.threads,
+                        self.interop_threads,
+                        self.pin
+                    )
+                )
+            return self._executor
+
+    def split_song(
+        self,
+        model: str,
+        device: str,
+        track_path: str,
+        options: Optional[dict] = None,
+        **kwargs
+    ):
+        """
+        DemucsService(model, device, **options).split_song(track_path,
+        **kwargs) on one of the worker processes
+        """
+        executor = self._get_executor()
+        try:
+            return executor.submit(
+                _split_song, model, device, str(track_path),
+                options or {}, kwargs
+            ).result()
+        except BrokenProcessPool:
+            # a worker died (e.g. killed by the OOM killer), the next
+            # request gets a brand new pool
+            logging.error("The process pool is broken, restarting it")
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            raise
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+process_pool = ProcessPool(
+    config.PROCESS_WORKERS,
+    config.PROCESS_THREADS,
+    config.PROCESS_INTEROP_THREADS,
+    config.PROCESS_PIN_CPUS
+)
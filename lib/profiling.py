@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+import cProfile
+import logging
+import pstats
+import re
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+import torch
+
+import lib.config as config
+
+# files written for every profiled job and their mimetypes
+PROFILE_FILES = {
+    "profile.pstats": "application/octet-stream",
+    "profile.txt": "text/plain",
+    "trace.json": "application/json",
+}
+
+# the capture running on the current thread, if any
+_active = threading.local()
+
+# only one cProfile profiler can be enabled at a time on python 3.12+,
+# where it uses sys.monitoring and sees every thread
+_cprofile_lock = threading.Lock()
+
+
+def profile_folder(job_id: str) -> Optional[Path]:
+    """
+    Folder holding the profile of job_id, None if job_id isn't a job id
+    """
+    if not re.fullmatch(r"[0-9a-f]{32}", job_id):
+        return None
+    return Path(config.PROFILES_DIR) / job_id
+
+
+def _start_cprofile() -> Optional[cProfile.Profile]:
+    """
+    An enabled profiler, None when another capture (or another profiling
+    tool) is running cProfile
+    """
+    if not _cprofile_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # "Another profiling tool is already active"
+        _cprofile_lock.release()
+        logging.warning(f"cProfile unavailable, only tracing torch: {e}")
+        return None
+    except BaseException:
+        _cprofile_lock.release()
+        raise
+    return profiler
+
+
+@contextmanager
+def capture(folder: Path) -> Iterator[None]:
+    """
+    Runs the block under cProfile and enables torch_profile on this thread,
+    the results are written to folder. Captures running while cProfile is
+    busy only record the torch trace
+    """
+    folder.mkdir(parents=True, exist_ok=True)
+    profiler = _start_cprofile()
+    _active.folder = folder
+    try:
+        yield
+    finally:
+        _active.folder = None
+        if profiler is not None:
+            profiler.disable()
+            _cprofile_lock.release()
+            profiler.dump_stats(str(folder / "profile.pstats"))
+            with open(folder / "profile.txt", "w") as report:
+                pstats.Stats(profiler, stream=report).sort_stats(
+                    "cumulative"
+                ).print_stats(50)
+        logging.info(f"Profile written to {folder}")
+
+
+@contextmanager
+def torch_profile() -> Iterator[None]:
+    """
+    Records the torch operators of the block as a Chrome trace when the
+    thread is running a capture, does nothing otherwise
+    """
+    folder = getattr(_active, "folder", None)
+    if folder is None:
+        yield
+        return
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    with torch.profiler.profile(
+        activities=activities, record_shapes=True
+    ) as profiler:
+        yield
+    profiler.export_chrome_trace(str(folder / "trace.json"))
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+# the progress of the job running on the current thread, if any
+_active = threading.local()
+
+
+class Progress():
+    """
+    Stage of a job and the chunks of it that are done, updated by the
+    thread running the job and waited on by the clients following it
+    """
+
+    def __init__(self):
+        self.stage: Optional[str] = None
+        self.done = 0
+        self.total = 0
+        self.stage_started_at: Optional[float] = None
+        # bumped on every change, see wait
+        self.version = 0
+        self._changed = threading.Condition()
+
+    def start_stage(self, stage: str, total: int = 0) -> None:
+        with self._changed:
+            self.stage = stage
+            self.done = 0
+            self.total = total
+            self.stage_started_at = time.time()
+            self._notify()
+
+    def advance(self, count: int = 1) -> None:
+        with self._changed:
+            self.done = min(self.done + count, self.total)
+            self._notify()
+
+    def touch(self) -> None:
+        """
+        Wakes up the waiters, e.g. when the state of the job changed
+        """
+        with self._changed:
+            self._notify()
+
+    def _notify(self) -> None:
+        self.version += 1
+        self._changed.notify_all()
+
+    def wait(self, version: int, timeout: float) -> int:
+        """
+        Blocks until something changed after version or timeout seconds
+        passed, returns the current version
+        """
+        with self._changed:
+            self._changed.wait_for(
+                lambda: self.version != version, timeout=timeout
+            )
+            return self.version
+
+    @property
+    def percent(self) -> Optional[float]:
+        with self._changed:
+            if not self.total:
+                return None
+            return 100 * self.done / self.total
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        """
+        Time left in the stage, extrapolated from the chunks done so far
+        """
+        with self._changed:
+            if not self.total or not self.done:
+                return None
+            elapsed = time.time() - self.stage_started_at
+            return elapsed / self.done * (self.total - self.done)
+
+
+def chunks(length: int, segment: int, overlap: float = 0.25) -> int:
+    """
+    Segments apply_model(split=True) runs the model on for length samples
+    """
+    return math.ceil(length / int((1 - overlap) * segment))
+
+
+@contextmanager
+def tracking(progress: Progress) -> Iterator[None]:
+    """
+    Reports the stages and chunks of the block to progress
+    """
+    _active.progress = progress
+    try:
+        yield
+    finally:
+        _active.progress = None
+
+
+def stage(name: str, total: int = 0) -> None:
+    progress = getattr(_active, "progress", None)
+    if progress is not None:
+        progress.start_stage(name, total)
+
+
+def advance(count: int = 1) -> None:
+    progress = getattr(_active, "progress", None)
+    if progress is not None:
+        progress.advance(count)
+
+
+class _CountingModel():
+    """
+    Forwards everything to model and counts a chunk on every call, for
+    apply_model which loops over the chunks itself
+    """
+
+    def __init__(self, model):
+        self._model = model
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+    def __call__(self, *args, **kwargs):
+        out = self._model(*args, **kwargs)
+        advance()
+        return out
+
+
+def counting(model):
+    if getattr(_active, "progress", None) is None:
+        return model
+    return _CountingModel(model)
@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict
+
+import torch
+
+import lib.config as config
+import lib.metrics as metrics
+
+REQUESTS = metrics.counter(
+    "demucs_result_cache_requests_total",
+    "Separations served from the cache (hit) or computed (miss)",
+    ["result"]
+)
+
+
+def make_key(wav: torch.Tensor, **params) -> str:
+    """
+    Content address of a separation: the decoded input plus every
+    parameter that changes the produced stems
+    """
+    digest = hashlib.sha256()
+    digest.update(wav.detach().cpu().contiguous().numpy().tobytes())
+    return finish_key(digest, **params)
+
+
+def finish_key(digest: "hashlib._Hash", **params) -> str:
+    """
+    Same as make_key for an input that was already hashed into digest
+    """
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.iterdir() if f.is_file())
+
+
+def dir_mtime(path: Path) -> float:
+    # the stems are still being written into a folder of a running
+    # separation, the folder itself only changes when one is created
+    mtime = path.stat().st_mtime
+    for child in path.iterdir():
+        mtime = max(mtime, child.stat().st_mtime)
+    return mtime
+
+
+class ResultCache():
+
+    def __init__(self, root: Path, max_bytes: int, stale_seconds: float):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        # partially written entries of crashed separations are removed
+        # once they weren't written to for stale_seconds
+        self.stale_seconds = stale_seconds
+        # key -> event set once the computation of key finished
+        self._inflight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def fetch_or_compute(
+        self,
+        key: str,
+        destination: Path,
+        compute: Callable[[Path], None]
+    ) -> bool:
+        """
+        Places the stems for key in destination, computing them with
+        compute(folder) only if they aren't cached yet. Concurrent calls
+        for the same key wait for a single computation.
+        Returns True when the stems came from the cache.
+        """
+        if not self.enabled:
+            self._clear(destination)
+            compute(destination)
+            return False
+
+        entry = self.root / key
+        while True:
+            if entry.is_dir():
+                os.utime(entry)
+                self._materialize(entry, destination)
+                logging.info(f"Separation cache hit for {destination}")
+                REQUESTS.inc(result="hit")
+                return True
+            with self._lock:
+                # the entry is renamed into place before the leader leaves
+                # _inflight, so checking it again under the lock avoids
+                # computing twice a result that just finished
+                if entry.is_dir():
+                    continue
+                event = self._inflight.get(key)
+                leader = event is None
+                if leader:
+                    event = threading.Event()
+                    self._inflight[key] = event
+            if not leader:
+                logging.info(f"Waiting for in flight separation of {key}")
+                event.wait()
+                # if the leader failed the entry is still missing and
+                # this request becomes the new leader
+                continue
+            REQUESTS.inc(result="miss")
+            try:
+                self._compute(entry, compute)
+            finally:
+                with self._lock:
+                    del self._inflight[key]
+                event.set()
+            self._evict(keep=entry)
+            self._materialize(entry, destination)
+            return False
+
+    def _compute(self, entry: Path, compute: Callable[[Path], None]) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        # stems are written aside and renamed so a partially written entry
+        # is never served
+        tmp = self.root / f".{entry.name}.{uuid.uuid4().hex}"
+        try:
+            compute(tmp)
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        try:
+            tmp.rename(entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            # _inflight only covers this process, with the process execution
+            # mode another worker may have computed the same stems meanwhile
+            if not entry.is_dir():
+                raise
+            logging.info(f"{entry.name} was computed by another process")
+
+    @staticmethod
+    def _clear(destination: Path) -> None:
+        # stems of a previous separation (e.g. in another format) must not
+        # end up in the download
+        if destination.is_dir():
+            for stale in destination.iterdir():
+                if stale.is_file():
+                    stale.unlink()
+
+    def _materialize(self, entry: Path, destination: Path) -> None:
+        self._clear(destination)
+        destination.mkdir(parents=True, exist_ok=True)
+        for stem in entry.iterdir():
+            target = destination / stem.name
+            try:
+                # hardlinks don't take extra space and survive the eviction
+                # of the entry
+                os.link(stem, target)
+            except OSError:
+                shutil.copy2(stem, target)
+
+    def _remove_stale(self) -> None:
+        now = time.time()
+        for partial in self.root.iterdir():
+            if not partial.name.startswith(".") or not partial.is_dir():
+                continue
+            try:
+                if now - dir_mtime(partial) <= self.stale_seconds:
+                    continue
+            except FileNotFoundError:
+                # renamed into place or removed meanwhile
+                continue
+            shutil.rmtree(partial, ignore_errors=True)
+            logging.info(
+                f"Removed {partial}, a separation that never finished"
+            )
+
+    def _evict(self, keep: Path) -> None:
+        self._remove_stale()
+        entries = [
+            e for e in self.root.iterdir()
+            if e.is_dir() and not e.name.startswith(".")
+        ]
+        sizes = {e: dir_size(e) for e in entries}
+        total = sum(sizes.values())
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+            if total <= self.max_bytes:
+                break
+            if entry == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= sizes[entry]
+            logging.info(
+                f"Evicted {entry} from the separation cache "
+                f"({sizes[entry]}B)"
+            )
+
+
+result_cache = ResultCache(
+    Path(config.RESULT_CACHE_DIR),
+    config.RESULT_CACHE_MB * 1024 * 1024,
+    config.RESULT_CACHE_STALE_HOURS * 3600
+)
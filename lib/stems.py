@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+
+from typing import List, Optional, Sequence
+
+import torch
+
+SOURCES = ["drums", "bass", "other", "vocals"]
+# sum of every source but the vocals
+ACCOMPANIMENT = "accompaniment"
+TWO_STEMS = ["vocals", ACCOMPANIMENT]
+STEMS = SOURCES + [ACCOMPANIMENT]
+
+
+def check_stems(stems: Optional[Sequence[str]]) -> Optional[List[str]]:
+    """
+    Validates the stems of a request, returns them without duplicates in
+    the order of STEMS (None for every source)
+    """
+    if stems is None:
+        return None
+    unknown = set(stems) - set(STEMS)
+    if unknown or not stems:
+        raise ValueError(
+            f"Unsupported stems {', '.join(sorted(unknown)) or '[]'}, "
+            f"use some of {', '.join(STEMS)}"
+        )
+    return [stem for stem in STEMS if stem in stems]
+
+
+def request_stems(
+    stems: Optional[Sequence[str]], two_stems: bool
+) -> Optional[List[str]]:
+    """
+    Stems selected by the stems and twoStems arguments of a split
+    """
+    if two_stems:
+        if stems is not None:
+            raise ValueError("stems and twoStems can't be used together")
+        return TWO_STEMS
+    return check_stems(stems)
+
+
+def select(
+    sources: torch.Tensor,
+    source_names: Sequence[str],
+    stems: Optional[Sequence[str]],
+    inplace: bool = False
+) -> List[torch.Tensor]:
+    """
+    The [channels, samples] stems out of the [sources, channels, samples]
+    output of the model, the accompaniment is added up here so only the
+    stems that are written are ever converted. With inplace it is added up
+    in the buffer of a source that isn't written by itself, when there is
+    one, so sources can't be used afterwards
+    """
+    if stems is None:
+        return list(sources)
+    names = list(source_names)
+    selected = []
+    for stem in stems:
+        if stem == ACCOMPANIMENT:
+            selected.append(_accompaniment(sources, names, stems, inplace))
+        else:
+            selected.append(sources[names.index(stem)])
+    return selected
+
+
+def _accompaniment(
+    sources: torch.Tensor,
+    names: List[str],
+    stems: Sequence[str],
+    inplace: bool
+) -> torch.Tensor:
+    others = [i for i, name in enumerate(names) if name != "vocals"]
+    unused = [i for i in others if names[i] not in stems]
+    if inplace and unused:
+        total = sources[unused[0]]
+        others.remove(unused[0])
+    else:
+        total = sources[others.pop(0)].clone()
+    for i in others:
+        total.add_(sources[i])
+    return total
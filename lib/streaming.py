@@ -0,0 +1,239 @@
+#!/usr/bin/python3
+
+import hashlib
+import math
+import struct
+import subprocess as sp
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+import lib.encoders as encoders
+import lib.progress as progress
+from lib.demucs.demucs.utils import TensorChunk, apply_model
+
+
+def read_blocks(
+    path: Path,
+    samplerate: int = 44100,
+    channels: int = 2,
+    block_seconds: float = 10,
+    seek_time: Optional[float] = None,
+    duration: Optional[float] = None
+) -> Iterator[torch.Tensor]:
+    """
+    Decodes path with ffmpeg and yields [channels, samples] float tensors
+    of block_seconds, the whole track is never held in memory. Only
+    duration seconds from seek_time are decoded when they are set
+    """
+    frame_bytes = channels * 4
+    block_bytes = int(block_seconds * samplerate) * frame_bytes
+    command = ['ffmpeg', '-loglevel', 'panic']
+    if seek_time:
+        command += ['-ss', str(seek_time)]
+    command += ['-i', str(path)]
+    if duration is not None:
+        command += ['-t', str(duration)]
+    command += [
+        '-threads', '1', '-f', 'f32le',
+        '-ac', str(channels), '-ar', str(samplerate), '-'
+    ]
+    with sp.Popen(command, stdout=sp.PIPE) as proc:
+        try:
+            while True:
+                data = proc.stdout.read(block_bytes)
+                data = data[:len(data) - len(data) % frame_bytes]
+                if not data:
+                    break
+                block = np.frombuffer(data, dtype=np.float32)
+                yield torch.from_numpy(block.copy()).view(-1, channels).t()
+        finally:
+            proc.kill()
+    if proc.returncode not in (0, -9):
+        raise sp.CalledProcessError(proc.returncode, command)
+
+
+def quantize(block: torch.Tensor) -> torch.Tensor:
+    # same 16 bits round trip applied to the whole track by split_song
+    return (block * 2**15).round() / 2**15
+
+
+class RunningStats():
+    """
+    Mean and (unbiased) standard deviation of the mono mix, accumulated
+    block by block
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.total_sq = 0.
+
+    def update(self, block: torch.Tensor) -> None:
+        ref = block.mean(0).double()
+        self.count += ref.numel()
+        self.total += ref.sum().item()
+        self.total_sq += (ref * ref).sum().item()
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count
+
+    @property
+    def std(self) -> float:
+        variance = (self.total_sq - self.total**2 / self.count)
+        return math.sqrt(max(variance, 0.) / max(self.count - 1, 1))
+
+
+def scan(
+    blocks: Iterable[torch.Tensor]
+) -> Tuple[RunningStats, "hashlib._Hash"]:
+    """
+    First pass over the track, returns the normalization statistics and a
+    sha256 of the decoded audio to use as cache key
+    """
+    stats = RunningStats()
+    digest = hashlib.sha256()
+    for block in blocks:
+        digest.update(block.contiguous().numpy().tobytes())
+        stats.update(quantize(block))
+    return stats, digest
+
+
+# RIFF, fmt and data chunk headers of a PCM WAV file
+WAV_HEADER_BYTES = 44
+
+
+class WavWriter():
+    """
+    16 bits WAV file of samples frames written incrementally. The file is
+    preallocated with its final header and every segment is flushed once
+    written, a worker that dies midway leaves a valid file with the stem
+    up to the last segment (and silence after it)
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        samples: int,
+        samplerate: int = 44100,
+        channels: int = 2
+    ):
+        size = samples * channels * 2
+        self._file = open(path, 'wb')
+        self._file.write(struct.pack(
+            '<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + size, b'WAVE', b'fmt ', 16,
+            1, channels, samplerate, samplerate * channels * 2, channels * 2,
+            16, b'data', size
+        ))
+        # sparse, the blocks are allocated as the segments are written
+        self._file.truncate(WAV_HEADER_BYTES + size)
+
+    def write(self, source: torch.Tensor) -> None:
+        self._file.write(encoders.to_pcm16(source, inplace=True))
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def separate_stream(
+    model,
+    blocks: Iterable[torch.Tensor],
+    mean: float,
+    std: float,
+    writers: List,
+    shifts: int = 0,
+    overlap: float = 0.25,
+    forward: Optional[Callable] = None,
+    select: Optional[Callable] = None
+) -> int:
+    """
+    Same overlap-add separation as apply_model(split=True) but consuming
+    the input and emitting the output segment by segment, memory is bound
+    by the model segment length instead of the track length.
+    writers receive the denormalized [channels, samples] output of each
+    source as soon as it is final, or of each stem returned by select when
+    it maps the [sources, channels, samples] output to the written stems.
+    The output isn't used once written, writers can convert it in place.
+    Returns the number of samples written.
+    """
+    if forward is None:
+        def forward(chunk):
+            return apply_model(model, chunk, shifts=shifts)
+
+    blocks = iter(blocks)
+    segment = model.segment_length
+    stride = int((1 - overlap) * segment)
+    # context the model reads around a segment (valid length padding and
+    # random shifts), it has to be available on the input buffer so the
+    # result matches the one of a full length input
+    max_shift = int(0.5 * model.samplerate)
+    margin = model.valid_length(segment + 2 * max_shift) - segment + max_shift
+    weight = torch.cat([torch.arange(1, segment // 2 + 1),
+                        torch.arange(segment - segment // 2, 0, -1)])
+    weight = weight / weight.max()
+
+    mix = None
+    mix_start = 0
+    eof = False
+    out = None
+    sum_weight = None
+    out_start = 0
+    offset = 0
+    while True:
+        while not eof and (
+            mix is None or
+            mix_start + mix.shape[-1] < offset + segment + margin
+        ):
+            try:
+                block = (quantize(next(blocks)) - mean) / std
+                mix = block if mix is None else torch.cat([mix, block], -1)
+            except StopIteration:
+                eof = True
+        if mix is None:
+            break
+        mix_end = mix_start + mix.shape[-1]
+        if offset >= mix_end:
+            break
+
+        chunk_out = forward(TensorChunk(mix, offset - mix_start, segment))
+        progress.advance()
+        chunk_length = chunk_out.shape[-1]
+        if out is None:
+            out = chunk_out.new_zeros(chunk_out.shape[:-1] + (segment,))
+            sum_weight = chunk_out.new_zeros(segment)
+            weight = weight.to(chunk_out.device)
+        needed = offset + chunk_length - out_start
+        if needed > out.shape[-1]:
+            grow = needed - out.shape[-1]
+            out = torch.cat(
+                [out, out.new_zeros(out.shape[:-1] + (grow,))], -1
+            )
+            sum_weight = torch.cat([sum_weight, sum_weight.new_zeros(grow)])
+        local = offset - out_start
+        out[..., local:local + chunk_length] += \
+            weight[:chunk_length] * chunk_out
+        sum_weight[local:local + chunk_length] += weight[:chunk_length]
+
+        # later segments start at offset + stride, everything before
+        # that point won't receive more contributions
+        offset += stride
+        final = (mix_end if eof and offset >= mix_end else offset) - out_start
+        final = min(final, out.shape[-1])
+        done = out[..., :final] / sum_weight[:final]
+        done.mul_(std).add_(mean)
+        if select is not None:
+            done = select(done)
+        for source, writer in zip(done, writers):
+            writer.write(source)
+        out = out[..., final:].clone()
+        sum_weight = sum_weight[final:].clone()
+        out_start += final
+
+        keep_from = max(offset - margin, mix_start) - mix_start
+        mix = mix[..., keep_from:].clone()
+        mix_start += keep_from
+    return out_start
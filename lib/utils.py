@@ -3,20 +3,23 @@
 import base64
 import datetime
 import logging
-import os
-from typing import Optional
+from typing import Iterator, List, Optional, Tuple
 from pathlib import Path
-import sqlite3
 import pytube
 import moviepy.editor
 import zipfile
-import pydub
+import lib.db as db
+import lib.metrics as metrics
 
-DOWNLOAD_DB = Path("models/database.db")
+ZIP_CHUNK_SIZE = 64 * 1024
+
+DOWNLOAD_BYTES = metrics.counter(
+    "demucs_download_bytes_total", "Bytes of the zips sent by /download"
+)
 
 
 # TODO make sure to return mp3, this will return mp4
-def video_to_mp3(url) -> Optional[str]:
+def video_to_mp3(url, output_path='songs') -> Optional[str]:
     # catch all exception for Youtube failures,
     try:
         video_filename: str = pytube.YouTube(
@@ -24,19 +27,22 @@ def video_to_mp3(url) -> Optional[str]:
         ).streams.filter(
             progressive=True,
             file_extension='mp4'
-        ).order_by('resolution').desc().first().download(output_path='songs')
-        return mp4_to_mp3(video_filename)
+        ).order_by('resolution').desc().first().download(
+            output_path=output_path
+        )
+        return mp4_to_mp3(video_filename, output_path)
     except Exception as e:
         logging.error(
             f"An error has ocurred while converting the video to mp3: {e}"
         )
 
 
-def mp4_to_mp3(video_filename) -> Optional[str]:
+def mp4_to_mp3(video_filename, output_path='songs') -> Optional[str]:
     video_path = Path(video_filename)
     try:
         video = moviepy.editor.VideoFileClip(str(video_path))
-        mp3_filename = f"songs/{video_path.name.replace('mp4', 'mp3')}"
+        mp3_filename = \
+            f"{output_path}/{video_path.name.replace('mp4', 'mp3')}"
         video.audio.write_audiofile(mp3_filename)
         video_path.unlink()
         return mp3_filename
@@ -51,45 +57,90 @@ def mp4_to_mp3(video_filename) -> Optional[str]:
         logging.error(f"Something went wrong: {e}")
 
 
+def fetch_audio(url, output_path='songs') -> Optional[str]:
+    """
+    Downloads the best audio-only stream of a youtube video as it is
+    (usually opus in webm or aac in mp4), the separation decodes it
+    directly so neither the video nor a transcoded copy are needed
+    """
+    try:
+        return pytube.YouTube(
+            url
+        ).streams.filter(
+            only_audio=True
+        ).order_by('abr').desc().first().download(output_path=output_path)
+    except Exception as e:
+        logging.error(
+            f"An error has ocurred while downloading the audio of {url}: {e}"
+        )
+
+
 def list_songs(path):
-    return [s for s in Path(path).iterdir()]
+    # hidden entries are the caches, not songs
+    return [s for s in Path(path).iterdir() if not s.name.startswith('.')]
 
 
-def zip_files(model, song) -> Optional[Path]:
+class _ZipStream():
     """
-    This function will zip the content of song in model
+    Write only file object that keeps what zipfile writes until it is
+    popped, zipfile handles it as an unseekable stream
     """
-    song_path = Path('separated') / Path(model) / Path(song)
-    download_path = Path('downloads') / Path(f'{song}.zip')
-    # new zipfile will be located in the downloads folder
-    try:
-        with zipfile.ZipFile(download_path, 'w') as archive:
-            logging.debug(f"Creating archive zip file {archive}")
-            with os.scandir(song_path) as target:
-                logging.debug(f"Exploring song's directory {target}")
-                # adding all the files inside the song's directory
-                for f in target:
-                    logging.debug(f"Adding {f} to {archive} ")
-                    archive.write(
-                        f.path,
-                        arcname=f"{song}/{f.name}"
-                    )
-        logging.info("File compressions succesfully completed!")
-        return download_path
-    except FileNotFoundError as fnfe:
-        logging.error(f"Trying to read a song path that doesn't exist: {fnfe}")
-    except Exception as e:
-        logging.error(f"Semething went wrong when creating the zip file {e}")
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def pop(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
 
 
-def db_execute(query, parameters):
-    if not DOWNLOAD_DB.exists():
-        raise FileNotFoundError("DB File doesn't exists or cannot be accessed")
+def stream_zip(song_path: Path, arcname: str) -> Iterator[bytes]:
+    """
+    Generates a zip of the files inside song_path while it is being read,
+    entries are stored (wav stems don't compress) and nothing is written
+    to disk
+    """
+    with metrics.stage("zip"):
+        for chunk in _stream_zip(song_path, arcname):
+            DOWNLOAD_BYTES.inc(len(chunk))
+            yield chunk
+
+
+def _stream_zip(song_path: Path, arcname: str) -> Iterator[bytes]:
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as archive:
+        for f in sorted(Path(song_path).iterdir()):
+            if not f.is_file():
+                continue
+            logging.debug(f"Streaming {f} into {arcname}")
+            info = zipfile.ZipInfo.from_file(f, arcname=f"{arcname}/{f.name}")
+            info.compress_type = zipfile.ZIP_STORED
+            with open(f, 'rb') as source, archive.open(info, 'w') as target:
+                while True:
+                    data = source.read(ZIP_CHUNK_SIZE)
+                    if not data:
+                        break
+                    target.write(data)
+                    yield stream.pop()
+    # the central directory is written when the archive is closed
+    yield stream.pop()
+
+
+def db_execute(query, parameters) -> List[tuple]:
+    """
+    Runs query on a pooled connection and returns all the resulting rows
+    """
     try:
-        with sqlite3.connect(DOWNLOAD_DB) as db:
-            result = db.execute(query, parameters)
-            db.commit()
-            return result
+        with metrics.stage("db"):
+            return db.pool.execute(query, parameters)
     except Exception as e:
         logging.error(
             f"There was an error while excecuting: {query}\
@@ -98,100 +149,84 @@ def db_execute(query, parameters):
         raise
 
 
-def create_new_download(song_path, download_url) -> None:
+def create_new_download(
+    song_path, download_url, song_name: Optional[str] = None
+) -> None:
     try:
         db_execute(
             """
-INSERT INTO downloads (song_path, download_url, accessed)
-values (?, ?, False)""",
-            (song_path, download_url,)
+INSERT INTO downloads (
+    song_path, download_url, accessed, created_at, song_name
+)
+values (?, ?, False, strftime('%s', 'now'), ?)""",
+            (song_path, download_url, song_name,)
         )
     except Exception as e:
         logging.error(f"There was an error when creating new download: {e}")
         raise
 
 
-def disable_download(download_url: str) -> None:
+def claim_download(download_url: str) -> Optional[Tuple[Path, str]]:
+    """
+    Disables download_url and returns its song path and song name in a
+    single statement, so concurrent requests with the same token can't
+    both get the file
+    """
     try:
-        db_execute(
+        result = db_execute(
             """
 UPDATE downloads SET accessed = True
-WHERE download_url = ? AND accessed = False""",
+WHERE download_url = ? AND accessed = False
+RETURNING song_path, song_name""",
             (download_url,)
         )
+        if result:
+            logging.debug(f"Claimed download {download_url}: {result[0]}")
+            song_path, song_name = result[0]
+            # the tokens created before the name was stored zip the folder
+            # under its own name
+            return Path(song_path), song_name or Path(song_path).name
+        logging.debug("Download link not found")
     except Exception as e:
-        logging.debug(f"There was a problem when disabling the download: {e}")
+        logging.error(f"There was an error when claiming the download: {e}")
         raise
 
 
-def get_download_file(download_url: str) -> Optional[Path]:
-    try:
-        logging.debug(f"Attempting to retrieve file: {download_url}")
-        result = db_execute(
-            """
-SELECT song_path FROM downloads
-WHERE download_url=? AND accessed=False""",
-            (download_url,)
-        )
-        song_path_row = result.fetchone()
-        if song_path_row:
-            logging.debug(f"got filepath: {song_path_row}")
-            return Path(song_path_row[0])
-        else:
-            logging.debug("Download link not found")
-    except Exception as e:
-        logging.error(
-            f"There was an error when retrieving the filename from the DB {e}"
-        )
+def parse_time(value: str) -> float:
+    """
+    HH:MM:SS[.ffffff] to seconds
+    """
+    time = datetime.time.fromisoformat(value)
+    return time.hour * 3600 + time.minute * 60 + time.second + \
+        time.microsecond / 1e6
 
 
-def remove_download_file(download_path: Path) -> None:
-    try:
-        if download_path:
-            download_path.unlink()
-        else:
-            logging.warning("The received path is empty/None")
-    except FileNotFoundError:
-        logging.error(f"File {download_path} doesn't exist")
-        raise
-    except Exception as e:
-        logging.error(
-            f"There was a problem removing file: {download_path} - {e}"
+def trim_window(start_time: str, end_time: str) -> Tuple[float, float]:
+    """
+    Seek time and duration in seconds of the start_time - end_time excerpt
+    """
+    seek_time = parse_time(start_time)
+    duration = parse_time(end_time) - seek_time
+    if duration <= 0:
+        raise ValueError(
+            f"end time {end_time} must be after start time {start_time}"
         )
-        raise
+    return seek_time, duration
 
 
-def trim_song(song_path: str, start_time: str, end_time: str) -> Optional[str]:
-    track = Path(song_path)
-    try:
-        start_time_obj = datetime.time.fromisoformat(start_time)
-        end_time_obj = datetime.time.fromisoformat(end_time)
-        start_time_ms = start_time_obj.hour * 3600 * 1000 + \
-            start_time_obj.minute * 60 * 1000 + \
-            start_time_obj.second * 1000 + \
-            start_time_obj.microsecond/1000
-        end_time_ms = end_time_obj.hour * 3600 * 1000 + \
-            end_time_obj.minute * 60 * 1000 + \
-            end_time_obj.second * 1000 + \
-            end_time_obj.microsecond/1000
-        # TODO(avillalobos) make sure these are within range, there will be an
-        # exception I'm sure but we should be defensive here.
-        song = pydub.AudioSegment.from_mp3(track.absolute())
-        extract = song[start_time_ms:end_time_ms]
-        extra_filename = Path(track.parent / Path(track.stem+'-extract.mp3'))
-        extract.export(extra_filename, format="mp3")
-        return track.parent / Path(track.stem+'-extract.mp3')
-    except Exception as e:
-        raise f"There was a problem casting start or end time {e}"
-
-
-def get_download_link(filename: str, model: str) -> str:
-    download = zip_files(model, Path(filename).stem)
+def get_download_link(
+    folder: str, model: str, name: Optional[str] = None
+) -> str:
+    # the zip is generated while it is downloaded, the download only
+    # needs to know where the stems are: the separated/<model>/<folder>
+    # folder of the split, and the song name the zip is named after
+    download = Path('separated') / Path(model) / folder
     download_url = base64.standard_b64encode(
         str(datetime.datetime.today()).encode()
     )
-    try:
-        create_new_download(str(download), download_url.decode())
-    except FileNotFoundError:
-        return "File successfully separated but download not created"
+    # a failed insert (sqlite3.Error) fails the split job, there is no
+    # token to return
+    create_new_download(
+        str(download), download_url.decode(), name or folder
+    )
     return download_url.decode()
@@ -1,31 +1,169 @@
 #!/usr/bin/python3
 
-from typing import Optional
+from pathlib import Path
+from typing import List, Optional
 import graphene
-import logging
-import lib.utils as utils
-from lib.demucs_service import DemucsService
+import lib.config as config
+import lib.encoders as encoders
+import lib.pipeline as pipeline
+from lib.catalog import DEFAULT_LIMIT, MAX_LIMIT, catalog
+from lib.estimator import cost_model, track_seconds
+from lib.jobs import JobQueueFull, jobs
+from lib.presets import DEFAULT_PRESET, PRESETS, check_preset
+from lib.stems import request_stems
+
+
+class Job(graphene.ObjectType):
+    id = graphene.ID()
+    kind = graphene.String()
+    state = graphene.String(
+        description="One of queued, running, completed or failed"
+    )
+    created_at = graphene.Float(description="Epoch when it was queued")
+    started_at = graphene.Float()
+    finished_at = graphene.Float()
+    queued_seconds = graphene.Float()
+    run_seconds = graphene.Float()
+    download_token = graphene.String(
+        description="Token to use on /download/<token> once a split"
+        " completed, null for the other jobs"
+    )
+    result = graphene.String(
+        description="What the job returned: the download token of a split,"
+        " the song filename of musicFromVideo"
+    )
+    error = graphene.String()
+    profile = graphene.Boolean(
+        description="The job is profiled, its results are served on"
+        " /profiles/<id>/profile.txt, profile.pstats and trace.json"
+    )
+    stage = graphene.String(
+        description="Stage of the running job, e.g. download, decode,"
+        " separate or encode. /jobs/<id>/events streams its changes"
+    )
+    percent = graphene.Float(description="Chunks of the stage done")
+    eta_seconds = graphene.Float(description="Time left in the stage")
+
+    def resolve_download_token(self, info):
+        return self.download_token
+
+    def resolve_stage(self, info):
+        return self.progress.stage
+
+    def resolve_percent(self, info):
+        return self.progress.percent
+
+    def resolve_eta_seconds(self, info):
+        return self.progress.eta_seconds
+
+
+class SplitEstimate(graphene.ObjectType):
+    audio_seconds = graphene.Float(description="Seconds of audio separated")
+    cost_per_second = graphene.Float(
+        description="Seconds of separation per second of audio"
+    )
+    measured = graphene.Boolean(
+        description="The cost was measured on the splits of this server"
+        " with the same model, device and preset, rather than extrapolated"
+    )
+    run_seconds = graphene.Float()
+    queue_seconds = graphene.Float(
+        description="Wait for a job worker behind the jobs already queued"
+    )
+    total_seconds = graphene.Float()
+
+
+def wants_profile(info, profile: bool) -> bool:
+    # info.context is the flask request
+    headers = getattr(info.context, "headers", {})
+    if not (profile or headers.get("X-Demucs-Profile") == "1"):
+        return False
+    if not config.PROFILING:
+        raise ValueError("profiling is disabled on this server")
+    return True
+
+
+# stems and preset of split and splitFromUrl
+SPLIT_ARGUMENTS = dict(
+    stems=graphene.List(
+        graphene.String,
+        description="Stems to write, some of drums, bass, other, vocals"
+        " and accompaniment (every source but the vocals). Every source by"
+        " default"
+    ),
+    two_stems=graphene.Boolean(
+        description="Only write vocals and accompaniment"
+    ),
+    preset=graphene.String(
+        description="Quality/latency preset: "
+        + ", ".join(
+            f"{name} ({preset.description})"
+            for name, preset in PRESETS.items()
+        )
+        + f". {DEFAULT_PRESET} by default"
+    )
+)
+
+
+# pagination, filtering and sorting of listSongs and listSeparatedSongs
+LIST_ARGUMENTS = dict(
+    limit=graphene.Int(
+        description=f"Songs per page, {DEFAULT_LIMIT} by default and at"
+        f" most {MAX_LIMIT}"
+    ),
+    offset=graphene.Int(description="Songs skipped before the page"),
+    prefix=graphene.String(description="Only the names starting with it"),
+    search=graphene.String(
+        description="Only the names containing it, case insensitive"
+    ),
+    sort_by=graphene.String(description="name (default) or modified"),
+    descending=graphene.Boolean()
+)
 
 
 class DemucsServiceAPI(graphene.ObjectType):
     split = graphene.String(
-        description="This function will trigger a song split based "
-        "on received parameters",
+        description="This function will queue a song split based "
+        "on received parameters and return the id of the job",
         song=graphene.String(required=True),
         model=graphene.String(),
         device=graphene.String(),
         start_time=graphene.String(),
-        end_time=graphene.String()
+        end_time=graphene.String(),
+        output_format=graphene.String(
+            description="Format of the stems: wav (default), flac, mp3"
+            " or opus"
+        ),
+        bitrate=graphene.Int(
+            description="Bitrate in kbps of the mp3 or opus stems"
+        ),
+        profile=graphene.Boolean(
+            description="Profile the job (also enabled by the"
+            " X-Demucs-Profile: 1 header), requires DEMUCS_PROFILING=1"
+        ),
+        **SPLIT_ARGUMENTS
     )
 
     split_from_url = graphene.String(
-        description="This function will trigger a song split based "
-        "on a youtube video",
+        description="This function will queue a song split based "
+        "on a youtube video and return the id of the job",
         url=graphene.String(required=True),
         model=graphene.String(),
         device=graphene.String(),
         start_time=graphene.String(),
-        end_time=graphene.String()
+        end_time=graphene.String(),
+        output_format=graphene.String(
+            description="Format of the stems: wav (default), flac, mp3"
+            " or opus"
+        ),
+        bitrate=graphene.Int(
+            description="Bitrate in kbps of the mp3 or opus stems"
+        ),
+        profile=graphene.Boolean(
+            description="Profile the job (also enabled by the"
+            " X-Demucs-Profile: 1 header), requires DEMUCS_PROFILING=1"
+        ),
+        **SPLIT_ARGUMENTS
     )
 
     list_songs = graphene.List(
@@ -35,20 +173,48 @@ class DemucsServiceAPI(graphene.ObjectType):
         " youtube videos. Ideally the UI will do a download video"
         " request followed by a list_songs based on the name"
         " based on the name returned by download youtube video",
+        **LIST_ARGUMENTS
     )
 
     list_separated_songs = graphene.List(
         graphene.String,
         description="This endpoint will return all the songs"
         " that were already separated and availabe on the server."
-        " By default it will return all the songs under demucs",
-        model=graphene.String()
+        " By default it will return all the songs under demucs. Every"
+        " split has its own <song>-<id> folder",
+        model=graphene.String(),
+        **LIST_ARGUMENTS
+    )
+
+    estimate_split = graphene.Field(
+        SplitEstimate,
+        description="Predicts how long a split would take from the length"
+        " of the song (or durationSeconds), the preset and the jobs"
+        " already queued, using the costs measured on this server",
+        song=graphene.String(),
+        duration_seconds=graphene.Float(
+            description="Length of the audio, instead of song e.g. before"
+            " a splitFromUrl"
+        ),
+        model=graphene.String(),
+        device=graphene.String(),
+        start_time=graphene.String(),
+        end_time=graphene.String(),
+        preset=graphene.String()
+    )
+
+    job = graphene.Field(
+        Job,
+        description="This endpoint will return the state, timings and"
+        " download token of a split job",
+        id=graphene.ID(required=True)
     )
 
     music_from_video = graphene.String(
-        description="This endpoint will download the MP3 version"
-        " of a youtube video and will store it on the songs directory"
-        " of the session",
+        description="This endpoint will queue the download of the MP3"
+        " version of a youtube video into the songs directory of the"
+        " session and return the id of the job, the filename is the"
+        " result of the job",
         url=graphene.String(required=True)
     )
 
@@ -59,39 +225,48 @@ class DemucsServiceAPI(graphene.ObjectType):
         model: str = "demucs",
         device: str = 'cpu',
         start_time: Optional[str] = None,
-        end_time: Optional[str] = None
+        end_time: Optional[str] = None,
+        output_format: str = "wav",
+        bitrate: Optional[int] = None,
+        profile: bool = False,
+        stems: Optional[List[str]] = None,
+        two_stems: bool = False,
+        preset: str = DEFAULT_PRESET
     ):
-        demucs_srv = DemucsService(model, device)
-        # rather than having a long lasting request,
-        # we should have a job created
-        logging.info(f"running demucs with {model} and {device}")
-        final_song_name = song
-        if start_time and end_time:
-            final_song_name = utils.trim_song(song, start_time, end_time)
-        demucs_srv.split_song(final_song_name)
-        logging.info('demucs completed')
-        return (
-            "Song has been separated succesfully!"
-            " url generated: www.demucs.com/download/"
-            f"{utils.get_download_link(final_song_name, model)}"
-        )
+        try:
+            encoders.check_format(output_format)
+            check_preset(preset)
+            stems = request_stems(stems, two_stems)
+            job = jobs.submit(
+                "split", pipeline.split,
+                song, model, device, start_time, end_time,
+                output_format, bitrate, stems, preset,
+                profile=wants_profile(info, profile), paths=[song]
+            )
+            return job.id
+        except (JobQueueFull, ValueError) as e:
+            return f"Unable to queue the split: {e}"
 
     def resolve_music_from_video(self, info, url):
+        # the download and the transcoding take as long as a split, they
+        # run as a job too
         try:
-            filename = utils.video_to_mp3(url)
-            return filename
-        except Exception as e:
-            return f"Something went wrong when downloading the video {e}"
+            job = jobs.submit(
+                "music_from_video", pipeline.music_from_video, url
+            )
+            return job.id
+        except JobQueueFull as e:
+            return f"Unable to queue the download: {e}"
 
-    def resolve_list_songs(self, info):
+    def resolve_list_songs(self, info, **kwargs):
         try:
-            return utils.list_songs('songs')
+            return catalog.list(Path('songs'), **kwargs)
         except Exception as e:
-            return f"Something went wrong when trying to list songs {e}"
+            return [f"Something went wrong when trying to list songs {e}"]
 
-    def resolve_list_separated_songs(self, info, model='demucs'):
+    def resolve_list_separated_songs(self, info, model='demucs', **kwargs):
         try:
-            return utils.list_songs(f"separated/{model}")
+            return catalog.list(Path('separated') / model, **kwargs)
         except Exception as e:
             return [f"Something went wrong, unable to return songs: {e}"]
 
@@ -102,39 +277,48 @@ class DemucsServiceAPI(graphene.ObjectType):
         model: str = "demucs",
         device: str = 'cpu',
         start_time: Optional[str] = None,
-        end_time: Optional[str] = None
+        end_time: Optional[str] = None,
+        output_format: str = "wav",
+        bitrate: Optional[int] = None,
+        profile: bool = False,
+        stems: Optional[List[str]] = None,
+        two_stems: bool = False,
+        preset: str = DEFAULT_PRESET
     ):
         try:
-            logging.info(
-                f"Received a split from url, trying to fetch video \
-                from Youtube {url} - {model} - {device}"
+            encoders.check_format(output_format)
+            check_preset(preset)
+            stems = request_stems(stems, two_stems)
+            job = jobs.submit(
+                "split_from_url", pipeline.split_from_url,
+                url, model, device, start_time, end_time,
+                output_format, bitrate, stems, preset,
+                profile=wants_profile(info, profile)
             )
-            filename = utils.video_to_mp3(url)
-            if not filename:
-                raise Exception("Failed to convert video to mp4")
-            demucs_srv = DemucsService(model, device)
-            # rather than having a long lasting request,
-            # we should have a job created
-            logging.info(f"running demucs with {model} and {device}")
-            final_song_name = filename
-            if start_time and end_time:
-                final_song_name = utils.trim_song(
-                    filename,
-                    start_time,
-                    end_time
-                )
-            demucs_srv.split_song(final_song_name)
-            logging.info('demucs completed')
-            # filename is the full path to the downloaded song,
-            # we only need the basename for the song
-            try:
-                return (
-                    "Song has been separated succesfully!"
-                    " url generated: www.demucs.com/download/"
-                    f"{utils.get_download_link(final_song_name, model)}"
-                )
-            except Exception as e:
-                return f"Something went wrong: {e}"
+            return job.id
+        except (JobQueueFull, ValueError) as e:
+            return f"Unable to queue the split: {e}"
 
-        except Exception as e:
-            return f"Something went bananas {e}"
+    def resolve_estimate_split(
+        self,
+        info,
+        song: Optional[str] = None,
+        duration_seconds: Optional[float] = None,
+        model: str = "demucs",
+        device: str = 'cpu',
+        start_time: Optional[str] = None,
+        end_time: Optional[str] = None,
+        preset: str = DEFAULT_PRESET
+    ):
+        check_preset(preset)
+        if duration_seconds is None:
+            if song is None:
+                raise ValueError("song or durationSeconds is required")
+            duration_seconds = track_seconds(song, start_time, end_time)
+        return cost_model.estimate(
+            duration_seconds, model, device, preset,
+            jobs.pending(), jobs.workers
+        )
+
+    def resolve_job(self, info, id):
+        return jobs.get(id)
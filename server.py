@@ -1,14 +1,22 @@
 #!/usr/bin/python3
 
+import lib.config as config
+import lib.metrics as metrics
+import lib.profiling as profiling
 import lib.utils as utils
+import json
 import logging
+import threading
 import graphene
-from flask import Flask, send_file, after_this_request
+from flask import Flask, Response, send_file, stream_with_context
 from flask_graphql import GraphQLView
 from models.api import DemucsServiceAPI
+from lib.janitor import janitor
+from lib.jobs import events, jobs
+from lib.model_registry import registry
 from pathlib import Path
 from flask_cors import CORS
-from typing import Optional
+from typing import Callable, Optional, Tuple
 
 
 class DemucsInternalException(Exception):
@@ -17,10 +25,37 @@ class DemucsInternalException(Exception):
         super().__init__(msg)
 
 
+DOWNLOADS_REJECTED = metrics.counter(
+    "demucs_downloads_rejected_total",
+    "Downloads refused because DEMUCS_MAX_DOWNLOADS were in progress"
+)
+EVENT_STREAMS_REJECTED = metrics.counter(
+    "demucs_event_streams_rejected_total",
+    "Job event streams refused because DEMUCS_MAX_EVENT_STREAMS were open"
+)
+
+# comment sent on the job events when nothing changed, so proxies don't
+# close the connection
+EVENTS_KEEPALIVE_SECONDS = 15
+
+# every download holds a server thread until the client read the whole zip
+download_slots = threading.BoundedSemaphore(config.MAX_DOWNLOADS) \
+    if config.MAX_DOWNLOADS > 0 else None
+# and every job event stream until its job is done
+event_slots = threading.BoundedSemaphore(config.MAX_EVENT_STREAMS) \
+    if config.MAX_EVENT_STREAMS > 0 else None
+
 app = Flask(__name__)
 CORS(app)
 schema = graphene.Schema(query=DemucsServiceAPI)
 
+# loading a model takes longer than most of the requests, so the models
+# configured in DEMUCS_PRELOAD_MODELS are loaded and warmed up on boot
+if config.PRELOAD_MODELS:
+    registry.preload(
+        config.PRELOAD_MODELS, config.PRELOAD_DEVICE, config.INFERENCE
+    )
+
 
 @app.errorhandler(FileNotFoundError)
 def file_not_found(err):
@@ -34,38 +69,125 @@ def internal_error(err):
     return "The file you are trying to access is not longer available", 500
 
 
+def limited(
+    slots: Optional[threading.BoundedSemaphore],
+    rejected: metrics.Counter,
+    message: str,
+    respond: Callable[[], Response]
+) -> Response:
+    """
+    respond() holding one of slots until the response is closed (sent or
+    the client went away), a 503 right away when they are all taken
+    """
+    if slots is None:
+        return respond()
+    if not slots.acquire(blocking=False):
+        rejected.inc()
+        return Response(message, status=503, headers={"Retry-After": "5"})
+    try:
+        response = respond()
+    except Exception:
+        slots.release()
+        raise
+    response.call_on_close(slots.release)
+    return response
+
+
 @app.route('/download/<token>')
 def gen_download(token):
     logging.info(f"Received download request for: {token}")
-    download_file: Optional[Path] = utils.get_download_file(token)
-    if download_file:
-        try:
-            # if download_file is not None, then this token
-            # was found on the DB
-            utils.disable_download(token)
-            failed = False
-
-            @after_this_request
-            def remove_file(response):
-                if not failed:
-                    try:
-                        utils.remove_download_file(download_file)
-                    except Exception as e:
-                        logging.error(f"Unable to remove the download: {e}")
-                return response
-
-            return send_file(
-                download_file,
-                as_attachment=True,
-                attachment_filename=download_file.name,
-                mimetype='application/zip'
-            )
-        except Exception as e:
-            failed = True
-            logging.error(f"An error ocurred while handling your request {e}")
-            raise DemucsInternalException(e) from e
-    else:
+    # refused before the token is claimed, so the client can retry it
+    return limited(
+        download_slots, DOWNLOADS_REJECTED,
+        "Too many downloads in progress, try again later",
+        lambda: download(token)
+    )
+
+
+def download(token) -> Response:
+    try:
+        # the token is disabled in the same statement that looks it up,
+        # so it can only be used once even with concurrent requests
+        claimed: Optional[Tuple[Path, str]] = utils.claim_download(token)
+    except Exception as e:
+        logging.error(f"An error ocurred while handling your request {e}")
+        raise DemucsInternalException(e) from e
+    if not claimed:
         raise FileNotFoundError("The download request is not longer available")
+    # the folder of the split carries its id, the zip is named after the
+    # song
+    song_path, song_name = claimed
+    if not song_path.is_dir():
+        raise FileNotFoundError(f"{song_path} is not longer available")
+    # the claimed token no longer protects the stems, the janitor leaves
+    # them alone until the zip is sent (or the client went away)
+    release = janitor.hold(song_path)
+    try:
+        # the zip is generated while it is sent, so the first bytes
+        # reach the client right away and nothing is written to disk
+        response = Response(
+            stream_with_context(
+                utils.stream_zip(song_path, song_name)
+            ),
+            mimetype='application/zip',
+            headers={
+                "Content-Disposition":
+                f'attachment; filename="{song_name}.zip"'
+            }
+        )
+    except Exception as e:
+        release()
+        logging.error(f"An error ocurred while handling your request {e}")
+        raise DemucsInternalException(e) from e
+    response.call_on_close(release)
+    return response
+
+
+@app.route('/jobs/<job_id>/events')
+def gen_job_events(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        raise FileNotFoundError(f"There is no job {job_id}")
+
+    def stream():
+        for snapshot in events(job, EVENTS_KEEPALIVE_SECONDS):
+            if snapshot is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: progress\ndata: {json.dumps(snapshot)}\n\n"
+
+    # server-sent events, the stream ends once the job is done
+    return limited(
+        event_slots, EVENT_STREAMS_REJECTED,
+        "Too many job event streams, try again later or poll the job query",
+        lambda: Response(
+            stream_with_context(stream()),
+            mimetype='text/event-stream',
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    )
+
+
+@app.route('/profiles/<job_id>/<name>')
+def gen_profile(job_id, name):
+    folder = profiling.profile_folder(job_id)
+    if not config.PROFILING or folder is None or \
+            name not in profiling.PROFILE_FILES:
+        raise FileNotFoundError(f"There is no profile {job_id}/{name}")
+    path = folder / name
+    if not path.is_file():
+        raise FileNotFoundError(f"There is no profile {job_id}/{name}")
+    return send_file(
+        str(path.resolve()), mimetype=profiling.PROFILE_FILES[name]
+    )
+
+
+@app.route('/metrics')
+def gen_metrics():
+    return Response(
+        metrics.registry.render(),
+        mimetype='text/plain; version=0.0.4'
+    )
 
 
 app.add_url_rule(
@@ -78,4 +200,6 @@ app.add_url_rule(
 )
 
 if __name__ == "__main__":
+    if config.JANITOR_INTERVAL_SECONDS > 0:
+        janitor.start(config.JANITOR_INTERVAL_SECONDS)
     app.run(host='0.0.0.0', port=5000)
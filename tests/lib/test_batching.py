@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+
+import testslide
+import unittest
+import torch
+from unittest import mock
+import lib.batching as batching
+from lib.batching import BatchScheduler, apply_batched
+from lib.demucs.demucs.model import Demucs
+from lib.demucs.demucs.utils import apply_model
+
+
+class RecordingModel(torch.nn.Module):
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+        self.sources = model.sources
+        self.segment_length = model.segment_length
+        self.batch_sizes = []
+
+    def valid_length(self, length):
+        return self.model.valid_length(length)
+
+    def forward(self, mix):
+        self.batch_sizes.append(mix.shape[0])
+        return self.model(mix)
+
+
+class TestBatching(testslide.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        torch.manual_seed(0)
+        self.model = RecordingModel(Demucs(
+            ["drums", "bass", "other", "vocals"],
+            channels=4, depth=2, segment_length=44100
+        ).eval())
+
+    def test_apply_batched_matches_apply_model(self):
+        scheduler = BatchScheduler(self.model, max_batch=4, max_wait=1)
+        wav = torch.randn(2, 3 * 44100 + 1234) * 0.1
+        try:
+            result = apply_batched(scheduler, wav)
+        finally:
+            scheduler.close()
+
+        expected = apply_model(self.model.model, wav, split=True)
+        self.assertTrue(torch.allclose(result, expected, atol=1e-5))
+        # 3 full segments batched together and the 2 shorter last ones
+        self.assertEqual(sorted(self.model.batch_sizes), [1, 1, 3])
+
+    def test_submit_batches_songs_together(self):
+        scheduler = BatchScheduler(self.model, max_batch=2, max_wait=1)
+        length = self.model.valid_length(44100)
+        try:
+            first = scheduler.submit(torch.randn(2, length))
+            second = scheduler.submit(torch.randn(2, length))
+            self.assertEqual(first.result().shape[:2], (4, 2))
+            self.assertEqual(second.result().shape[:2], (4, 2))
+        finally:
+            scheduler.close()
+
+        self.assertEqual(self.model.batch_sizes, [2])
+
+    def test_submit_does_not_wait_past_max_wait(self):
+        scheduler = BatchScheduler(self.model, max_batch=8, max_wait=0.01)
+        length = self.model.valid_length(44100)
+        try:
+            scheduler.submit(torch.randn(2, length)).result(timeout=10)
+        finally:
+            scheduler.close()
+
+        self.assertEqual(self.model.batch_sizes, [1])
+
+    def test_submit_failure(self):
+        scheduler = BatchScheduler(self.model, max_batch=1, max_wait=0)
+        try:
+            future = scheduler.submit(torch.randn(3))
+            with self.assertRaises(Exception):
+                future.result(timeout=10)
+        finally:
+            scheduler.close()
+
+    def test_close_runs_the_queued_segments(self):
+        scheduler = BatchScheduler(self.model, max_batch=8, max_wait=1)
+        length = self.model.valid_length(44100)
+        futures = [scheduler.submit(torch.randn(2, length)) for _ in range(2)]
+        scheduler.close()
+
+        for future in futures:
+            self.assertEqual(future.result(timeout=10).shape[:2], (4, 2))
+
+    def test_replaced_scheduler_still_separates(self):
+        patcher = mock.patch.dict(batching._schedulers, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        length = self.model.valid_length(44100)
+        first = batching.get_scheduler("bench", "cpu", self.model)
+        # the registry loaded the model again while a song holds first
+        reloaded = RecordingModel(self.model.model)
+        second = batching.get_scheduler("bench", "cpu", reloaded)
+        try:
+            self.assertIsNot(first, second)
+            result = first.submit(torch.randn(2, length)).result(timeout=10)
+            self.assertEqual(result.shape[:2], (4, 2))
+            self.assertEqual(self.model.batch_sizes, [1])
+        finally:
+            second.close()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
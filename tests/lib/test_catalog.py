@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+
+import os
+import tempfile
+import testslide
+import unittest
+from pathlib import Path
+from lib.catalog import MAX_LIMIT, Catalog
+from lib.db import ConnectionPool
+
+
+class TestCatalog(testslide.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.pool = ConnectionPool(self.root / "database.db", 2)
+        self.catalog = Catalog(self.pool)
+        self.songs = self.root / "songs"
+        self.songs.mkdir()
+        for age, name in enumerate(["b.mp3", "a2.mp3", "Live.mp3", "a1.mp3"]):
+            path = self.songs / name
+            path.write_bytes(b"0")
+            os.utime(path, (1000 - age, 1000 - age))
+        (self.songs / ".cache").mkdir()
+
+    def tearDown(self) -> None:
+        self.pool.close()
+        self.tmp.cleanup()
+        super().tearDown()
+
+    def _names(self, **kwargs):
+        return [Path(p).name for p in self.catalog.list(self.songs, **kwargs)]
+
+    def test_list_reconciles_on_first_use(self):
+        self.assertEqual(
+            ["Live.mp3", "a1.mp3", "a2.mp3", "b.mp3"], self._names()
+        )
+        self.assertEqual(
+            [str(self.songs / "Live.mp3")],
+            self.catalog.list(self.songs, limit=1)
+        )
+
+    def test_pagination(self):
+        self.assertEqual(["a1.mp3", "a2.mp3"], self._names(limit=2, offset=1))
+        self.assertEqual([], self._names(offset=10))
+
+    def test_prefix_and_search(self):
+        self.assertEqual(["a1.mp3", "a2.mp3"], self._names(prefix="a"))
+        self.assertEqual(["Live.mp3"], self._names(search="live"))
+
+    def test_sort_by_modified(self):
+        self.assertEqual(
+            ["b.mp3", "a2.mp3", "Live.mp3", "a1.mp3"],
+            self._names(sort_by="modified", descending=True)
+        )
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            self.catalog.list(self.songs, sort_by="size")
+        with self.assertRaises(ValueError):
+            self.catalog.list(self.songs, limit=MAX_LIMIT + 1)
+
+    def test_add_and_remove(self):
+        self._names()
+        song = self.songs / "c.mp3"
+        song.write_bytes(b"0")
+        self.catalog.add(song)
+        # relative and absolute paths of the same folder are the same
+        self.catalog.remove(Path(os.path.relpath(self.songs / "b.mp3")))
+
+        self.assertEqual(
+            ["Live.mp3", "a1.mp3", "a2.mp3", "c.mp3"], self._names()
+        )
+
+    def test_reconcile(self):
+        self._names()
+        (self.songs / "b.mp3").unlink()
+        (self.songs / "d.mp3").write_bytes(b"0")
+
+        self.catalog.reconcile_all()
+
+        self.assertEqual(
+            ["Live.mp3", "a1.mp3", "a2.mp3", "d.mp3"], self._names()
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
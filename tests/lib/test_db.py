@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+
+import sqlite3
+import tempfile
+import threading
+import testslide
+import unittest
+from pathlib import Path
+from lib.db import MIGRATIONS, ConnectionPool
+
+
+class TestConnectionPool(testslide.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / "models" / "database.db"
+        self.pool = ConnectionPool(self.path, 4)
+
+    def tearDown(self) -> None:
+        self.pool.close()
+        self.tmp.cleanup()
+        super().tearDown()
+
+    def _insert(self, token: str) -> None:
+        self.pool.execute(
+            "INSERT INTO downloads (song_path, download_url, accessed) "
+            "VALUES (?, ?, False)",
+            (f"separated/demucs/{token}", token)
+        )
+
+    def test_creates_schema(self):
+        self._insert("token")
+
+        self.assertTrue(self.path.exists())
+        self.assertEqual(
+            [(len(MIGRATIONS),)], self.pool.execute("PRAGMA user_version")
+        )
+        indexes = self.pool.execute("PRAGMA index_list(downloads)")
+        self.assertIn("downloads_download_url", [row[1] for row in indexes])
+        self.assertEqual(
+            [("wal",)], self.pool.execute("PRAGMA journal_mode")
+        )
+
+    def test_migrates_existing_database(self):
+        self.path.parent.mkdir(parents=True)
+        with sqlite3.connect(self.path) as db:
+            db.execute(MIGRATIONS[0])
+            db.execute(
+                "INSERT INTO downloads (song_path, download_url, accessed) "
+                "VALUES ('song', 'token', False)"
+            )
+            db.execute("PRAGMA user_version = 1")
+        db.close()
+
+        self.assertEqual(
+            [("song",)],
+            self.pool.execute(
+                "SELECT song_path FROM downloads WHERE download_url = ?",
+                ("token",)
+            )
+        )
+        self.assertEqual(
+            [(len(MIGRATIONS),)], self.pool.execute("PRAGMA user_version")
+        )
+
+    def test_reuses_connections(self):
+        for _ in range(10):
+            self.pool.execute("SELECT 1")
+
+        self.assertEqual(1, self.pool._created)
+
+    def test_rollback_on_error(self):
+        with self.assertRaises(sqlite3.OperationalError):
+            with self.pool.connection() as db:
+                db.execute(
+                    "INSERT INTO downloads (song_path, download_url, "
+                    "accessed) VALUES ('song', 'token', False)"
+                )
+                db.execute("SELECT * FROM missing")
+
+        self.assertEqual([], self.pool.execute("SELECT * FROM downloads"))
+
+    def test_concurrent_claim(self):
+        self._insert("token")
+        barrier = threading.Barrier(4)
+        claimed = []
+
+        def claim():
+            barrier.wait()
+            claimed.extend(self.pool.execute(
+                "UPDATE downloads SET accessed = True "
+                "WHERE download_url = ? AND accessed = False "
+                "RETURNING song_path",
+                ("token",)
+            ))
+
+        threads = [threading.Thread(target=claim) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([("separated/demucs/token",)], claimed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+
+import os
+import tempfile
+import testslide
+import unittest
+import torch
+from pathlib import Path
+from unittest import mock
+from scipy.io import wavfile
+import lib.batching as batching
+import lib.config as config
+import lib.demucs_service as demucs_service
+import lib.fast_inference as fast_inference
+from lib.demucs.demucs.model import Demucs
+
+
+class TestDemucsService(testslide.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        torch.manual_seed(0)
+        # the service writes under separated/ of the working directory
+        self.tmp = tempfile.TemporaryDirectory()
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.addCleanup(os.chdir, cwd)
+        self.model = Demucs(
+            ["drums", "bass", "other", "vocals"],
+            channels=4, depth=2, segment_length=44100
+        ).eval()
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+        super().tearDown()
+
+    def _service(self, inference: str, **kwargs):
+        model = self.model if inference == "eager" else \
+            fast_inference.optimize(self.model, "fp32")
+        self.mock_callable(
+            demucs_service.registry, "get"
+        ).for_call(
+            "demucs", "cpu", inference
+        ).to_return_value(model)
+        return demucs_service.DemucsService(
+            "demucs", "cpu", inference=inference, **kwargs
+        )
+
+    def test_separate_batched_fast_inference(self):
+        # the sources of the fast models are inference tensors, the stems
+        # are still selected and converted in place
+        self.patch_attribute(config, "BATCH_MAX_SIZE", 4)
+        patcher = mock.patch.dict(batching._schedulers, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        service = self._service("fast", stems=["vocals", "accompaniment"])
+        folder = Path("separated/demucs/song")
+        wav = torch.randn(2, 2 * 44100 + 1234) * 0.1
+
+        try:
+            service._separate(wav, folder)
+        finally:
+            for scheduler in batching._schedulers.values():
+                scheduler.close()
+
+        for stem in ("vocals", "accompaniment"):
+            samplerate, pcm = wavfile.read(str(folder / f"{stem}.wav"))
+            self.assertEqual(samplerate, 44100)
+            self.assertEqual(pcm.shape, (2 * 44100 + 1234, 2))
+        self.assertFalse((folder / "drums.wav").exists())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+import shutil
+import subprocess
+import tempfile
+import testslide
+import unittest
+import numpy as np
+import torch
+from pathlib import Path
+import lib.encoders as encoders
+
+
+class TestEncoders(testslide.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = Path(self.tmp.name)
+        t = torch.arange(44100) / 44100
+        self.source = 0.5 * torch.stack(
+            [torch.sin(2 * np.pi * 440 * t), torch.cos(2 * np.pi * 440 * t)]
+        )
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+        super().tearDown()
+
+    def test_to_pcm16(self):
+        pcm = encoders.to_pcm16(torch.tensor([[1., -1.], [0.5, 0.]]))
+        self.assertEqual(pcm.dtype, np.int16)
+        np.testing.assert_array_equal(
+            pcm, np.array([[32767, 16384], [-32768, 0]])
+        )
+
+    def test_to_pcm16_inplace(self):
+        source = self.source.clone()
+        expected = (source * 2**15).clamp_(-2**15, 2**15 - 1).short().t()
+
+        pcm = encoders.to_pcm16(source, inplace=True)
+        self.assertTrue(pcm.flags["C_CONTIGUOUS"])
+        np.testing.assert_array_equal(pcm, expected.numpy())
+        # the source was scaled and clamped in place
+        self.assertTrue(torch.equal(source, self.source * 2**15))
+
+    def test_check_format(self):
+        encoders.check_format("flac")
+        with self.assertRaises(ValueError):
+            encoders.check_format("ogg")
+
+    def test_ffmpeg_command_bitrate(self):
+        command = encoders.ffmpeg_command(Path("vocals.mp3"), "mp3", 192)
+        self.assertEqual(
+            command[-5:], ["-c:a", "libmp3lame", "-b:a", "192k", "vocals.mp3"]
+        )
+        command = encoders.ffmpeg_command(Path("vocals.opus"), "opus", None)
+        self.assertIn("160k", command)
+        command = encoders.ffmpeg_command(Path("vocals.flac"), "flac", 192)
+        self.assertNotIn("-b:a", command)
+
+    def test_encode_stems_wav(self):
+        pcm = encoders.to_pcm16(self.source)
+        paths = encoders.encode_stems(
+            {"bass": pcm, "vocals": pcm}, self.folder, "wav"
+        )
+        self.assertEqual(
+            paths, [self.folder / "bass.wav", self.folder / "vocals.wav"]
+        )
+        self.assertTrue(all(path.stat().st_size > 0 for path in paths))
+
+    @unittest.skipIf(shutil.which("ffmpeg") is None, "ffmpeg not installed")
+    def test_encode_stems_compressed(self):
+        pcm = encoders.to_pcm16(self.source)
+        for output_format in ["flac", "mp3", "opus"]:
+            path, = encoders.encode_stems(
+                {"vocals": pcm}, self.folder, output_format
+            )
+            self.assertEqual(path.suffix, f".{output_format}")
+            self.assertLess(path.stat().st_size, pcm.nbytes)
+
+    def test_encode_stem_failure(self):
+        self.mock_callable(
+            encoders.sp, "run"
+        ).to_raise(
+            subprocess.CalledProcessError(1, "ffmpeg")
+        ).and_assert_called_once()
+
+        with self.assertRaises(subprocess.CalledProcessError):
+            encoders.encode_stem(
+                encoders.to_pcm16(self.source),
+                self.folder / "vocals.flac",
+                "flac"
+            )
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
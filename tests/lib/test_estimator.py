@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+
+import tempfile
+import testslide
+import unittest
+import numpy as np
+from pathlib import Path
+from scipy.io import wavfile
+from lib.estimator import CostModel, track_seconds
+from lib.presets import PRESETS
+
+
+class TestEstimator(testslide.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.costs = CostModel(default_cost=0.5, smoothing=0.5)
+
+    def test_default_cost_is_scaled_by_preset(self):
+        self.assertEqual(
+            (0.5, False), self.costs.cost("demucs", "cpu", "standard")
+        )
+        cost, measured = self.costs.cost("demucs", "cpu", "high_quality")
+        self.assertFalse(measured)
+        self.assertAlmostEqual(0.5 * PRESETS["high_quality"].shifts, cost)
+        with self.assertRaises(ValueError):
+            self.costs.cost("demucs", "cpu", "best")
+
+    def test_record(self):
+        self.costs.record("demucs", "cpu", "standard", 100, 40)
+        self.assertEqual(
+            (0.4, True), self.costs.cost("demucs", "cpu", "standard")
+        )
+        # moving average
+        self.costs.record("demucs", "cpu", "standard", 100, 20)
+        self.assertAlmostEqual(
+            0.3, self.costs.cost("demucs", "cpu", "standard")[0]
+        )
+        # other presets are extrapolated from the measured standard one
+        cost, measured = self.costs.cost("demucs", "cpu", "preview")
+        self.assertFalse(measured)
+        self.assertAlmostEqual(0.3 * PRESETS["preview"].relative_cost, cost)
+        # other models aren't
+        self.assertEqual(0.5, self.costs.cost("tasnet", "cpu", "standard")[0])
+
+    def test_estimate_queue(self):
+        self.costs.record("demucs", "cpu", "standard", 100, 50)
+
+        idle = self.costs.estimate(200, "demucs", "cpu", "standard",
+                                   pending=1, workers=2)
+        self.assertEqual(100, idle["run_seconds"])
+        self.assertEqual(0, idle["queue_seconds"])
+
+        # 2 running and 2 queued, this one starts after 2 waves of splits
+        busy = self.costs.estimate(200, "demucs", "cpu", "standard",
+                                   pending=4, workers=2)
+        self.assertEqual(100, busy["queue_seconds"])
+        self.assertEqual(200, busy["total_seconds"])
+
+    def test_track_seconds(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            song = Path(tmp) / "song.wav"
+            silence = np.zeros((44100 * 90, 2), dtype=np.int16)
+            wavfile.write(str(song), 44100, silence)
+            self.assertAlmostEqual(90, track_seconds(str(song)), places=1)
+            self.assertAlmostEqual(
+                30, track_seconds(str(song), "00:01:00", "00:02:00"),
+                places=1
+            )
+        with self.assertRaises(FileNotFoundError):
+            track_seconds(str(song))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+
+import testslide
+import unittest
+import torch
+import lib.fast_inference as fast_inference
+from lib.demucs.demucs.model import Demucs
+from lib.demucs.demucs.utils import apply_model
+
+
+class TestFastInference(testslide.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        torch.manual_seed(0)
+        self.model = Demucs(
+            ["drums", "bass", "other", "vocals"],
+            channels=4, depth=2, segment_length=44100
+        ).eval()
+        # a segment and a shorter last one
+        self.wav = torch.randn(2, 44100 + 20000) * 0.1
+        self.expected = apply_model(self.model, self.wav, split=True).detach()
+
+    def _snr(self, result):
+        noise = (result - self.expected).pow(2).sum()
+        return 10 * torch.log10(self.expected.pow(2).sum() / noise).item()
+
+    def test_fp32_traced_matches_eager(self):
+        fast = fast_inference.optimize(self.model, "fp32")
+        self.assertIsNotNone(fast._traced)
+        self.assertEqual(fast.sources, self.model.sources)
+
+        result = apply_model(fast, self.wav, split=True)
+        self.assertFalse(result.requires_grad)
+        self.assertTrue(torch.allclose(result, self.expected, atol=1e-5))
+
+    def test_int8_is_close(self):
+        fast = fast_inference.optimize(self.model, "int8", trace=False)
+        self.assertIsNone(fast._traced)
+
+        result = apply_model(fast, self.wav, split=True)
+        self.assertGreater(self._snr(result), 30)
+        # the original model isn't quantized in place
+        self.assertIsInstance(self.model.lstm.lstm, torch.nn.LSTM)
+
+    def test_bf16_falls_back_without_native_support(self):
+        self.mock_callable(
+            fast_inference, "bf16_supported"
+        ).to_return_value(False).and_assert_called_once()
+
+        fast = fast_inference.optimize(self.model, "bf16", trace=False)
+        self.assertEqual("fp32", fast.precision)
+
+    def test_unsupported_settings(self):
+        with self.assertRaises(ValueError):
+            fast_inference.optimize(self.model, "int4")
+        with self.assertRaises(ValueError):
+            fast_inference.check_inference("turbo")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+
+import shutil
+import tempfile
+import threading
+import time
+import testslide
+import unittest
+from pathlib import Path
+from lib.db import ConnectionPool
+from lib.ingest_cache import IngestCache, video_id
+
+URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+class TestIngestCache(testslide.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.pool = ConnectionPool(self.root / "database.db", 4)
+        self.cache = IngestCache(self.root / "cache", 1024, 3600, self.pool)
+        self.songs = self.root / "songs"
+        self.downloads = []
+
+    def tearDown(self) -> None:
+        self.pool.close()
+        self.tmp.cleanup()
+        super().tearDown()
+
+    def _download(self, size=100, name="song.webm"):
+        def download(url, folder):
+            self.downloads.append(url)
+            # pytube creates the output folder
+            Path(folder).mkdir(parents=True, exist_ok=True)
+            path = Path(folder) / name
+            path.write_bytes(b"0" * size)
+            return str(path)
+        return download
+
+    def test_video_id(self):
+        self.assertEqual("dQw4w9WgXcQ", video_id(URL))
+        self.assertEqual(
+            "dQw4w9WgXcQ", video_id("https://youtu.be/dQw4w9WgXcQ?t=42")
+        )
+        self.assertIsNone(video_id("https://example.com/song"))
+
+    def test_hit(self):
+        first = self.cache.fetch(URL, "audio", self._download(), self.songs)
+        second = self.cache.fetch(
+            "https://youtu.be/dQw4w9WgXcQ", "audio", self._download(),
+            self.songs
+        )
+
+        self.assertEqual(str(self.songs / "dQw4w9WgXcQ-song.webm"), first)
+        self.assertEqual(first, second)
+        self.assertEqual([URL], self.downloads)
+        self.assertEqual({"hits": 1, "misses": 1}, self.cache.stats())
+        self.assertEqual(
+            [(1,)], self.pool.execute("SELECT hits FROM ingest_cache")
+        )
+
+    def test_kinds_are_cached_separately(self):
+        self.cache.fetch(URL, "audio", self._download(), self.songs)
+        self.cache.fetch(
+            URL, "mp3", self._download(name="song.mp3"), self.songs
+        )
+
+        self.assertEqual(2, len(self.downloads))
+
+    def test_failed_download(self):
+        self.assertIsNone(
+            self.cache.fetch(URL, "audio", lambda url, folder: None)
+        )
+        self.cache.fetch(URL, "audio", self._download(), self.songs)
+
+        self.assertEqual(1, len(self.downloads))
+        self.assertEqual({"hits": 0, "misses": 2}, self.cache.stats())
+
+    def test_expired_entry_is_downloaded_again(self):
+        self.cache.fetch(URL, "audio", self._download(), self.songs)
+        self.pool.execute(
+            "UPDATE ingest_cache SET created_at = ?", (time.time() - 7200,)
+        )
+        self.cache.fetch(URL, "audio", self._download(), self.songs)
+
+        self.assertEqual(2, len(self.downloads))
+
+    def test_evicts_least_recently_used(self):
+        urls = [f"https://youtu.be/video000{i}xx" for i in range(3)]
+        for url in urls[:2]:
+            self.cache.fetch(url, "audio", self._download(400), self.songs)
+        # the first video is now more recently used than the second one
+        self.cache.fetch(urls[0], "audio", self._download(400), self.songs)
+        self.cache.fetch(urls[2], "audio", self._download(400), self.songs)
+
+        self.assertEqual(
+            ["video0000xx", "video0002xx"],
+            sorted(row[0] for row in self.pool.execute(
+                "SELECT video_id FROM ingest_cache"
+            ))
+        )
+        self.assertFalse((self.root / "cache" / "video0001xx-audio").exists())
+        # the copy in songs outlives the eviction
+        self.assertTrue((self.songs / "video0001xx-song.webm").exists())
+
+    def test_concurrent_fetches_download_once(self):
+        release = threading.Event()
+
+        def slow_download(url, folder):
+            release.wait()
+            return self._download()(url, folder)
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                self.cache.fetch(URL, "audio", slow_download, self.songs)
+            ))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, len(self.downloads))
+        self.assertEqual(
+            [str(self.songs / "dQw4w9WgXcQ-song.webm")] * 4, results
+        )
+
+    def test_entry_evicted_after_lookup(self):
+        self.cache.fetch(URL, "audio", self._download(), self.songs)
+        evicted = []
+
+        def evict_after_lookup(original, vid, kind):
+            entry = original(vid, kind)
+            if entry is not None and not evicted:
+                # another request evicts it before it is materialized
+                shutil.rmtree(entry.parent)
+                evicted.append(entry)
+            return entry
+
+        self.mock_callable(self.cache, "_lookup").with_wrapper(
+            evict_after_lookup
+        )
+        other = self.root / "other"
+        result = self.cache.fetch(URL, "audio", self._download(), other)
+
+        self.assertEqual(str(other / "dQw4w9WgXcQ-song.webm"), result)
+        self.assertTrue(Path(result).is_file())
+        self.assertEqual(1, len(evicted))
+        self.assertEqual(2, len(self.downloads))
+
+    def test_same_title_different_videos(self):
+        first = self.cache.fetch(URL, "audio", self._download(), self.songs)
+        second = self.cache.fetch(
+            "https://youtu.be/video0000xx", "audio", self._download(200),
+            self.songs
+        )
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(100, Path(first).stat().st_size)
+        self.assertEqual(200, Path(second).stat().st_size)
+
+    def test_disabled(self):
+        cache = IngestCache(self.root / "cache", 0, 3600, self.pool)
+        cache.fetch(URL, "audio", self._download(), self.songs)
+        cache.fetch(URL, "audio", self._download(), self.songs)
+
+        self.assertEqual(2, len(self.downloads))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+
+import os
+import tempfile
+import time
+import testslide
+import unittest
+from pathlib import Path
+from lib.catalog import Catalog
+from lib.db import ConnectionPool
+from lib.janitor import Janitor, Policy
+
+HOUR = 3600
+
+
+class TestJanitor(testslide.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.pool = ConnectionPool(self.root / "database.db", 2)
+        self.songs = self.root / "songs"
+        self.separated = self.root / "separated"
+        self.songs.mkdir()
+        self.separated.mkdir()
+
+    def tearDown(self) -> None:
+        self.pool.close()
+        self.tmp.cleanup()
+        super().tearDown()
+
+    def _janitor(self, ttl=HOUR, max_bytes=0) -> Janitor:
+        return Janitor(
+            [
+                Policy(self.songs, ttl, max_bytes),
+                Policy(self.separated, ttl, max_bytes, depth=2),
+            ],
+            HOUR,
+            self.pool,
+            Catalog(self.pool)
+        )
+
+    def _song(self, name, size=100, age=0) -> Path:
+        path = self.songs / name
+        path.write_bytes(b"0" * size)
+        os.utime(path, (time.time() - age, time.time() - age))
+        return path
+
+    def _stems(self, name, size=100, age=0) -> Path:
+        folder = self.separated / "demucs" / name
+        folder.mkdir(parents=True)
+        for stem in ["drums", "bass", "other", "vocals"]:
+            path = folder / f"{stem}.wav"
+            path.write_bytes(b"0" * size)
+            os.utime(path, (time.time() - age, time.time() - age))
+        os.utime(folder, (time.time() - age, time.time() - age))
+        return folder
+
+    def test_removes_expired(self):
+        old = self._song("old.mp3", age=2 * HOUR)
+        new = self._song("new.mp3")
+        old_stems = self._stems("old", age=2 * HOUR)
+        new_stems = self._stems("new")
+
+        reclaimed = self._janitor().sweep()
+
+        self.assertEqual(
+            {str(self.songs): 100, str(self.separated): 400}, reclaimed
+        )
+        self.assertFalse(old.exists())
+        self.assertFalse(old_stems.exists())
+        self.assertTrue(new.exists())
+        self.assertTrue(new_stems.exists())
+
+    def test_quota_removes_oldest_first(self):
+        oldest = self._song("oldest.mp3", age=30)
+        older = self._song("older.mp3", age=20)
+        newest = self._song("newest.mp3", age=10)
+        janitor = self._janitor(ttl=0, max_bytes=150)
+
+        janitor.sweep()
+
+        self.assertFalse(oldest.exists())
+        self.assertFalse(older.exists())
+        self.assertTrue(newest.exists())
+        self.assertEqual(200, janitor.reclaimed_bytes)
+
+    def test_in_use_is_kept(self):
+        song = self._song("song.mp3", age=2 * HOUR)
+        stems = self._stems("song", age=2 * HOUR)
+        janitor = self._janitor()
+
+        with janitor.in_use(song, stems):
+            janitor.sweep()
+            self.assertTrue(song.exists())
+            self.assertTrue(stems.exists())
+        janitor.sweep()
+
+        self.assertFalse(song.exists())
+        self.assertFalse(stems.exists())
+
+    def test_unexpired_token_is_kept(self):
+        claimed = self._stems("claimed", age=2 * HOUR)
+        unclaimed = self._stems("unclaimed", age=2 * HOUR)
+        expired = self._stems("expired", age=2 * HOUR)
+        for folder, accessed, created_at in [
+            (claimed, True, time.time()),
+            (unclaimed, False, time.time()),
+            (expired, False, time.time() - 2 * HOUR),
+        ]:
+            self.pool.execute(
+                "INSERT INTO downloads "
+                "(song_path, download_url, accessed, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                (str(folder), folder.name, accessed, created_at)
+            )
+
+        self._janitor().sweep()
+
+        self.assertFalse(claimed.exists())
+        self.assertTrue(unclaimed.exists())
+        self.assertFalse(expired.exists())
+
+    def test_hidden_entries_are_skipped(self):
+        cache = self.songs / ".cache"
+        cache.mkdir()
+        os.utime(cache, (time.time() - 2 * HOUR, time.time() - 2 * HOUR))
+
+        self._janitor(ttl=HOUR, max_bytes=1).sweep()
+
+        self.assertTrue(cache.exists())
+
+    def test_missing_directories(self):
+        janitor = Janitor(
+            [Policy(self.root / "downloads", HOUR, 1)], HOUR, self.pool,
+            Catalog(self.pool)
+        )
+
+        self.assertEqual({str(self.root / "downloads"): 0}, janitor.sweep())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+
+import threading
+import time
+import testslide
+import unittest
+import tempfile
+from pathlib import Path
+import lib.config as config
+import lib.progress as progress
+from lib.janitor import janitor
+from lib.jobs import COMPLETED, FAILED, Job, JobManager, JobQueueFull, events
+
+
+class TestJobManager(testslide.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.manager = JobManager(workers=1, max_pending=2, history=10)
+
+    def tearDown(self) -> None:
+        self.manager.shutdown()
+        super().tearDown()
+
+    def test_submit_completed(self):
+        job = self.manager.submit("split", lambda song: f"token-{song}", "a")
+        self.manager.shutdown()
+
+        self.assertEqual(job.state, COMPLETED)
+        self.assertEqual(job.result, "token-a")
+        self.assertIsNone(job.error)
+        self.assertGreaterEqual(job.run_seconds, 0)
+        self.assertIs(self.manager.get(job.id), job)
+        self.assertEqual(self.manager.pending(), 0)
+
+    def test_submit_failed(self):
+        def boom():
+            raise Exception("Boom!")
+
+        job = self.manager.submit("split", boom)
+        self.manager.shutdown()
+
+        self.assertEqual(job.state, FAILED)
+        self.assertEqual(job.error, "Boom!")
+        self.assertIsNone(job.result)
+
+    def test_submit_profiled(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.patch_attribute(config, "PROFILES_DIR", tmp)
+
+            job = self.manager.submit(
+                "split", lambda song: f"token-{song}", "a", profile=True
+            )
+            self.manager.shutdown()
+
+            self.assertEqual(job.result, "token-a")
+            self.assertTrue(
+                (Path(tmp) / job.id / "profile.pstats").is_file()
+            )
+            self.assertIn(
+                "<lambda>", (Path(tmp) / job.id / "profile.txt").read_text()
+            )
+
+    def test_submit_queue_full(self):
+        release = threading.Event()
+        self.manager.submit("split", release.wait)
+        self.manager.submit("split", release.wait)
+        try:
+            with self.assertRaises(JobQueueFull):
+                self.manager.submit("split", release.wait)
+        finally:
+            release.set()
+
+    def test_paths_are_held_until_the_job_finished(self):
+        song = Path("songs/held.mp3").resolve()
+        release = threading.Event()
+        # the first job keeps the only worker busy, the second one is queued
+        self.manager.submit("split", release.wait)
+        self.manager.submit("split", lambda: None, paths=["songs/held.mp3"])
+        self.assertIn(song, janitor.protected())
+
+        release.set()
+        self.manager.shutdown()
+        self.assertNotIn(song, janitor.protected())
+
+    def test_queue_full_releases_the_paths(self):
+        song = Path("songs/rejected.mp3").resolve()
+        release = threading.Event()
+        self.manager.submit("split", release.wait)
+        self.manager.submit("split", release.wait)
+        try:
+            with self.assertRaises(JobQueueFull):
+                self.manager.submit(
+                    "split", release.wait, paths=["songs/rejected.mp3"]
+                )
+            self.assertNotIn(song, janitor.protected())
+        finally:
+            release.set()
+
+    def test_finished_jobs_are_forgotten(self):
+        manager = JobManager(workers=1, max_pending=10, history=1)
+        first = manager.submit("split", lambda: "first")
+        while not first.done:
+            time.sleep(0.01)
+        second = manager.submit("split", lambda: "second")
+        manager.shutdown()
+
+        self.assertIsNone(manager.get(first.id))
+        self.assertIs(manager.get(second.id), second)
+
+    def test_events(self):
+        release = threading.Event()
+
+        def separate():
+            progress.stage("separate", 2)
+            progress.advance()
+            release.wait()
+            progress.advance()
+            return "token"
+
+        job = self.manager.submit("split", separate)
+        stream = events(job, keepalive=0.01)
+        snapshot = next(stream)
+        while snapshot is None or snapshot["percent"] != 50:
+            snapshot = next(stream)
+        self.assertEqual("separate", snapshot["stage"])
+        self.assertIsNone(next(stream))
+        release.set()
+
+        snapshots = [s for s in stream if s is not None]
+        self.assertEqual(COMPLETED, snapshots[-1]["state"])
+        self.assertEqual(100, snapshots[-1]["percent"])
+        self.assertEqual("token", snapshots[-1]["download_token"])
+
+    def test_snapshot_download_token(self):
+        split = Job("split")
+        split.result = "token"
+        video = Job("music_from_video")
+        video.result = "songs/video.mp3"
+
+        self.assertEqual("token", split.snapshot()["download_token"])
+        self.assertIsNone(video.snapshot()["download_token"])
+        self.assertEqual("songs/video.mp3", video.snapshot()["result"])
+
+    def test_get_unknown_job(self):
+        self.assertIsNone(self.manager.get("NotARealJob"))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
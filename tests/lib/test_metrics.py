@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+
+import testslide
+import time
+import unittest
+import lib.metrics as metrics
+
+
+class TestMetrics(testslide.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        counter = self.registry.register(
+            metrics.Counter("requests_total", "Requests", ["result"])
+        )
+        counter.inc(result="hit")
+        counter.inc(2, result="miss")
+        counter.inc(result="hit")
+
+        self.assertEqual(
+            "# HELP requests_total Requests\n"
+            "# TYPE requests_total counter\n"
+            'requests_total{result="hit"} 2\n'
+            'requests_total{result="miss"} 2\n',
+            self.registry.render()
+        )
+
+    def test_histogram(self):
+        histogram = self.registry.register(
+            metrics.Histogram("seconds", "Time", ["stage"], buckets=(1, 5))
+        )
+        for value in [0.5, 1, 3, 10]:
+            histogram.observe(value, stage="decode")
+
+        self.assertEqual(
+            "# HELP seconds Time\n"
+            "# TYPE seconds histogram\n"
+            'seconds_bucket{stage="decode",le="1"} 2\n'
+            'seconds_bucket{stage="decode",le="5"} 3\n'
+            'seconds_bucket{stage="decode",le="+Inf"} 4\n'
+            'seconds_sum{stage="decode"} 14.5\n'
+            'seconds_count{stage="decode"} 4\n',
+            self.registry.render()
+        )
+
+    def test_callback(self):
+        self.registry.register(
+            metrics.Callback("pending", "Pending jobs", lambda: 3)
+        )
+        self.registry.register(metrics.Callback(
+            "model_bytes", "Loaded models",
+            lambda: [({"model": 'say "hi"'}, 10)]
+        ))
+
+        self.assertEqual(
+            "# HELP pending Pending jobs\n"
+            "# TYPE pending gauge\n"
+            "pending 3\n"
+            "# HELP model_bytes Loaded models\n"
+            "# TYPE model_bytes gauge\n"
+            'model_bytes{model="say \\"hi\\""} 10\n',
+            self.registry.render()
+        )
+
+    def test_register_twice_keeps_first(self):
+        first = self.registry.register(metrics.Counter("total", "Total"))
+        second = self.registry.register(metrics.Counter("total", "Total"))
+
+        self.assertIs(first, second)
+
+    def test_stage(self):
+        count = metrics.STAGE_SECONDS.count(stage="test")
+        errors = metrics.ERRORS.value(stage="test")
+
+        with metrics.stage("test"):
+            pass
+        with self.assertRaises(ValueError):
+            with metrics.stage("test"):
+                raise ValueError("Boom!")
+
+        self.assertEqual(count + 2, metrics.STAGE_SECONDS.count(stage="test"))
+        self.assertEqual(errors + 1, metrics.ERRORS.value(stage="test"))
+
+    def test_stage_exclude(self):
+        count = metrics.STAGE_SECONDS.count(stage="test_write")
+        total = metrics.STAGE_SECONDS.sum(stage="test_run")
+        timer = metrics.Timer("test_write")
+
+        with metrics.stage("test_run", exclude=timer):
+            with timer.time():
+                time.sleep(0.05)
+        timer.observe()
+
+        self.assertGreaterEqual(timer.seconds, 0.05)
+        self.assertLess(
+            metrics.STAGE_SECONDS.sum(stage="test_run") - total, 0.05
+        )
+        self.assertEqual(
+            count + 1, metrics.STAGE_SECONDS.count(stage="test_write")
+        )
+
+    def test_timer_errors(self):
+        errors = metrics.ERRORS.value(stage="test_write")
+        timer = metrics.Timer("test_write")
+
+        with self.assertRaises(ValueError):
+            with timer.time():
+                raise ValueError("Boom!")
+
+        self.assertEqual(errors + 1, metrics.ERRORS.value(stage="test_write"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+
+import testslide
+import unittest
+import torch
+from lib.fast_inference import FastModel
+from lib.model_registry import ModelRegistry, model_size
+
+
+class TestModelRegistry(testslide.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        # a Linear(16, 16) holds 272 float32 values
+        self.fake_model_size = model_size(torch.nn.Linear(16, 16))
+        self.registry = ModelRegistry(2 * self.fake_model_size)
+
+    def test_get_loads_model_once(self):
+        self.mock_callable(
+            self.registry, "load"
+        ).for_call(
+            "demucs", "cpu"
+        ).with_implementation(
+            lambda model, device: torch.nn.Linear(16, 16)
+        ).and_assert_called_once()
+
+        first = self.registry.get("demucs", "cpu")
+        second = self.registry.get("demucs", "cpu")
+        self.assertIs(first, second)
+
+    def test_get_evicts_least_recently_used(self):
+        self.mock_callable(
+            self.registry, "load"
+        ).with_implementation(
+            lambda model, device: torch.nn.Linear(16, 16)
+        ).and_assert_called_exactly(3)
+
+        self.registry.get("demucs", "cpu")
+        self.registry.get("tasnet", "cpu")
+        # demucs becomes the most recently used one
+        self.registry.get("demucs", "cpu")
+        self.registry.get("light", "cpu")
+
+        self.assertEqual(
+            [key for key, _ in self.registry.loaded()],
+            [("demucs", "cpu", "eager"), ("light", "cpu", "eager")]
+        )
+
+    def test_get_fast_model(self):
+        eager = torch.nn.Linear(16, 16)
+        fast = torch.nn.Linear(16, 16)
+        self.mock_callable(
+            self.registry, "load"
+        ).for_call(
+            "demucs", "cpu"
+        ).to_return_value(eager).and_assert_called_once()
+        self.mock_callable(
+            self.registry, "optimize"
+        ).for_call(
+            eager, "demucs"
+        ).to_return_value(fast).and_assert_called_once()
+
+        self.assertIs(fast, self.registry.get("demucs", "cpu", "fast"))
+        self.assertIs(fast, self.registry.get("demucs", "cpu", "fast"))
+        # the eager model is cached alongside the fast one
+        self.assertIs(eager, self.registry.get("demucs", "cpu"))
+
+    def test_get_evicts_fast_model_with_its_eager_model(self):
+        self.mock_callable(
+            self.registry, "load"
+        ).with_implementation(
+            lambda model, device: torch.nn.Linear(16, 16)
+        ).and_assert_called_exactly(2)
+        self.mock_callable(
+            self.registry, "optimize"
+        ).with_implementation(
+            lambda loaded, model: torch.nn.Linear(16, 16)
+        ).and_assert_called_once()
+
+        self.registry.get("demucs", "cpu", "fast")
+        # the fast model keeps the eager one alive, they are evicted
+        # together
+        self.registry.get("tasnet", "cpu")
+
+        self.assertEqual(
+            [key for key, _ in self.registry.loaded()],
+            [("tasnet", "cpu", "eager")]
+        )
+
+    def test_model_size_of_fast_models(self):
+        eager = torch.nn.Sequential(torch.nn.Linear(16, 16))
+        quantized = torch.ao.quantization.quantize_dynamic(
+            eager, {torch.nn.Linear}, dtype=torch.qint8
+        )
+
+        # the int8 weights are packed, outside of parameters()
+        self.assertEqual([], list(quantized.parameters()))
+        size = model_size(FastModel(eager, quantized, "int8"), shared=eager)
+        self.assertLess(16 * 16, size)
+        self.assertLess(size, self.fake_model_size)
+        # an fp32 fast model runs the weights of the eager one
+        self.assertEqual(
+            0, model_size(FastModel(eager, eager, "fp32"), shared=eager)
+        )
+
+    def test_preload_warms_up_models(self):
+        fake_model = torch.nn.Linear(16, 16)
+        self.mock_callable(
+            self.registry, "load"
+        ).for_call(
+            "demucs", "cpu"
+        ).to_return_value(fake_model).and_assert_called_once()
+        self.mock_callable(
+            self.registry, "warm_up"
+        ).for_call(
+            fake_model, "cpu"
+        ).to_return_value(None).and_assert_called_once()
+
+        self.registry.preload(["demucs"], "cpu")
+
+    def test_preload_failure_is_not_fatal(self):
+        self.mock_callable(
+            self.registry, "load"
+        ).to_raise(FileNotFoundError).and_assert_called_once()
+        self.mock_callable(
+            self.registry, "warm_up"
+        ).and_assert_not_called()
+
+        self.registry.preload(["notreal"], "cpu")
+        self.assertEqual(self.registry.loaded(), [])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
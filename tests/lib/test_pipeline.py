@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+
+import testslide
+import unittest
+from pathlib import Path
+from unittest import mock
+import lib.config as config
+import lib.pipeline as pipeline
+from lib.process_pool import process_pool
+
+
+class TestPipeline(testslide.TestCase):
+
+    def test_split_song_process_mode(self):
+        self.patch_attribute(config, "EXECUTION_MODE", "process")
+        self.mock_callable(
+            process_pool, "split_song"
+        ).for_call(
+            "demucs", "cpu", "songs/song.mp3", {"output_format": "flac"}
+        ).to_return_value(None).and_assert_called_once()
+        self.mock_constructor(
+            pipeline, "DemucsService"
+        ).and_assert_not_called()
+
+        pipeline.split_song(
+            "demucs", "cpu", "songs/song.mp3", {"output_format": "flac"}
+        )
+
+    def test_split_song_thread_mode(self):
+        self.patch_attribute(config, "EXECUTION_MODE", "thread")
+        self.mock_callable(
+            process_pool, "split_song"
+        ).and_assert_not_called()
+        fake_service = testslide.StrictMock(
+            pipeline.DemucsService, runtime_attrs=["split_song"]
+        )
+        self.mock_callable(
+            fake_service, "split_song"
+        ).for_call("songs/song.mp3").to_return_value(
+            None
+        ).and_assert_called_once()
+        self.mock_constructor(
+            pipeline, "DemucsService"
+        ).for_call("demucs", "cpu").to_return_value(fake_service)
+
+        pipeline.split_song("demucs", "cpu", "songs/song.mp3")
+
+    def test_split_song_records_cost(self):
+        self.patch_attribute(config, "EXECUTION_MODE", "thread")
+        fake_service = testslide.StrictMock(
+            pipeline.DemucsService, runtime_attrs=["split_song"]
+        )
+        self.mock_callable(
+            fake_service, "split_song"
+        ).for_call("songs/song.mp3").to_return_value(
+            30.0
+        ).and_assert_called_once()
+        self.mock_constructor(
+            pipeline, "DemucsService"
+        ).for_call(
+            "demucs", "cpu", preset="preview"
+        ).to_return_value(fake_service)
+        recorded = []
+        self.mock_callable(
+            pipeline.cost_model, "record"
+        ).with_implementation(
+            lambda *args: recorded.append(args)
+        ).and_assert_called_once()
+
+        pipeline.split_song(
+            "demucs", "cpu", "songs/song.mp3", {"preset": "preview"}
+        )
+        self.assertEqual(("demucs", "cpu", "preview", 30.0), recorded[0][:4])
+
+    def test_separator_class(self):
+        self.assertIs(pipeline.DemucsService, pipeline.separator_class())
+        # patch_attribute deletes falsy attributes when it restores them
+        with mock.patch.object(
+            config, "SEPARATOR", "benchmarks.fake_separator:FakeSeparator"
+        ):
+            self.assertEqual(
+                "FakeSeparator", pipeline.separator_class().__name__
+            )
+
+    def test_split_excerpt(self):
+        patcher = mock.patch.object(
+            pipeline.uuid, "uuid4", return_value=mock.Mock(hex="job1")
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_callable(
+            pipeline, "split_song"
+        ).for_call(
+            "demucs", "cpu", "songs/song.mp3",
+            {
+                "output_format": "wav", "bitrate": None, "stems": None,
+                "preset": "standard"
+            },
+            name="song-extract-job1", seek_time=90.0, duration=30.0
+        ).to_return_value(None).and_assert_called_once()
+        self.mock_callable(
+            pipeline.catalog, "add"
+        ).for_call(
+            Path("separated/demucs/song-extract-job1")
+        ).to_return_value(None).and_assert_called_once()
+        self.mock_callable(
+            pipeline.utils, "get_download_link"
+        ).for_call(
+            "song-extract-job1", "demucs", "song-extract"
+        ).to_return_value("token").and_assert_called_once()
+
+        self.assertEqual(
+            "token",
+            pipeline.split("songs/song.mp3", start_time="00:01:30",
+                           end_time="00:02:00")
+        )
+
+    def test_splits_write_their_own_folder(self):
+        names = []
+        self.mock_callable(pipeline, "split_song").with_implementation(
+            lambda *args, name, **kwargs: names.append(name)
+        )
+        self.mock_callable(pipeline.catalog, "add").to_return_value(None)
+        downloads = []
+        self.mock_callable(
+            pipeline.utils, "get_download_link"
+        ).with_implementation(
+            lambda folder, model, name: downloads.append(name) or "token"
+        )
+
+        pipeline.split("songs/song.mp3")
+        pipeline.split("songs/song.mp3", output_format="flac")
+
+        self.assertEqual(2, len(set(names)))
+        self.assertTrue(all(name.startswith("song-") for name in names))
+        # the downloads are still named after the song
+        self.assertEqual(["song", "song"], downloads)
+
+    def test_music_from_video(self):
+        self.mock_callable(
+            pipeline.ingest_cache, "fetch"
+        ).for_call(
+            "https://youtu.be/video", "mp3", pipeline.utils.video_to_mp3
+        ).to_return_value("songs/video.mp3").and_assert_called_once()
+        self.mock_callable(
+            pipeline.catalog, "add"
+        ).for_call(
+            Path("songs/video.mp3")
+        ).to_return_value(None).and_assert_called_once()
+
+        self.assertEqual(
+            "songs/video.mp3",
+            pipeline.music_from_video("https://youtu.be/video")
+        )
+
+    def test_music_from_video_failed_download(self):
+        self.mock_callable(
+            pipeline.ingest_cache, "fetch"
+        ).to_return_value(None).and_assert_called_once()
+        self.mock_callable(pipeline.catalog, "add").and_assert_not_called()
+
+        with self.assertRaises(Exception):
+            pipeline.music_from_video("https://youtu.be/NotARealURL")
+
+    def test_split_from_url_failed_download(self):
+        self.mock_callable(
+            pipeline.ingest_cache, "fetch"
+        ).for_call(
+            "https://youtu.be/NotARealURL", "audio", pipeline.utils.fetch_audio
+        ).to_return_value(None).and_assert_called_once()
+
+        with self.assertRaises(Exception):
+            pipeline.split_from_url("https://youtu.be/NotARealURL")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
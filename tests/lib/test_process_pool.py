@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+
+import multiprocessing
+import os
+import testslide
+import unittest
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+import lib.process_pool as process_pool
+from lib.process_pool import ProcessPool, _init_worker
+
+
+class FakeExecutor():
+
+    def __init__(self, error=None):
+        self.error = error
+        self.shut_down = False
+
+    def submit(self, fn, *args):
+        future = Future()
+        if self.error:
+            future.set_exception(self.error)
+        else:
+            future.set_result(30.0)
+        return future
+
+    def shutdown(self, wait=True):
+        self.shut_down = True
+
+
+class TestProcessPool(testslide.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.mock_callable(
+            process_pool.torch, "set_num_threads"
+        ).to_return_value(None)
+        self.mock_callable(
+            process_pool.torch, "set_num_interop_threads"
+        ).to_return_value(None)
+        self.mock_callable(
+            os, "sched_getaffinity"
+        ).to_return_value({0, 1, 2, 3, 4, 5, 6, 7})
+
+    def _pinned_cores(self, workers, threads):
+        counter = multiprocessing.Value('i', 0)
+        pinned = []
+        self.mock_callable(os, "sched_setaffinity").with_implementation(
+            lambda pid, cores: pinned.append(cores)
+        )
+        for _ in range(workers):
+            _init_worker(counter, threads, 1, True)
+        return pinned
+
+    def test_workers_are_pinned_to_their_own_cores(self):
+        self.assertEqual(
+            [[0, 1], [2, 3], [4, 5], [6, 7]], self._pinned_cores(4, 2)
+        )
+
+    def test_pinning_wraps_around_the_cores(self):
+        self.assertEqual(
+            [[0, 1, 2, 3], [4, 5, 6, 7], [0, 1, 2, 3]],
+            self._pinned_cores(3, 4)
+        )
+
+    def test_no_pinning(self):
+        self.mock_callable(os, "sched_setaffinity").and_assert_not_called()
+        _init_worker(multiprocessing.Value('i', 0), 2, 1, False)
+
+    def test_broken_pool_is_replaced(self):
+        pool = ProcessPool(2, 1)
+        broken = FakeExecutor(BrokenProcessPool("a worker died"))
+        pool._executor = broken
+
+        with self.assertRaises(BrokenProcessPool):
+            pool.split_song("demucs", "cpu", "songs/song.mp3")
+        self.assertTrue(broken.shut_down)
+        self.assertIsNone(pool._executor)
+
+        replacement = FakeExecutor()
+        self.mock_constructor(
+            process_pool, "ProcessPoolExecutor"
+        ).with_implementation(
+            lambda **kwargs: replacement
+        ).and_assert_called_once()
+        self.assertEqual(
+            30.0, pool.split_song("demucs", "cpu", "songs/song.mp3")
+        )
+        self.assertIs(replacement, pool._executor)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
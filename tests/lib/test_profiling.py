@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+
+import json
+import pstats
+import tempfile
+import testslide
+import unittest
+from unittest import mock
+import torch
+from pathlib import Path
+import lib.config as config
+import lib.profiling as profiling
+
+
+class TestProfiling(testslide.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = Path(self.tmp.name) / "job"
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+        super().tearDown()
+
+    def test_profile_folder(self):
+        self.patch_attribute(config, "PROFILES_DIR", self.tmp.name)
+        job_id = "0123456789abcdef0123456789abcdef"
+
+        self.assertEqual(
+            Path(self.tmp.name) / job_id, profiling.profile_folder(job_id)
+        )
+        self.assertIsNone(profiling.profile_folder("../../etc"))
+
+    def test_capture(self):
+        with profiling.capture(self.folder):
+            with profiling.torch_profile():
+                torch.ones(8, 8).matmul(torch.ones(8, 8))
+
+        stats = pstats.Stats(str(self.folder / "profile.pstats"))
+        self.assertTrue(
+            any("matmul" in function for _, _, function in stats.stats)
+        )
+        self.assertTrue((self.folder / "profile.txt").is_file())
+        trace = json.loads((self.folder / "trace.json").read_text())
+        events = [event.get("name") for event in trace["traceEvents"]]
+        self.assertIn("aten::matmul", events)
+
+    def test_capture_while_cprofile_busy(self):
+        self.assertTrue(profiling._cprofile_lock.acquire(blocking=False))
+        self.addCleanup(profiling._cprofile_lock.release)
+
+        with profiling.capture(self.folder):
+            with profiling.torch_profile():
+                torch.ones(8, 8).matmul(torch.ones(8, 8))
+
+        self.assertFalse((self.folder / "profile.pstats").exists())
+        self.assertTrue((self.folder / "trace.json").is_file())
+        self.assertIsNone(profiling._active.folder)
+
+    def test_capture_other_profiling_tool(self):
+        class BusyProfile():
+
+            def enable(self):
+                # what python 3.12+ raises when cProfile is already enabled
+                raise ValueError("Another profiling tool is already active")
+
+        # testslide refuses to patch_attribute a class
+        patcher = mock.patch.object(
+            profiling.cProfile, "Profile", BusyProfile
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        with profiling.capture(self.folder):
+            pass
+
+        self.assertFalse((self.folder / "profile.pstats").exists())
+        self.assertIsNone(profiling._active.folder)
+        # the next capture can use cProfile
+        self.assertTrue(profiling._cprofile_lock.acquire(blocking=False))
+        profiling._cprofile_lock.release()
+
+    def test_torch_profile_without_capture(self):
+        with profiling.torch_profile():
+            torch.ones(8, 8).matmul(torch.ones(8, 8))
+
+        self.assertFalse(self.folder.exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
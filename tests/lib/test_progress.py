@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+
+import threading
+import testslide
+import unittest
+import lib.progress as progress
+from lib.progress import Progress
+
+
+class FakeModel():
+    segment_length = 100
+
+    def __call__(self, x):
+        return x * 2
+
+
+class TestProgress(testslide.TestCase):
+
+    def test_percent_and_eta(self):
+        tracker = Progress()
+        tracker.start_stage("separate", 4)
+        self.assertEqual(0, tracker.percent)
+        self.assertIsNone(tracker.eta_seconds)
+
+        tracker.advance()
+        self.assertEqual(25, tracker.percent)
+        self.assertGreaterEqual(tracker.eta_seconds, 0)
+
+        tracker.start_stage("encode")
+        self.assertIsNone(tracker.percent)
+
+    def test_chunks(self):
+        # a stride of 75 samples
+        self.assertEqual(4, progress.chunks(300, 100))
+        self.assertEqual(5, progress.chunks(301, 100))
+
+    def test_tracking(self):
+        tracker = Progress()
+        model = FakeModel()
+        self.assertIs(model, progress.counting(model))
+        progress.stage("decode")
+        self.assertIsNone(tracker.stage)
+
+        with progress.tracking(tracker):
+            progress.stage("separate", 2)
+            counted = progress.counting(model)
+            self.assertEqual(4, counted(2))
+            self.assertEqual(100, counted.segment_length)
+
+        self.assertEqual("separate", tracker.stage)
+        self.assertEqual(50, tracker.percent)
+        progress.advance()
+        self.assertEqual(50, tracker.percent)
+
+    def test_wait(self):
+        tracker = Progress()
+        version = tracker.version
+        self.assertEqual(version, tracker.wait(version, timeout=0.01))
+
+        threading.Timer(0.01, tracker.touch).start()
+        self.assertNotEqual(version, tracker.wait(version, timeout=5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+
+import os
+import tempfile
+import threading
+import testslide
+import time
+import unittest
+import torch
+from pathlib import Path
+from lib.result_cache import ResultCache, make_key
+
+
+class TestResultCache(testslide.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.cache = ResultCache(self.root / "cache", 1024 * 1024, 3600)
+        self.computed = []
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+        super().tearDown()
+
+    def _compute(self, size=4):
+        def compute(folder: Path):
+            self.computed.append(folder)
+            folder.mkdir()
+            for name in ["drums", "bass", "other", "vocals"]:
+                (folder / f"{name}.wav").write_bytes(b"0" * size)
+        return compute
+
+    def test_make_key(self):
+        wav = torch.zeros(2, 10)
+        self.assertEqual(
+            make_key(wav, model="demucs", shifts=0),
+            make_key(wav.clone(), shifts=0, model="demucs")
+        )
+        self.assertNotEqual(
+            make_key(wav, model="demucs", shifts=0),
+            make_key(wav, model="demucs", shifts=1)
+        )
+        self.assertNotEqual(
+            make_key(wav, model="demucs"),
+            make_key(torch.ones(2, 10), model="demucs")
+        )
+
+    def test_fetch_or_compute_hit(self):
+        first = self.root / "first"
+        second = self.root / "second"
+
+        self.assertFalse(
+            self.cache.fetch_or_compute("key", first, self._compute())
+        )
+        self.assertTrue(
+            self.cache.fetch_or_compute("key", second, self._compute())
+        )
+
+        self.assertEqual(len(self.computed), 1)
+        self.assertEqual(
+            sorted(f.name for f in second.iterdir()),
+            ["bass.wav", "drums.wav", "other.wav", "vocals.wav"]
+        )
+
+    def test_fetch_or_compute_single_flight(self):
+        started = threading.Event()
+        release = threading.Event()
+        compute = self._compute()
+
+        def slow_compute(folder):
+            started.set()
+            release.wait()
+            compute(folder)
+
+        hits = []
+        leader = threading.Thread(
+            target=lambda: hits.append(self.cache.fetch_or_compute(
+                "key", self.root / "leader", slow_compute
+            ))
+        )
+        leader.start()
+        started.wait()
+        follower = threading.Thread(
+            target=lambda: hits.append(self.cache.fetch_or_compute(
+                "key", self.root / "follower", compute
+            ))
+        )
+        follower.start()
+        release.set()
+        leader.join()
+        follower.join()
+
+        self.assertEqual(len(self.computed), 1)
+        self.assertEqual(sorted(hits), [False, True])
+        self.assertTrue((self.root / "follower" / "vocals.wav").exists())
+
+    def test_fetch_or_compute_failure_is_not_cached(self):
+        def boom(folder):
+            raise Exception("Boom!")
+
+        with self.assertRaises(Exception):
+            self.cache.fetch_or_compute("key", self.root / "song", boom)
+
+        self.assertFalse(
+            self.cache.fetch_or_compute(
+                "key", self.root / "song", self._compute()
+            )
+        )
+        self.assertEqual(
+            [e.name for e in (self.root / "cache").iterdir()], ["key"]
+        )
+
+    def test_fetch_or_compute_concurrent_processes(self):
+        # the process workers have their own cache objects on the same root
+        other = ResultCache(self.root / "cache", 1024 * 1024, 3600)
+
+        def compute(folder):
+            self._compute()(folder)
+            other.fetch_or_compute("key", self.root / "other", self._compute())
+
+        self.assertFalse(
+            self.cache.fetch_or_compute("key", self.root / "song", compute)
+        )
+        self.assertEqual(len(self.computed), 2)
+        self.assertEqual(
+            [e.name for e in (self.root / "cache").iterdir()], ["key"]
+        )
+        self.assertEqual(
+            sorted(f.name for f in (self.root / "song").iterdir()),
+            ["bass.wav", "drums.wav", "other.wav", "vocals.wav"]
+        )
+
+    def test_eviction(self):
+        # every entry takes 4 stems of 128KB
+        cache = ResultCache(self.root / "cache", 1024 * 1024, 3600)
+        for key in ["a", "b", "c"]:
+            cache.fetch_or_compute(
+                key, self.root / key, self._compute(128 * 1024)
+            )
+
+        self.assertEqual(
+            sorted(e.name for e in (self.root / "cache").iterdir()),
+            ["b", "c"]
+        )
+        # evicted entries don't remove the stems already handed out
+        self.assertTrue((self.root / "a" / "vocals.wav").exists())
+
+    def test_stale_partial_entries_are_removed(self):
+        # folders left by separations that crashed midway, the second one
+        # is still being written
+        stale = self.root / "cache" / ".a.0123"
+        running = self.root / "cache" / ".b.4567"
+        (self.root / "cache").mkdir()
+        for partial in [stale, running]:
+            self._compute()(partial)
+        hours_ago = time.time() - 2 * 3600
+        for path in [stale, *stale.iterdir()]:
+            os.utime(path, (hours_ago, hours_ago))
+
+        self.cache.fetch_or_compute(
+            "key", self.root / "song", self._compute()
+        )
+
+        self.assertFalse(stale.exists())
+        self.assertTrue(running.is_dir())
+
+    def test_disabled(self):
+        cache = ResultCache(self.root / "cache", 0, 3600)
+        cache.fetch_or_compute("key", self.root / "song", self._compute())
+        cache.fetch_or_compute("key", self.root / "song2", self._compute())
+
+        self.assertEqual(len(self.computed), 2)
+        self.assertFalse((self.root / "cache").exists())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
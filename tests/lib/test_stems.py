@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+
+import testslide
+import unittest
+import torch
+from lib.stems import (
+    SOURCES, TWO_STEMS, check_stems, request_stems, select
+)
+
+
+class TestStems(testslide.TestCase):
+
+    def test_check_stems(self):
+        self.assertIsNone(check_stems(None))
+        self.assertEqual(
+            ["bass", "vocals"], check_stems(["vocals", "bass", "vocals"])
+        )
+        with self.assertRaises(ValueError):
+            check_stems(["guitar"])
+        with self.assertRaises(ValueError):
+            check_stems([])
+
+    def test_request_stems(self):
+        self.assertIsNone(request_stems(None, False))
+        self.assertEqual(TWO_STEMS, request_stems(None, True))
+        self.assertEqual(["drums"], request_stems(["drums"], False))
+        with self.assertRaises(ValueError):
+            request_stems(["drums"], True)
+
+    def test_select(self):
+        # source i is a constant i + 1
+        sources = torch.stack([
+            torch.full((2, 10), float(i + 1)) for i in range(len(SOURCES))
+        ])
+
+        self.assertEqual(4, len(select(sources, SOURCES, None)))
+        vocals, accompaniment = select(sources, SOURCES, TWO_STEMS)
+        self.assertTrue(torch.equal(vocals, sources[3]))
+        self.assertTrue(torch.equal(accompaniment, torch.full((2, 10), 6.)))
+        bass, = select(sources, SOURCES, ["bass"])
+        self.assertTrue(torch.equal(bass, sources[1]))
+
+    def test_select_inplace(self):
+        sources = torch.stack([
+            torch.full((2, 10), float(i + 1)) for i in range(len(SOURCES))
+        ])
+
+        # summed in the buffer of drums, which isn't written by itself
+        vocals, accompaniment = select(
+            sources, SOURCES, TWO_STEMS, inplace=True
+        )
+        self.assertEqual(
+            accompaniment.data_ptr(), sources[0].data_ptr()
+        )
+        self.assertTrue(torch.equal(accompaniment, torch.full((2, 10), 6.)))
+
+        # every other source is written, the sum goes to a new buffer
+        sources = torch.stack([
+            torch.full((2, 10), float(i + 1)) for i in range(len(SOURCES))
+        ])
+        stems = ["accompaniment", "bass", "drums", "other"]
+        accompaniment, *_ = select(sources, SOURCES, stems, inplace=True)
+        self.assertTrue(torch.equal(accompaniment, torch.full((2, 10), 6.)))
+        self.assertTrue(torch.equal(sources[0], torch.full((2, 10), 1.)))
+
+
+if __name__ == "__main__":
+    unittest.main()
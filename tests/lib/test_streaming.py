@@ -0,0 +1,273 @@
+#!/usr/bin/python3
+
+import os
+import subprocess
+import sys
+import tempfile
+import testslide
+import unittest
+import torch
+from pathlib import Path
+from scipy.io import wavfile
+from lib.demucs.demucs.model import Demucs
+from lib.demucs.demucs.utils import apply_model
+import lib.config as config
+import lib.demucs_service as demucs_service
+import lib.streaming as streaming
+
+REPO = Path(__file__).resolve().parents[2]
+
+# Separates `minutes` of synthetic audio with a pass-through model that
+# still has the shape of demucs (4 sources, 10 seconds segments) and
+# prints the peak RSS of the process in KB.
+PEAK_RSS_SCRIPT = """
+import resource, sys, torch
+import lib.streaming as streaming
+
+class PassThrough(torch.nn.Module):
+    sources = ["drums", "bass", "other", "vocals"]
+    samplerate = 44100
+    segment_length = 10 * 44100
+
+    def valid_length(self, length):
+        return length
+
+    def forward(self, mix):
+        return mix.unsqueeze(1).expand(-1, 4, -1, -1) / 4
+
+class Sink():
+    def write(self, source):
+        pass
+
+def blocks(minutes):
+    t = torch.arange(10 * 44100) / 44100
+    for _ in range(minutes * 6):
+        yield torch.stack([torch.sin(440 * t), torch.cos(440 * t)])
+
+minutes = int(sys.argv[1])
+streaming.separate_stream(
+    PassThrough(), blocks(minutes), 0., 1., [Sink() for _ in range(4)]
+)
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+# Separates a `seconds` long generated mp3 through
+# DemucsService.split_song (ffmpeg decoding, WavWriter stems) with the
+# same pass-through model and prints the peak RSS of the process in KB.
+SPLIT_SONG_PEAK_RSS_SCRIPT = """
+import resource, subprocess, sys, torch
+import lib.config as config
+import lib.demucs_service as demucs_service
+
+class PassThrough(torch.nn.Module):
+    sources = ["drums", "bass", "other", "vocals"]
+    samplerate = 44100
+    segment_length = 10 * 44100
+
+    def valid_length(self, length):
+        return length
+
+    def forward(self, mix):
+        return mix.unsqueeze(1).expand(-1, 4, -1, -1) / 4
+
+seconds = sys.argv[1]
+subprocess.run([
+    "ffmpeg", "-loglevel", "error", "-f", "lavfi",
+    "-i", f"sine=frequency=440:duration={seconds}",
+    "-ac", "2", "-ar", "44100", "-b:a", "64k", "song.mp3"
+], check=True)
+config.STREAMING_MIN_SECONDS = 0
+demucs_service.registry.get = lambda *args: PassThrough()
+demucs_service.DemucsService("demucs", "cpu").split_song("song.mp3")
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+class TestStreaming(testslide.TestCase):
+
+    def _blocks(self, wav, size):
+        for offset in range(0, wav.shape[-1], size):
+            yield wav[..., offset:offset + size]
+
+    def test_running_stats(self):
+        torch.manual_seed(0)
+        wav = torch.randn(2, 10000)
+        stats, _ = streaming.scan(self._blocks(wav, 3000))
+        ref = streaming.quantize(wav).mean(0)
+
+        self.assertAlmostEqual(stats.mean, ref.mean().item(), places=5)
+        self.assertAlmostEqual(stats.std, ref.std().item(), places=5)
+
+    def test_separate_stream_matches_apply_model(self):
+        torch.manual_seed(0)
+        model = Demucs(
+            ["drums", "bass", "other", "vocals"],
+            channels=4, depth=2, segment_length=44100
+        ).eval()
+        wav = torch.randn(2, 3 * 44100 + 1234) * 0.1
+
+        expected = apply_model(model, wav, split=True)
+
+        class Collect():
+            def __init__(self):
+                self.parts = []
+
+            def write(self, source):
+                self.parts.append(source)
+
+        writers = [Collect() for _ in model.sources]
+        written = streaming.separate_stream(
+            model, self._blocks(wav, 20000), 0., 1., writers
+        )
+
+        self.assertEqual(written, wav.shape[-1])
+        result = torch.stack([torch.cat(w.parts, -1) for w in writers])
+        self.assertTrue(torch.allclose(result, expected, atol=1e-5))
+
+    def test_separate_stream_select(self):
+        torch.manual_seed(0)
+        model = Demucs(
+            ["drums", "bass", "other", "vocals"],
+            channels=4, depth=2, segment_length=44100
+        ).eval()
+        wav = torch.randn(2, 2 * 44100) * 0.1
+
+        expected = apply_model(model, wav, split=True)
+
+        class Collect():
+            def __init__(self):
+                self.parts = []
+
+            def write(self, source):
+                self.parts.append(source)
+
+        # only the vocals and the sum of the other sources are written
+        writers = [Collect(), Collect()]
+        streaming.separate_stream(
+            model, self._blocks(wav, 20000), 0., 1., writers,
+            select=lambda sources: [sources[3], sources[:3].sum(0)]
+        )
+
+        vocals, accompaniment = [torch.cat(w.parts, -1) for w in writers]
+        self.assertTrue(torch.allclose(vocals, expected[3], atol=1e-5))
+        self.assertTrue(
+            torch.allclose(accompaniment, expected[:3].sum(0), atol=1e-5)
+        )
+
+    def test_wav_writer_partial_file(self):
+        wav = torch.rand(2, 1000) - 0.5
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "vocals.wav"
+            writer = streaming.WavWriter(path, 1000)
+            writer.write(wav[:, :400].clone())
+
+            # readable before it is complete, the rest is silence
+            samplerate, partial = wavfile.read(str(path))
+            self.assertEqual(samplerate, 44100)
+            self.assertEqual(partial.shape, (1000, 2))
+            self.assertFalse(partial[400:].any())
+
+            writer.write(wav[:, 400:].clone())
+            writer.close()
+            _, pcm = wavfile.read(str(path))
+
+        expected = (wav * 2**15).clamp_(-2**15, 2**15 - 1).short().t()
+        self.assertTrue(torch.equal(torch.from_numpy(pcm), expected))
+        self.assertTrue(torch.equal(torch.from_numpy(partial[:400]),
+                                    expected[:400]))
+
+    def test_read_blocks_window(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            track = Path(tmp) / "song.wav"
+            # every second of the track has a different constant level
+            pcm = torch.cat([
+                torch.full((44100, 2), second * 1000, dtype=torch.int16)
+                for second in range(10)
+            ])
+            wavfile.write(str(track), 44100, pcm.numpy())
+
+            wav = torch.cat(list(streaming.read_blocks(
+                track, block_seconds=1, seek_time=3, duration=2.5
+            )), -1)
+
+        self.assertEqual(wav.shape, (2, int(2.5 * 44100)))
+        self.assertAlmostEqual(wav[0, 100].item(), 3000 / 2**15, places=4)
+        self.assertAlmostEqual(wav[0, -100].item(), 5000 / 2**15, places=4)
+
+    def _peak_rss(self, minutes):
+        output = subprocess.run(
+            [sys.executable, "-c", PEAK_RSS_SCRIPT, str(minutes)],
+            cwd=REPO, check=True, capture_output=True, text=True
+        )
+        return int(output.stdout.strip())
+
+    def test_separate_stream_peak_memory_is_flat(self):
+        one_minute = self._peak_rss(1)
+        one_hour = self._peak_rss(60)
+        # a whole hour of stereo float audio takes ~600MB on its own and
+        # the four sources four times that
+        self.assertLess(one_hour - one_minute, 64 * 1024)
+
+    def test_split_song_streams_long_tracks(self):
+        # a 3 seconds track goes through the path of the long ones: decoded
+        # by ffmpeg block by block and written by WavWriter
+        self.patch_attribute(config, "STREAMING_MIN_SECONDS", 0)
+        torch.manual_seed(0)
+        model = Demucs(
+            ["drums", "bass", "other", "vocals"],
+            channels=4, depth=2, segment_length=44100
+        ).eval()
+        self.mock_callable(
+            demucs_service.registry, "get"
+        ).to_return_value(model)
+        samples = 3 * 44100 + 1234
+        cwd = os.getcwd()
+        # the service writes under separated/ of the working directory
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                pcm = (torch.rand(samples, 2) - 0.5) * 2**14
+                wavfile.write("song.wav", 44100, pcm.short().numpy())
+
+                service = demucs_service.DemucsService("demucs", "cpu")
+                seconds = service.split_song("song.wav", name="song")
+
+                folder = Path("separated/demucs/song")
+                stems = {}
+                for stem in ("drums", "bass", "other", "vocals"):
+                    path = folder / f"{stem}.wav"
+                    # the preallocated header matches what was written
+                    self.assertEqual(
+                        path.stat().st_size,
+                        streaming.WAV_HEADER_BYTES + samples * 2 * 2
+                    )
+                    stems[stem] = wavfile.read(str(path))
+            finally:
+                os.chdir(cwd)
+
+        self.assertAlmostEqual(samples / 44100, seconds, places=2)
+        for samplerate, stem_pcm in stems.values():
+            self.assertEqual(samplerate, 44100)
+            self.assertEqual(stem_pcm.shape, (samples, 2))
+            self.assertTrue(stem_pcm.any())
+
+    def _split_song_peak_rss(self, seconds):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = subprocess.run(
+                [sys.executable, "-c", SPLIT_SONG_PEAK_RSS_SCRIPT,
+                 str(seconds)],
+                cwd=tmp, check=True, capture_output=True, text=True,
+                env=dict(os.environ, PYTHONPATH=str(REPO))
+            )
+        return int(output.stdout.strip().splitlines()[-1])
+
+    def test_split_song_peak_memory_is_flat(self):
+        one_minute = self._split_song_peak_rss(60)
+        ten_minutes = self._split_song_peak_rss(600)
+        # ten minutes of stereo float audio take ~200MB on their own and
+        # the four sources four times that
+        self.assertLess(ten_minutes - one_minute, 64 * 1024)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -1,17 +1,21 @@
 #!/usr/bin/python3
 
-from sqlite3.dbapi2 import Cursor
 from typing import Iterator
+import io
+import tempfile
 import zipfile
 import testslide
 import unittest
 import pytube
 from testslide.strict_mock import StrictMock
 import lib.utils as utils
+import lib.db as db
 import pathlib
 from unittest.mock import patch
 import os
 import sqlite3
+import subprocess
+from lib.demucs.demucs.audio import AudioFile
 
 
 class FakeIterator(Iterator):
@@ -24,6 +28,35 @@ class FakeIterator(Iterator):
         return self
 
 
+class FakeStreamSource():
+    """
+    Local stand-in for the pytube streams of a video, the audio-only
+    stream "downloads" a copy of a local file
+    """
+
+    def __init__(self, audio_file: pathlib.Path):
+        self.audio_file = audio_file
+        self.filters = []
+
+    def filter(self, **filters):
+        self.filters.append(filters)
+        return self
+
+    def order_by(self, attribute):
+        return self
+
+    def desc(self):
+        return self
+
+    def first(self):
+        return self
+
+    def download(self, output_path):
+        target = pathlib.Path(output_path) / self.audio_file.name
+        target.write_bytes(self.audio_file.read_bytes())
+        return str(target)
+
+
 class TestUtils(testslide.TestCase):
 
     def __init__(self, methodName: str) -> None:
@@ -38,14 +71,10 @@ class TestUtils(testslide.TestCase):
             pathlib.Path('separated') /\
             pathlib.Path(self.fake_model) /\
             pathlib.Path(self.fake_youtube_song_mp3).name
-        self.fake_download_path = pathlib.Path("downloads") / pathlib.Path(
-            f"{self.fake_song_path.stem}.zip"
-        )
         self.fake_download_url = "ThisIsAHashBelieveMe!"
-        self.fake_download_db = pathlib.Path('models/database.db')
         self.fake_query = """
-INSERT INTO downloads (song_path, download_url, accessed)
-values (?, ?, False)"""
+INSERT INTO downloads (song_path, download_url, accessed, created_at)
+values (?, ?, False, strftime('%s', 'now'))"""
         self.fake_parameters = (self.fake_song_path, self.fake_download_url,)
 
     def test_video_to_mp3_successful(self):
@@ -87,7 +116,7 @@ values (?, ?, False)"""
         self.mock_callable(
             utils, "mp4_to_mp3"
         ).for_call(
-            self.fake_youtube_song_name
+            self.fake_youtube_song_name, 'songs'
         ).to_return_value(
             self.fake_youtube_song_mp3
         ).and_assert_called_once()
@@ -105,6 +134,46 @@ values (?, ?, False)"""
 
         self.assertRaises(Exception, utils.video_to_mp3(self.fake_url))
 
+    def test_fetch_audio(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = pathlib.Path(tmp) / "song.webm"
+            subprocess.run([
+                'ffmpeg', '-loglevel', 'error', '-f', 'lavfi',
+                '-i', 'sine=frequency=440:duration=2',
+                '-c:a', 'libopus', str(source)
+            ], check=True)
+            fake_streams = FakeStreamSource(source)
+            fake_youtube_instance = StrictMock(
+                pytube.YouTube, runtime_attrs=["streams"]
+            )
+            fake_youtube_instance.streams = fake_streams
+            self.mock_constructor(
+                pytube, "YouTube"
+            ).for_call(
+                self.fake_url
+            ).to_return_value(fake_youtube_instance)
+            songs = pathlib.Path(tmp) / "songs"
+            songs.mkdir()
+
+            filename = utils.fetch_audio(self.fake_url, output_path=songs)
+
+            self.assertEqual([{"only_audio": True}], fake_streams.filters)
+            self.assertEqual(songs / "song.webm", pathlib.Path(filename))
+            wav = AudioFile(pathlib.Path(filename)).read(
+                streams=0, samplerate=44100, channels=2
+            )
+            self.assertEqual(2, wav.shape[0])
+            self.assertAlmostEqual(2, wav.shape[1] / 44100, places=1)
+
+    def test_fetch_audio_failure(self):
+        self.mock_constructor(
+            pytube, "YouTube"
+        ).for_call(
+            self.fake_url
+        ).to_raise(pytube.exceptions.VideoUnavailable("NotARealURL"))
+
+        self.assertIsNone(utils.fetch_audio(self.fake_url))
+
     @patch('moviepy.editor.VideoFileClip', autospec=True)
     @patch('moviepy.editor.AudioFileClip', autospec=True)
     def test_mp4_to_mp3_successful(
@@ -150,309 +219,128 @@ values (?, ?, False)"""
                 self.fake_youtube_song_mp3
             )
 
-    def _fake_iter(self):
-        for dir in ["bass.wav", "voice.wav", "drums.wav", "other.wav"]:
-            tmp_dir = StrictMock(os.DirEntry, runtime_attrs=["path", "name"])
-            tmp_dir.path = dir
-            tmp_dir.name = dir
-            yield tmp_dir
-
-    def test_zip_files_successful(self):
-        fake_zipfile_manager = StrictMock(
-            zipfile.ZipFile,
-            runtime_attrs=["write"],
-            default_context_manager=True
-        )
-        fake_zipfile_manager.write = lambda x, arcname: True
-        self.mock_callable(
-            fake_zipfile_manager, 'write'
-        ).to_return_value(None).and_assert_called_exactly(4)
-        self.mock_constructor(
-            zipfile, "ZipFile"
-        ).for_call(
-            self.fake_download_path, 'w'
-        ).to_return_value(fake_zipfile_manager)
-
-        fake_zipfile_manager.__enter__ = lambda: fake_zipfile_manager
-
-        scandir_iterator = StrictMock(
-            FakeIterator,
-            default_context_manager=True,
-            runtime_attrs=["__iter__"]
-        )
-
-        fake_song_path = pathlib.Path(
-            str(self.fake_song_path).replace(".mp3", "")
-        )
-        scandir_iterator.__iter__ = self._fake_iter
-        self.mock_callable(
-            os, "scandir"
-        ).for_call(
-            fake_song_path
-        ).to_return_value(
-            scandir_iterator
-        )
-
-        download_path = utils.zip_files(
-            self.fake_model, self.fake_song_path.stem
-        )
-
-        # we want to know if we can resolve the same path we expect
-        self.assertEqual(
-            download_path.resolve(), self.fake_download_path.resolve()
-        )
-
-    def test_zip_files_failure(self):
-        fake_zipfile_manager = StrictMock(
-            zipfile.ZipFile,
-            runtime_attrs=["write"],
-            default_context_manager=True
-        )
-        fake_zipfile_manager.write = lambda x, arcname: True
-        self.mock_constructor(
-            zipfile, "ZipFile"
-        ).for_call(
-            self.fake_download_path, 'w'
-        ).to_return_value(fake_zipfile_manager)
-
-        fake_zipfile_manager.__enter__ = lambda: fake_zipfile_manager
-
-        scandir_iterator = StrictMock(
-            FakeIterator,
-            default_context_manager=True,
-            runtime_attrs=["__iter__"]
-        )
-
-        fake_song_path = pathlib.Path(
-            str(self.fake_song_path).replace(".mp3", "")
-        )
-        scandir_iterator.__iter__ = self._fake_iter
-        self.mock_callable(
-            os, "scandir"
-        ).for_call(
-            fake_song_path
-        ).to_raise(FileNotFoundError)
-        # we want to know if we can resolve the same path we expect
-        self.assertIsNone(
-            utils.zip_files(
-                self.fake_model, self.fake_song_path.stem
-            )
-        )
+    def test_stream_zip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            song_path = pathlib.Path(tmp) / "song"
+            song_path.mkdir()
+            stems = {
+                "bass.wav": os.urandom(3 * utils.ZIP_CHUNK_SIZE + 10),
+                "vocals.wav": b"",
+            }
+            for name, content in stems.items():
+                (song_path / name).write_bytes(content)
+
+            chunks = list(utils.stream_zip(song_path, "song"))
+
+        # the archive is produced while the stems are read
+        self.assertGreater(len(chunks), 3)
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+            self.assertIsNone(archive.testzip())
+            for name, content in stems.items():
+                info = archive.getinfo(f"song/{name}")
+                self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+                self.assertEqual(archive.read(info), content)
+
+    def test_stream_zip_song_not_found(self):
+        with self.assertRaises(FileNotFoundError):
+            list(utils.stream_zip(pathlib.Path("NotASong"), "NotASong"))
 
     def test_db_execute(self):
+        self.mock_callable(db.pool, "execute").for_call(
+            self.fake_query, self.fake_parameters
+        ).to_return_value([("row",)]).and_assert_called_once()
 
-        fake_db = StrictMock(
-            sqlite3.Connection, runtime_attrs=["execute", "commit"],
-            default_context_manager=True
+        self.assertEqual(
+            [("row",)],
+            utils.db_execute(self.fake_query, self.fake_parameters)
         )
-        fake_db.execute = lambda: True
-        fake_db.commit = lambda: True
-        self.mock_callable(fake_db, "execute").for_call(
-            """
-INSERT INTO downloads (song_path, download_url, accessed)
-values (?, ?, False)""",
-            (self.fake_song_path, self.fake_download_url,)
-        ).to_return_value(None).and_assert_called_once()
-        self.mock_callable(
-            fake_db, "commit"
-        ).for_call().to_return_value(None).and_assert_called_once()
-        self.mock_callable(
-            sqlite3, "connect"
-        ).for_call(
-            self.fake_download_db
-        ).to_return_value(fake_db)
-
-        with patch.object(pathlib.Path, "exists") as fake_download_db:
-            fake_download_db.return_value = True
-            utils.db_execute(
-                self.fake_query, self.fake_parameters
-            )
-
-    def test_db_exceute_no_db_file(self):
-        with patch.object(pathlib.Path, "exists") as fake_download_db:
-            fake_download_db.return_value = False
-            with self.assertRaises(FileNotFoundError):
-                utils.db_execute(
-                    self.fake_query, self.fake_parameters
-                )
 
     def test_db_exceute_failed_to_execute(self):
+        self.mock_callable(db.pool, "execute").for_call(
+            self.fake_query, self.fake_parameters
+        ).to_raise(sqlite3.OperationalError).and_assert_called_once()
 
-        fake_db = StrictMock(
-            sqlite3.Connection, runtime_attrs=["execute"],
-            default_context_manager=True
-        )
-        fake_db.execute = lambda: True
-        self.mock_callable(fake_db, "execute").for_call(
-            """
-INSERT INTO downloads (song_path, download_url, accessed)
-values (?, ?, False)""",
-            (self.fake_song_path, self.fake_download_url,)
-        ).to_raise(Exception).and_assert_called_once()
-        self.mock_callable(
-            sqlite3, "connect"
-        ).for_call(
-            self.fake_download_db
-        ).to_return_value(fake_db)
-
-        with patch.object(pathlib.Path, "exists") as fake_download_db:
-            fake_download_db.return_value = True
-            with self.assertRaises(Exception):
-                utils.db_execute(
-                    self.fake_query, self.fake_parameters
-                )
-
-    def test_db_exceute_failed_to_commit(self):
-
-        fake_db = StrictMock(
-            sqlite3.Connection, runtime_attrs=["execute", "commit"],
-            default_context_manager=True
-        )
-        fake_db.execute = lambda: True
-        fake_db.commit = lambda: True
-        self.mock_callable(fake_db, "execute").for_call(
-            """
-INSERT INTO downloads (song_path, download_url, accessed)
-values (?, ?, False)""",
-            (self.fake_song_path, self.fake_download_url,)
-        ).to_return_value(None).and_assert_called_once()
-        self.mock_callable(
-            fake_db, "commit"
-        ).for_call().to_raise(
-            Exception
-        ).and_assert_called_once()
-        self.mock_callable(
-            sqlite3, "connect"
-        ).for_call(
-            self.fake_download_db
-        ).to_return_value(fake_db)
-
-        with patch.object(pathlib.Path, "exists") as fake_download_db:
-            fake_download_db.return_value = True
-            with self.assertRaises(Exception):
-                utils.db_execute(
-                    self.fake_query, self.fake_parameters
-                )
+        with self.assertRaises(sqlite3.OperationalError):
+            utils.db_execute(self.fake_query, self.fake_parameters)
 
     def test_create_new_download_successful(self):
         self.mock_callable(utils, "db_execute").for_call(
             """
-INSERT INTO downloads (song_path, download_url, accessed)
-values (?, ?, False)""",
-            (self.fake_song_path, self.fake_download_url,)
-        ).to_return_value(None).and_assert_called_once()
+INSERT INTO downloads (
+    song_path, download_url, accessed, created_at, song_name
+)
+values (?, ?, False, strftime('%s', 'now'), ?)""",
+            (self.fake_song_path, self.fake_download_url, "song1",)
+        ).to_return_value([]).and_assert_called_once()
 
         with patch.object(pathlib.Path, "exists") as fake_download_db:
             fake_download_db.return_value = True
             utils.create_new_download(
-                self.fake_song_path, self.fake_download_url
+                self.fake_song_path, self.fake_download_url, "song1"
             )
 
-    def test_disable_download_successful(self):
+    def test_get_download_link_db_error(self):
+        self.mock_callable(utils, "create_new_download").to_raise(
+            sqlite3.OperationalError("database is locked")
+        ).and_assert_called_once()
+
+        with self.assertRaises(sqlite3.OperationalError):
+            utils.get_download_link("song-0f3a", "demucs", "song")
+
+    def test_claim_download_successful(self):
+        fake_song = 'path/to/song1-0f3a'
         self.mock_callable(utils, "db_execute").for_call(
             """
 UPDATE downloads SET accessed = True
-WHERE download_url = ? AND accessed = False""",
+WHERE download_url = ? AND accessed = False
+RETURNING song_path, song_name""",
             (self.fake_download_url,)
-        ).to_return_value(None).and_assert_called_once()
+        ).to_return_value([(fake_song, "song1")]).and_assert_called_once()
 
-        with patch.object(pathlib.Path, "exists") as fake_download_db:
-            fake_download_db.return_value = True
-            utils.disable_download(
-                self.fake_download_url
-            )
+        self.assertEqual(
+            (pathlib.Path(fake_song), "song1"),
+            utils.claim_download(self.fake_download_url)
+        )
 
-    def test_get_download_file_successful(self):
+    def test_claim_download_without_song_name(self):
+        # tokens created before the song name was stored
         fake_song = 'path/to/song1'
-        fake_cursor = StrictMock(Cursor, runtime_attrs=["fetchone"])
-        fake_cursor.fetchone = lambda: [(fake_song)]
-
         self.mock_callable(utils, "db_execute").for_call(
             """
-"SELECT song_path \
-FROM downloads \
-WHERE download_url=? AND accessed=False""",
+UPDATE downloads SET accessed = True
+WHERE download_url = ? AND accessed = False
+RETURNING song_path, song_name""",
             (self.fake_download_url,)
-        ).to_return_value(fake_cursor).and_assert_called_once()
+        ).to_return_value([(fake_song, None)]).and_assert_called_once()
 
-        with patch.object(pathlib.Path, "exists") as fake_download_db:
-            fake_download_db.return_value = True
-            self.assertEqual(
-                pathlib.Path(fake_song),
-                utils.get_download_file(self.fake_download_url)
-            )
-
-    def test_get_download_file_not_found(self):
-        fake_cursor = StrictMock(Cursor, runtime_attrs=["fetchone"])
-        fake_cursor.fetchone = lambda: []
+        self.assertEqual(
+            (pathlib.Path(fake_song), "song1"),
+            utils.claim_download(self.fake_download_url)
+        )
 
+    def test_claim_download_already_claimed(self):
         self.mock_callable(utils, "db_execute").for_call(
             """
-"SELECT song_path \
-FROM downloads \
-WHERE download_url=? AND accessed=False""",
+UPDATE downloads SET accessed = True
+WHERE download_url = ? AND accessed = False
+RETURNING song_path, song_name""",
             (self.fake_download_url,)
-        ).to_return_value(fake_cursor).and_assert_called_once()
+        ).to_return_value([]).and_assert_called_once()
 
-        with patch.object(pathlib.Path, "exists") as fake_download_db:
-            fake_download_db.return_value = True
-            self.assertIsNone(
-                utils.get_download_file(self.fake_download_url)
-            )
+        self.assertIsNone(utils.claim_download(self.fake_download_url))
 
-    def test_get_download_file_exception(self):
-        fake_cursor = StrictMock(Cursor, runtime_attrs=["fetchone"])
-        fake_cursor.fetchone = lambda: []
-
-        self.mock_callable(utils, "db_execute").for_call(
-            """
-"SELECT song_path \
-FROM downloads \
-WHERE download_url=? AND accessed=False""",
-            (self.fake_download_url,)
-        ).to_raise(FileNotFoundError).and_assert_called_once()
+    def test_parse_time(self):
+        self.assertEqual(0, utils.parse_time("00:00:00"))
+        self.assertEqual(3723.5, utils.parse_time("01:02:03.500000"))
 
-        with patch.object(pathlib.Path, "exists") as fake_download_db:
-            fake_download_db.return_value = True
-            self.assertIsNone(
-                utils.get_download_file(self.fake_download_url)
-            )
+    def test_trim_window(self):
+        self.assertEqual(
+            (90.0, 30.0), utils.trim_window("00:01:30", "00:02:00")
+        )
 
-    def test_remove_download_file_successful(self):
-        # tried to use compound with but pylance complained
-        with patch.object(pathlib.Path, "exists") as fake_exists:
-            with patch.object(
-                pathlib.Path, "unlink"
-            ) as fake_unlink:
-                fake_exists.return_value = True
-                fake_unlink.return_value = True
-                self.assertIsNone(
-                    utils.remove_download_file(self.fake_download_path)
-                )
-                fake_unlink.assert_called_once()
-
-    def test_remove_download_file_failed(self):
-        with patch.object(
-            pathlib.Path, "unlink"
-        ) as fake_unlink:
-            fake_unlink.return_value = True
-            self.assertIsNone(
-                utils.remove_download_file(None)
-            )
-            fake_unlink.assert_not_called()
-
-    def test_remove_download_file_not_found(self):
-        # tried to use compound with but pylance complained
-        with patch.object(pathlib.Path, "exists") as fake_exists:
-            with patch.object(
-                pathlib.Path, "unlink"
-            ) as fake_unlink:
-                fake_exists.return_value = True
-                fake_unlink.side_effect = FileNotFoundError()
-                with self.assertRaises(FileNotFoundError):
-                    self.assertIsNone(
-                        utils.remove_download_file(self.fake_download_path)
-                    )
+    def test_trim_window_end_before_start(self):
+        with self.assertRaises(ValueError):
+            utils.trim_window("00:02:00", "00:01:30")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,312 @@
+#!/usr/bin/python3
+
+import graphene
+import testslide
+import unittest
+from unittest import mock
+import lib.config as config
+import lib.pipeline as pipeline
+from pathlib import Path
+from lib.catalog import catalog
+from lib.estimator import cost_model
+from lib.jobs import Job, JobQueueFull, jobs
+from models.api import DemucsServiceAPI
+
+
+class TestDemucsServiceAPI(testslide.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.schema = graphene.Schema(query=DemucsServiceAPI)
+        self.fake_job = Job("split")
+
+    def test_split_returns_job_id(self):
+        self.mock_callable(
+            jobs, "submit"
+        ).for_call(
+            "split", pipeline.split, "songs/song.mp3", "demucs", "cpu",
+            None, None, "wav", None, None, "standard",
+            profile=False, paths=["songs/song.mp3"]
+        ).to_return_value(self.fake_job).and_assert_called_once()
+
+        result = self.schema.execute('{ split(song: "songs/song.mp3") }')
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data["split"], self.fake_job.id)
+
+    def test_split_from_url_queue_full(self):
+        self.mock_callable(
+            jobs, "submit"
+        ).to_raise(JobQueueFull("Full")).and_assert_called_once()
+
+        result = self.schema.execute(
+            '{ splitFromUrl(url: "https://youtu.be/NotARealURL") }'
+        )
+        self.assertEqual(
+            result.data["splitFromUrl"], "Unable to queue the split: Full"
+        )
+
+    def test_split_output_format(self):
+        self.mock_callable(
+            jobs, "submit"
+        ).for_call(
+            "split", pipeline.split, "songs/song.mp3", "demucs", "cpu",
+            None, None, "mp3", 192, None, "standard",
+            profile=False, paths=["songs/song.mp3"]
+        ).to_return_value(self.fake_job).and_assert_called_once()
+
+        result = self.schema.execute(
+            '{ split(song: "songs/song.mp3", outputFormat: "mp3",'
+            ' bitrate: 192) }'
+        )
+        self.assertEqual(result.data["split"], self.fake_job.id)
+
+    def test_split_two_stems(self):
+        self.mock_callable(
+            jobs, "submit"
+        ).for_call(
+            "split", pipeline.split, "songs/song.mp3", "demucs", "cpu",
+            None, None, "wav", None, ["vocals", "accompaniment"], "standard",
+            profile=False, paths=["songs/song.mp3"]
+        ).to_return_value(self.fake_job).and_assert_called_once()
+
+        result = self.schema.execute(
+            '{ split(song: "songs/song.mp3", twoStems: true) }'
+        )
+        self.assertEqual(result.data["split"], self.fake_job.id)
+
+    def test_split_stems(self):
+        self.mock_callable(
+            jobs, "submit"
+        ).for_call(
+            "split_from_url", pipeline.split_from_url,
+            "https://youtu.be/NotARealURL", "demucs", "cpu",
+            None, None, "wav", None, ["drums", "vocals"], "standard",
+            profile=False
+        ).to_return_value(self.fake_job).and_assert_called_once()
+
+        result = self.schema.execute(
+            '{ splitFromUrl(url: "https://youtu.be/NotARealURL",'
+            ' stems: ["vocals", "drums"]) }'
+        )
+        self.assertEqual(result.data["splitFromUrl"], self.fake_job.id)
+
+    def test_split_unsupported_stems(self):
+        self.mock_callable(jobs, "submit").and_assert_not_called()
+
+        for arguments in ('stems: ["guitar"]',
+                          'stems: ["vocals"], twoStems: true'):
+            result = self.schema.execute(
+                '{ split(song: "songs/song.mp3", %s) }' % arguments
+            )
+            self.assertTrue(
+                result.data["split"].startswith("Unable to queue the split")
+            )
+
+    def test_split_preset(self):
+        self.mock_callable(
+            jobs, "submit"
+        ).for_call(
+            "split", pipeline.split, "songs/song.mp3", "demucs", "cpu",
+            None, None, "wav", None, None, "high_quality",
+            profile=False, paths=["songs/song.mp3"]
+        ).to_return_value(self.fake_job).and_assert_called_once()
+
+        result = self.schema.execute(
+            '{ split(song: "songs/song.mp3", preset: "high_quality") }'
+        )
+        self.assertEqual(result.data["split"], self.fake_job.id)
+
+        result = self.schema.execute(
+            '{ split(song: "songs/song.mp3", preset: "best") }'
+        )
+        self.assertTrue(
+            result.data["split"].startswith("Unable to queue the split")
+        )
+
+    def test_estimate_split(self):
+        self.mock_callable(jobs, "pending").to_return_value(3)
+        self.mock_callable(
+            cost_model, "estimate"
+        ).for_call(
+            240.0, "demucs", "cpu", "preview", 3, jobs.workers
+        ).to_return_value({
+            "audio_seconds": 240.0,
+            "cost_per_second": 0.25,
+            "measured": False,
+            "run_seconds": 60.0,
+            "queue_seconds": 120.0,
+            "total_seconds": 180.0,
+        }).and_assert_called_once()
+
+        result = self.schema.execute(
+            '{ estimateSplit(durationSeconds: 240, preset: "preview")'
+            ' { runSeconds queueSeconds totalSeconds measured } }'
+        )
+        self.assertIsNone(result.errors)
+        self.assertEqual(
+            result.data["estimateSplit"],
+            {
+                "runSeconds": 60.0,
+                "queueSeconds": 120.0,
+                "totalSeconds": 180.0,
+                "measured": False
+            }
+        )
+
+    def test_estimate_split_requires_a_length(self):
+        result = self.schema.execute('{ estimateSplit { totalSeconds } }')
+        self.assertIn("durationSeconds", result.errors[0].message)
+
+    def test_split_unsupported_output_format(self):
+        self.mock_callable(jobs, "submit").and_assert_not_called()
+
+        result = self.schema.execute(
+            '{ split(song: "songs/song.mp3", outputFormat: "ogg") }'
+        )
+        self.assertTrue(
+            result.data["split"].startswith("Unable to queue the split")
+        )
+
+    def test_music_from_video_returns_job_id(self):
+        self.mock_callable(
+            jobs, "submit"
+        ).for_call(
+            "music_from_video", pipeline.music_from_video,
+            "https://youtu.be/video"
+        ).to_return_value(self.fake_job).and_assert_called_once()
+
+        result = self.schema.execute(
+            '{ musicFromVideo(url: "https://youtu.be/video") }'
+        )
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data["musicFromVideo"], self.fake_job.id)
+
+    def test_job_result(self):
+        job = Job("music_from_video")
+        job.result = "songs/video-title.mp3"
+        self.mock_callable(
+            jobs, "get"
+        ).for_call(job.id).to_return_value(job)
+
+        result = self.schema.execute(
+            '{ job(id: "%s") { result downloadToken } }' % job.id
+        )
+        self.assertIsNone(result.errors)
+        self.assertEqual(
+            result.data["job"]["result"], "songs/video-title.mp3"
+        )
+        # the filename isn't a token /download knows
+        self.assertIsNone(result.data["job"]["downloadToken"])
+
+    def test_job_download_token(self):
+        self.fake_job.result = "token"
+        self.mock_callable(
+            jobs, "get"
+        ).for_call(self.fake_job.id).to_return_value(self.fake_job)
+
+        result = self.schema.execute(
+            '{ job(id: "%s") { result downloadToken } }' % self.fake_job.id
+        )
+        self.assertIsNone(result.errors)
+        self.assertEqual(
+            {"result": "token", "downloadToken": "token"},
+            result.data["job"]
+        )
+
+    def test_list_songs_page(self):
+        self.mock_callable(
+            catalog, "list"
+        ).for_call(
+            Path("songs"), limit=2, offset=4, prefix="a", sort_by="modified",
+            descending=True
+        ).to_return_value(
+            ["songs/a1.mp3", "songs/a2.mp3"]
+        ).and_assert_called_once()
+
+        result = self.schema.execute(
+            '{ listSongs(limit: 2, offset: 4, prefix: "a",'
+            ' sortBy: "modified", descending: true) }'
+        )
+        self.assertIsNone(result.errors)
+        self.assertEqual(
+            result.data["listSongs"], ["songs/a1.mp3", "songs/a2.mp3"]
+        )
+
+    def test_list_separated_songs(self):
+        self.mock_callable(
+            catalog, "list"
+        ).for_call(
+            Path("separated/demucs_extra"), search="live"
+        ).to_return_value(
+            ["separated/demucs_extra/Live at home"]
+        ).and_assert_called_once()
+
+        result = self.schema.execute(
+            '{ listSeparatedSongs(model: "demucs_extra", search: "live") }'
+        )
+        self.assertEqual(
+            result.data["listSeparatedSongs"],
+            ["separated/demucs_extra/Live at home"]
+        )
+
+    def _profiling(self, enabled: bool) -> None:
+        # patch_attribute deletes falsy attributes when it restores them
+        patcher = mock.patch.object(config, "PROFILING", enabled)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_split_profile_disabled(self):
+        self._profiling(False)
+        self.mock_callable(jobs, "submit").and_assert_not_called()
+
+        result = self.schema.execute(
+            '{ split(song: "songs/song.mp3", profile: true) }'
+        )
+        self.assertEqual(
+            result.data["split"],
+            "Unable to queue the split: profiling is disabled on this server"
+        )
+
+    def test_split_profile_header(self):
+        self._profiling(True)
+        self.mock_callable(
+            jobs, "submit"
+        ).for_call(
+            "split", pipeline.split, "songs/song.mp3", "demucs", "cpu",
+            None, None, "wav", None, None, "standard",
+            profile=True, paths=["songs/song.mp3"]
+        ).to_return_value(self.fake_job).and_assert_called_once()
+
+        class FakeRequest():
+            headers = {"X-Demucs-Profile": "1"}
+
+        result = self.schema.execute(
+            '{ split(song: "songs/song.mp3") }', context_value=FakeRequest()
+        )
+        self.assertEqual(result.data["split"], self.fake_job.id)
+
+    def test_job_status(self):
+        self.fake_job.result = "ThisIsAHashBelieveMe!"
+        self.mock_callable(
+            jobs, "get"
+        ).for_call(
+            self.fake_job.id
+        ).to_return_value(self.fake_job).and_assert_called_once()
+
+        result = self.schema.execute(
+            '{ job(id: "%s") { state downloadToken runSeconds } }'
+            % self.fake_job.id
+        )
+        self.assertIsNone(result.errors)
+        self.assertEqual(
+            result.data["job"],
+            {
+                "state": "queued",
+                "downloadToken": "ThisIsAHashBelieveMe!",
+                "runSeconds": None
+            }
+        )
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
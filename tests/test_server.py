@@ -1,12 +1,19 @@
 #!/usr/bin/python3
 
+import io
+import json
+import tempfile
 import testslide
+import threading
 import unittest
+from unittest import mock
+import zipfile
+import lib.config as config
 import lib.utils as utils
 from pathlib import Path
-from testslide import StrictMock
+from lib.janitor import janitor
+from lib.jobs import COMPLETED, Job, jobs
 import server
-from werkzeug.wrappers import Response
 
 
 class TestServer(testslide.TestCase):
@@ -15,7 +22,10 @@ class TestServer(testslide.TestCase):
         super(testslide.TestCase, self).__init__(*args, **kwargs)
         self.fake_token = "fakehask"
         self.not_found_token = "ThisHashDoesntExist"
-        self.file_name = "file.mp3"
+        self.song_name = "file"
+        # the folder of a split carries its id
+        self.split_folder = "file-0f3a"
+        self.stems = ["bass.wav", "drums.wav", "other.wav", "vocals.wav"]
 
     def setUp(self) -> None:
         server.app.config['TESTING'] = True
@@ -23,132 +33,124 @@ class TestServer(testslide.TestCase):
         server.app.config['DEBUG'] = False
         self.app = server.app.test_client()
         self.assertEqual(server.app.debug, False)
+        self.tmp = tempfile.TemporaryDirectory()
         super().setUp()
-        StrictMock._SETTABLE_MAGICS.append("__fspath__")
 
-    def _get_fake_path(self, file_name):
-        fake_path = StrictMock(
-            Path, runtime_attrs=["name"]
-        )
-        fake_path.name = file_name
-        return fake_path
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+        super().tearDown()
 
-    def _mock_get_download_file(self, token, fake_path):
-        self.mock_callable(
-            utils, "get_download_file"
-        ).for_call(
-            token
-        ).to_return_value(fake_path).and_assert_called_once()
-
-    def _mock_disable_download(self, fake_token):
-        self.mock_callable(
-            utils, "disable_download"
-        ).for_call(
-            fake_token
-        ).to_return_value(None).and_assert_called_once()
+    def _get_fake_song_path(self):
+        song_path = Path(self.tmp.name) / self.split_folder
+        song_path.mkdir()
+        for stem in self.stems:
+            (song_path / stem).write_bytes(stem.encode() * 1000)
+        return song_path
 
-    def _mock_remove_download_file(self, fake_path, response):
+    def _mock_claim_download(self, token, fake_path):
         self.mock_callable(
-            utils, "remove_download_file"
+            utils, "claim_download"
         ).for_call(
-            fake_path
-        ).to_return_value(response).and_assert_called_once()
-
-    def _mock_send_file(
-            self,
-            fake_path,
-            as_attachment=True,
-            attachment_filename=None,
-            mimetype='application/zip',
-            response=None
-    ):
-        self.mock_callable(
-            server, "send_file"
-        ).for_call(
-            fake_path,
-            as_attachment=as_attachment,
-            attachment_filename=attachment_filename,
-            mimetype=mimetype,
-        ).to_return_value(response).and_assert_called_once()
+            token
+        ).to_return_value(
+            fake_path and (fake_path, self.song_name)
+        ).and_assert_called_once()
 
     def test_gen_download_ok(self):
-        fake_path = self._get_fake_path(self.file_name)
-        self._mock_get_download_file(self.fake_token, fake_path)
-        self._mock_disable_download(self.fake_token)
-        self._mock_remove_download_file(fake_path, Response("File removed!"))
-        self._mock_send_file(
-            fake_path,
-            as_attachment=True,
-            attachment_filename=self.file_name,
-            mimetype='application/zip',
-            response=Response("Yes!")
-        )
+        song_path = self._get_fake_song_path()
+        self._mock_claim_download(self.fake_token, song_path)
 
         response = self.app.get(
             f"/download/{self.fake_token}", follow_redirects=True
         )
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/zip")
+        self.assertEqual(
+            response.headers["Content-Disposition"],
+            f'attachment; filename="{self.song_name}.zip"'
+        )
+        with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(
+                sorted(archive.namelist()),
+                sorted(f"{self.song_name}/{stem}" for stem in self.stems)
+            )
+            self.assertEqual(
+                archive.read(f"{self.song_name}/bass.wav"),
+                b"bass.wav" * 1000
+            )
+        # the stems are kept, only the token is claimed
+        self.assertTrue((song_path / "bass.wav").exists())
+
+    def test_gen_download_holds_the_stems(self):
+        song_path = self._get_fake_song_path()
+        self._mock_claim_download(self.fake_token, song_path)
+        held = []
+
+        def stream_zip(path, arcname):
+            held.append(janitor._in_use[path.resolve()])
+            yield b"zip"
+
+        self.mock_callable(
+            utils, "stream_zip"
+        ).with_implementation(stream_zip).and_assert_called_once()
+
+        response = self.app.get(f"/download/{self.fake_token}")
+        self.assertEqual(b"zip", response.data)
+        self.assertEqual([1], held)
+        response.close()
+        self.assertNotIn(song_path.resolve(), janitor._in_use)
 
     def test_gen_download_hash_not_found(self):
-        self._mock_get_download_file(self.not_found_token, None)
+        self._mock_claim_download(self.not_found_token, None)
 
         self.mock_callable(
-            utils, "disable_download"
+            utils, "stream_zip"
         ).and_assert_not_called()
 
-        self.mock_callable(
-            utils, "remove_download_file"
-        ).and_assert_not_called()
+        response = self.app.get(
+            f"/download/{self.not_found_token}", follow_redirects=True
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_gen_download_song_removed(self):
+        self._mock_claim_download(
+            self.fake_token, Path(self.tmp.name) / "NotASong"
+        )
 
         self.mock_callable(
-            server, "send_file"
+            utils, "stream_zip"
         ).and_assert_not_called()
 
         response = self.app.get(
-            f"/download/{self.not_found_token}", follow_redirects=True
+            f"/download/{self.fake_token}", follow_redirects=True
         )
         self.assertEqual(response.status_code, 404)
 
     def test_gen_download_internal_error(self):
-        fake_path = self._get_fake_path(self.file_name)
-        self._mock_get_download_file(self.fake_token, fake_path)
-
-        self._mock_disable_download(self.fake_token)
+        song_path = self._get_fake_song_path()
+        self._mock_claim_download(self.fake_token, song_path)
 
         self.mock_callable(
-            server, "send_file"
+            utils, "stream_zip"
         ).for_call(
-            fake_path,
-            as_attachment=True,
-            attachment_filename=self.file_name,
-            mimetype='application/zip',
+            song_path, self.song_name
         ).to_raise(Exception).and_assert_called_once()
 
-        self.mock_callable(
-            utils, "remove_download_file"
-        ).and_assert_not_called()
-
         response = self.app.get(
             f"/download/{self.fake_token}", follow_redirects=True
         )
         self.assertEqual(response.status_code, 500)
 
-    def test_gen_download_disable_download_failure(self):
-        fake_path = self._get_fake_path(self.file_name)
-        self._mock_get_download_file(self.fake_token, fake_path)
-
+    def test_gen_download_claim_download_failure(self):
         self.mock_callable(
-            utils, "disable_download"
+            utils, "claim_download"
         ).for_call(
             self.fake_token
         ).to_raise(Exception).and_assert_called_once()
 
         self.mock_callable(
-            server, "send_file"
-        ).and_assert_not_called()
-
-        self.mock_callable(
-            utils, "remove_download_file"
+            utils, "stream_zip"
         ).and_assert_not_called()
 
         response = self.app.get(
@@ -156,29 +158,113 @@ class TestServer(testslide.TestCase):
         )
         self.assertEqual(response.status_code, 500)
 
-    def test_gen_download_remove_download_failure(self):
-        fake_path = self._get_fake_path(self.file_name)
-        self._mock_get_download_file(self.fake_token, fake_path)
-        self._mock_disable_download(self.fake_token)
-
-        self._mock_send_file(
-            fake_path,
-            as_attachment=True,
-            attachment_filename=self.file_name,
-            mimetype='application/zip',
-            response=Response("Yes!")
+    def test_gen_download_limit(self):
+        slots = threading.BoundedSemaphore(1)
+        self.patch_attribute(server, "download_slots", slots)
+        song_path = self._get_fake_song_path()
+        self._mock_claim_download(self.fake_token, song_path)
+
+        slots.acquire()
+        response = self.app.get(f"/download/{self.fake_token}")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "5")
+        slots.release()
+
+        response = self.app.get(f"/download/{self.fake_token}")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(slots.acquire(blocking=False))
+        response.close()
+        self.assertTrue(slots.acquire(blocking=False))
+
+    def test_metrics(self):
+        song_path = self._get_fake_song_path()
+        self._mock_claim_download(self.fake_token, song_path)
+        sent = utils.DOWNLOAD_BYTES.value()
+
+        download = self.app.get(f"/download/{self.fake_token}")
+        response = self.app.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/plain")
+        body = response.get_data(as_text=True)
+        self.assertIn("# TYPE demucs_stage_seconds histogram", body)
+        self.assertIn('demucs_stage_seconds_count{stage="zip"}', body)
+        self.assertIn("demucs_jobs_pending 0", body)
+        self.assertIn("# TYPE demucs_model_cache_bytes gauge", body)
+        self.assertEqual(
+            sent + len(download.data), utils.DOWNLOAD_BYTES.value()
         )
 
+    def test_gen_job_events(self):
+        job = Job("split")
+        job.state = COMPLETED
+        job.result = self.fake_token
         self.mock_callable(
-            utils, "remove_download_file"
-        ).to_raise(Exception).and_assert_called()
+            jobs, "get"
+        ).for_call(job.id).to_return_value(job).and_assert_called_once()
+
+        response = self.app.get(f"/jobs/{job.id}/events")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/event-stream")
+        event, data = response.get_data(as_text=True).strip().split("\n")
+        self.assertEqual("event: progress", event)
+        snapshot = json.loads(data[len("data: "):])
+        self.assertEqual(COMPLETED, snapshot["state"])
+        self.assertEqual(self.fake_token, snapshot["download_token"])
+
+    def test_gen_job_events_limit(self):
+        slots = threading.BoundedSemaphore(1)
+        self.patch_attribute(server, "event_slots", slots)
+        job = Job("split")
+        job.state = COMPLETED
+        self.mock_callable(jobs, "get").for_call(job.id).to_return_value(job)
+
+        slots.acquire()
+        response = self.app.get(f"/jobs/{job.id}/events")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "5")
+        slots.release()
+
+        response = self.app.get(f"/jobs/{job.id}/events")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(slots.acquire(blocking=False))
+        response.close()
+        self.assertTrue(slots.acquire(blocking=False))
+
+    def test_gen_job_events_unknown_job(self):
+        response = self.app.get("/jobs/NotARealJob/events")
+        self.assertEqual(response.status_code, 404)
+
+    def _profiling(self, enabled: bool) -> None:
+        # patch_attribute deletes falsy attributes when it restores them
+        patcher = mock.patch.object(config, "PROFILING", enabled)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_gen_profile(self):
+        self._profiling(True)
+        self.patch_attribute(config, "PROFILES_DIR", self.tmp.name)
+        job_id = "0123456789abcdef0123456789abcdef"
+        (Path(self.tmp.name) / job_id).mkdir()
+        (Path(self.tmp.name) / job_id / "profile.txt").write_text("calls")
+
+        response = self.app.get(f"/profiles/{job_id}/profile.txt")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b"calls")
+        response.close()
+
+        response = self.app.get(f"/profiles/{job_id}/trace.json")
+        self.assertEqual(response.status_code, 404)
+        response = self.app.get(f"/profiles/{job_id}/database.db")
+        self.assertEqual(response.status_code, 404)
+
+    def test_gen_profile_disabled(self):
+        self._profiling(False)
 
         response = self.app.get(
-            f"/download/{self.fake_token}", follow_redirects=True
+            "/profiles/0123456789abcdef0123456789abcdef/profile.txt"
         )
-        # no need to fail the user request due internal error
-        # while removing a file.
-        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.status_code, 404)
 
 
 if __name__ == '__main__':
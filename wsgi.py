@@ -0,0 +1,8 @@
+#!/usr/bin/python3
+"""
+WSGI entry point of the production server:
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+"""
+
+from server import app as application  # noqa: F401